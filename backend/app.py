@@ -1,27 +1,40 @@
 # backend/app.py
 
 import logging
-from fastapi import FastAPI, Request, Depends
+from fastapi import FastAPI, Request, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
 from starlette.middleware.base import BaseHTTPMiddleware
-from typing import Dict, Any
-from passlib.context import CryptContext
+from typing import Dict, Any, Optional
 from security import get_current_user
 
 from controllers.auth import login_user
 from controllers.users import list_users
 from controllers.user import get_user, create_user, update_user, delete_user
 from controllers.models import list_models
-from controllers.generate import generate_text, clear_history
+from controllers.generate import generate_text, generate_text_stream, clear_history, dedup_stats
+from controllers.jobs import create_job, get_job, job_events, generate_via_queue, stream_via_queue
 from models import CreateUserRequest, LoginRequest, RegisterRequest, UpdateUserRequest, DeleteUserRequest
 from utils import health
+from llama_workers import worker_pool
+from scheduler import scheduler
+from prompt_cache import prompt_cache
+from model_registry import model_registry
+from async_eav import eav
+from user_cache import user_cache
+from hashing import password_hasher
+from search import web_search
+from response_cache import response_cache
+from timings import throughput
+from cpu_topology import cpu_allocator
+from jobs import job_queue
+from replicas import replica_registry, AffinityRouter
+from settings import settings
+import metrics
 
 # Поиск в интернет, можно выключить при необходимости
 SEARCH_ENABLED = True
 
-# Инициализация хеширования паролей
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -45,6 +58,60 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Запросы генерации выполняются на реплике, которой принадлежит сессия
+app.add_middleware(AffinityRouter)
+# Замеры этапов запроса (внешний слой, чтобы учесть и аутентификацию, и потоковые ответы)
+app.add_middleware(metrics.MetricsMiddleware)
+# Подсчет обращений к Redis за запрос
+metrics.instrument_redis(eav.client)
+
+
+@app.on_event("startup")
+async def startup():
+    # Реестр моделей загружается один раз, дальше — только при изменении каталога моделей
+    try:
+        await model_registry.load()
+    except Exception as e:
+        logger.error(f"Не удалось загрузить реестр моделей: {str(e)}", exc_info=True)
+    # Lua-скрипты загружаются заранее; вторичные индексы EAV перестраиваются,
+    # только если изменился список индексируемых атрибутов
+    try:
+        await eav.scripts.load()
+        if await eav.rebuild_index():
+            logger.info(f"Индексы EAV перестроены: {sorted(eav.indexed_attributes)}")
+    except Exception as e:
+        logger.error(f"Не удалось перестроить индексы EAV: {str(e)}", exc_info=True)
+    # Подписка на инвалидации кэша пользователей
+    user_cache.start()
+    # Общий HTTP-клиент поиска в интернете
+    await web_search.start()
+    if not settings.api_inference:
+        # Генерацию выполняют воркеры заданий (job_worker.py), модели в процессе API не загружаются
+        return
+    # Фоновая проверка здоровья воркеров llama-server
+    worker_pool.start_monitor()
+    # Загрузка и прогрев моделей из MODEL_PRELOAD в фоне, в пределах бюджета памяти
+    preload = {}
+    for model_name in settings.model_preload:
+        model_config = await model_registry.get(model_name)
+        if model_config is None:
+            logger.warning(f"Модель {model_name} из MODEL_PRELOAD не найдена")
+        else:
+            preload[model_name] = model_config
+    worker_pool.start_preload(preload)
+    # Регистрация реплики и heartbeat для маршрутизации сессий между репликами
+    if settings.replica_routing:
+        await replica_registry.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await replica_registry.stop()
+    await user_cache.stop()
+    await web_search.close()
+    await worker_pool.shutdown()
+    password_hasher.shutdown()
+    metrics.mark_process_dead()
 
 
 # Маршруты
@@ -60,9 +127,11 @@ async def users(
     field: str,
     value: str,
     request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=1000),
     # current_user: dict = Depends(get_current_user)
 ):
-    return await list_users(field, value, request)
+    return await list_users(field, value, request, cursor, limit)
 
 
 @app.get("/api/user")
@@ -124,4 +193,83 @@ async def test_generate(
     prompt: Dict[str, Any],
     current_user: dict = Depends(get_current_user)
 ):
+    if not settings.api_inference:
+        return await generate_via_queue(prompt, current_user)
     return await generate_text(prompt, current_user)
+
+
+# Потоковая генерация (SSE): токены отправляются клиенту по мере генерации
+@app.post("/api/generate/stream")
+async def generate_stream(
+    prompt: Dict[str, Any],
+    current_user: dict = Depends(get_current_user)
+):
+    if settings.api_inference:
+        events = await generate_text_stream(prompt, current_user)
+    else:
+        events = await stream_via_queue(prompt, current_user)
+    if isinstance(events, dict):
+        return events
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Асинхронные задания генерации: постановка в очередь, состояние и результат (long-poll через wait)
+# и подписка на выполнение (SSE)
+@app.post("/api/jobs")
+async def job_create(
+    prompt: Dict[str, Any],
+    current_user: dict = Depends(get_current_user)
+):
+    return await create_job(prompt, current_user)
+
+
+@app.get("/api/jobs/{job_id}")
+async def job_get(
+    job_id: str,
+    wait: float = Query(0, ge=0),
+    current_user: dict = Depends(get_current_user)
+):
+    return await get_job(job_id, wait, current_user)
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_subscribe(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    events = await job_events(job_id, current_user)
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Статистика подсистем генерации
+@app.get("/api/stats")
+async def stats(current_user: dict = Depends(get_current_user)):
+    return {
+        "scheduler": scheduler.stats(),
+        "prompt_cache": prompt_cache.stats(),
+        "user_cache": user_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "search": web_search.stats(),
+        "response_cache": response_cache.stats(),
+        "generation_dedup": dedup_stats(),
+        "throughput": await throughput.stats(),
+        "residency": worker_pool.stats(),
+        "cpu": cpu_allocator.stats(),
+        "jobs": await job_queue.stats(),
+        "replicas": replica_registry.stats()
+    }
+
+
+# Метрики Prometheus (гистограммы этапов генерации, обращения к Redis, очередь и активные генерации)
+@app.get("/api/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
@@ -1,55 +1,68 @@
 # backend/async_eav.py
 
-from typing import Dict, Any, List, Optional
+import os
+from typing import Dict, Any, List, Optional, Tuple
 import redis.asyncio as redis
 
+from redis_scripts import RedisScripts
 from settings import settings
 
 class AsyncEAVWithIndex:
-    def __init__(self, redis_url: str = settings.redis_url):
+    # Служебные ключи индексов: набор проиндексированных атрибутов и блокировка перестроения
+    INDEX_ATTRIBUTES_KEY = "index:attributes"
+    INDEX_LOCK_KEY = "index:rebuild:lock"
+
+    def __init__(self, redis_url: str = settings.redis_url, indexed_attributes: Optional[List[str]] = None):
         """
         Асинхронный клиент для работы с EAV-моделью и индексами в Redis.
 
+        Индекс атрибута — sorted set index:{атрибут}:{значение} с entity_id в качестве членов
+        (все с нулевым весом, поэтому упорядочены лексикографически и читаются постранично
+        через ZRANGEBYLEX). Составные операции с индексами выполняются Lua-скриптами:
+        атомарно и за один round-trip.
+
         :param redis_url: строка подключения к Redis
+        :param indexed_attributes: атрибуты, по которым ведутся индексы (по умолчанию из настроек)
         """
         self.client = redis.from_url(redis_url, decode_responses=True)
+        self.scripts = RedisScripts(self.client)
+        if indexed_attributes is None:
+            indexed_attributes = settings.eav_indexed_attributes
+        self.indexed_attributes = set(indexed_attributes)
 
 
-    async def create_entity(self, entity_id: str, attributes: Dict[str, Any]):
+    async def create_entity(self, entity_id: str, attributes: Dict[str, Any], ttl: Optional[int] = None):
         """
         Создать новую сущность с атрибутами.
         Если сущность уже существует — удалит старую и создаст заново.
+        Выполняется одним скриптом (DEL + HSET + EXPIRE вместе с индексами).
 
         :param entity_id: уникальный идентификатор сущности
         :param attributes: словарь атрибутов {имя: значение}
+        :param ttl: время жизни ключа в секундах (опционально), если None, то без ограничения
 
         Пример:
             await eav.create_entity("user:123", {"name": "Alice", "age": 30})
         """
-        for attr, val in attributes.items():
-            await self.set_attribute(entity_id, attr, val)
-            # print(f"entity_id {entity_id}")
-            # print(f"attr {attr}")
-            # print(f"val {val}")
-            # print(f"-----------")
-        
-        # key = f"{entity_id}"  # Используем правильный ключ с префиксом
-        # value = await self.client.hgetall(key)  # Исправлено: hgetall по ключу user:admin
+        return await self._set(entity_id, attributes, sorted(self.indexed_attributes), replace=True, ttl=ttl)
 
 
-    async def update_entity(self, entity_id: str, attributes: Dict[str, Any]):
+    async def update_entity(self, entity_id: str, attributes: Dict[str, Any], ttl: Optional[int] = None):
         """
         Обновить существующую сущность.
         Добавляет или перезаписывает переданные атрибуты, остальные остаются без изменений.
+        Все атрибуты записываются одной командой HSET.
 
         :param entity_id: уникальный идентификатор сущности
         :param attributes: словарь атрибутов {имя: значение}
+        :param ttl: время жизни ключа в секундах (опционально), если None, то не меняется
 
         Пример:
             await eav.update_entity("user:123", {"age": 31})
         """
-        for attr, val in attributes.items():
-            await self.set_attribute(entity_id, attr, val)
+        if not attributes:
+            return []
+        return await self._set(entity_id, attributes, self._indexed(attributes), ttl=ttl)
 
 
     async def set_attribute(self, entity_id: str, attribute: str, value: Any, ttl: Optional[int] = None):
@@ -68,16 +81,7 @@ class AsyncEAVWithIndex:
             # Установить атрибут с TTL 3600 секунд (1 час)
             await eav.set_attribute("user:123", "status", "active", ttl=3600)
         """
-        key = f"{entity_id}"
-        pipeline = self.client.pipeline()
-        pipeline.hset(key, attribute, value)
-
-        # Устанавливаем TTL, если он указан
-        if ttl is not None:
-            pipeline.expire(key, ttl)
-
-        data = await pipeline.execute()
-        return data
+        return await self._set(entity_id, {attribute: value}, self._indexed([attribute]), ttl=ttl)
 
 
     async def get_all_attributes(self, entity_id: str) -> Dict[str, Any]:
@@ -94,6 +98,48 @@ class AsyncEAVWithIndex:
         return await self.client.hgetall(key)
 
 
+    async def get_many(self, entity_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Получить все атрибуты нескольких сущностей за один round-trip.
+
+        :param entity_ids: список идентификаторов сущностей
+        :return: словарь {entity_id: атрибуты}; несуществующие сущности не попадают в результат
+
+        Пример:
+            users = await eav.get_many(["user:1", "user:2"])
+        """
+        if not entity_ids:
+            return {}
+        pipeline = self.client.pipeline()
+        for entity_id in entity_ids:
+            pipeline.hgetall(f"{entity_id}")
+        results = await pipeline.execute()
+        return {entity_id: attrs for entity_id, attrs in zip(entity_ids, results) if attrs}
+
+
+    async def get_attributes_many(self, entity_ids: List[str], attributes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Получить выбранные атрибуты нескольких сущностей за один round-trip.
+
+        :param entity_ids: список идентификаторов сущностей
+        :param attributes: список имён атрибутов
+        :return: словарь {entity_id: {атрибут: значение или None}}
+
+        Пример:
+            roles = await eav.get_attributes_many(["user:1", "user:2"], ["role"])
+        """
+        if not entity_ids or not attributes:
+            return {}
+        pipeline = self.client.pipeline()
+        for entity_id in entity_ids:
+            pipeline.hmget(f"{entity_id}", attributes)
+        results = await pipeline.execute()
+        return {
+            entity_id: dict(zip(attributes, values))
+            for entity_id, values in zip(entity_ids, results)
+        }
+
+
     async def get_attribute(self, entity_id: str, attribute: str) -> Any:
         """
         Получить значение одного атрибута сущности.
@@ -119,16 +165,8 @@ class AsyncEAVWithIndex:
         Пример:
             await eav.delete_attribute("user:123", "status")
         """
-        key = f"{entity_id}"
-        old_value = await self.client.hget(key, attribute)
-
-        pipeline = self.client.pipeline()
-        pipeline.hdel(key, attribute)
-
-        # if old_value is not None:
-        #     pipeline.srem(self._index_key(attribute, old_value), entity_id)
-
-        await pipeline.execute()
+        indexed = self._indexed([attribute])
+        await self.scripts.run("eav_delete_attributes", [f"{entity_id}"], [len(indexed), *indexed, attribute])
 
 
     async def delete_entity(self, entity_id: str):
@@ -140,39 +178,200 @@ class AsyncEAVWithIndex:
         Пример:
             await eav.delete_entity("user:123")
         """
-        key = f"{entity_id}"
-        attributes = await self.client.hgetall(key)
+        await self.delete_many([entity_id])
 
-        pipeline = self.client.pipeline()
-        for attr, val in attributes.items():
-            # pipeline.srem(self._index_key(attr, val), entity_id)
-            pass
 
-        pipeline.delete(key)
-        await pipeline.execute()
+    async def delete_many(self, entity_ids: List[str]) -> int:
+        """
+        Удалить несколько сущностей вместе с их индексами за один round-trip.
+
+        :param entity_ids: список идентификаторов сущностей
+        :return: число удалённых сущностей
+
+        Пример:
+            await eav.delete_many(["user:1", "user:2"])
+        """
+        if not entity_ids:
+            return 0
+        keys = [f"{entity_id}" for entity_id in entity_ids]
+        return await self.scripts.run("eav_delete", keys, sorted(self.indexed_attributes))
 
 
-    async def find_entities_by_attribute(self, attribute: str, value: Any) -> List[str]:
+    async def find_entities_by_attribute(self, attribute: str, value: Any, prefix: str = "") -> List[str]:
         """
         Найти все entity_id, у которых данный атрибут имеет указанное значение.
-        Использует индекс, работает очень быстро.
+        Использует индекс, работает очень быстро; для атрибутов без индекса — полный SCAN.
 
         :param attribute: имя атрибута
         :param value: значение атрибута
+        :param prefix: префикс entity_id (например, "user:"), пустой — все сущности
         :return: список идентификаторов сущностей
 
         Пример:
             users = await eav.find_entities_by_attribute("status", "active")
         """
-        # members = await self.client.smembers(self._index_key(attribute, value))
-        # return list(members)
-        return []
+        if attribute in self.indexed_attributes:
+            low, high = self._lex_range(prefix)
+            return await self.client.zrangebylex(self._index_key(attribute, value), low, high)
+
+        entity_ids: List[str] = []
+        cursor: Optional[int] = 0
+        while cursor is not None:
+            found, cursor = await self.scan_entities_by_attribute(attribute, value, f"{prefix}*", cursor)
+            entity_ids.extend(found)
+        return entity_ids
+
+
+    async def find_entities_page(
+        self,
+        attribute: str,
+        value: Any,
+        prefix: str = "",
+        cursor: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[str], Optional[str]]:
+        """
+        Страница entity_id из индекса атрибута: стоимость зависит от размера страницы, а не от числа ключей.
+
+        :param attribute: имя проиндексированного атрибута
+        :param value: значение атрибута
+        :param prefix: префикс entity_id (например, "user:")
+        :param cursor: последний entity_id предыдущей страницы или None для первой
+        :param limit: размер страницы
+        :return: (entity_id страницы, курсор следующей страницы или None, если это последняя)
+        :raises ValueError: если атрибут не индексируется
+
+        Пример:
+            admins, cursor = await eav.find_entities_page("role", "admin", prefix="user:", limit=50)
+        """
+        if attribute not in self.indexed_attributes:
+            raise ValueError(f"Атрибут {attribute} не индексируется")
+        low, high = self._lex_range(prefix)
+        if cursor is not None:
+            low = f"({cursor}"
+        # Берём на один элемент больше, чтобы узнать, есть ли следующая страница
+        entity_ids = await self.client.zrangebylex(self._index_key(attribute, value), low, high, start=0, num=limit + 1)
+        if len(entity_ids) > limit:
+            return entity_ids[:limit], entity_ids[limit - 1]
+        return entity_ids, None
+
+
+    async def scan_entities_by_attribute(
+        self,
+        attribute: str,
+        value: Any,
+        match: str = "*",
+        cursor: int = 0,
+        count: int = 100,
+    ) -> Tuple[List[str], Optional[int]]:
+        """
+        Одна пачка SCAN по ключам match с чтением атрибута всех ключей пачки одним pipeline.
+        Для атрибутов без индекса.
+
+        :param attribute: имя атрибута
+        :param value: значение атрибута
+        :param match: шаблон ключей сущностей
+        :param cursor: курсор SCAN (0 — с начала)
+        :param count: подсказка размера пачки для SCAN
+        :return: (найденные entity_id, курсор следующей пачки или None, если обход завершён)
+        """
+        cursor, keys = await self.client.scan(cursor=cursor, match=match, count=count, _type="hash")
+        values = await self.get_attributes_many(keys, [attribute])
+        found = [key for key in keys if values[key][attribute] == str(value)]
+        return found, (int(cursor) or None)
+
+
+    async def rebuild_index(self, force: bool = False) -> bool:
+        """
+        Перестроить индексы по всем сущностям, если изменился список индексируемых атрибутов
+        (или force=True). Перестраивает только один процесс — под блокировкой в Redis.
+
+        :param force: перестроить, даже если список атрибутов не менялся
+        :return: True, если индексы перестроены
+        """
+        configured = self.indexed_attributes
+        current = await self.client.smembers(self.INDEX_ATTRIBUTES_KEY)
+        if current == configured and not force:
+            return False
+        if not await self.client.set(self.INDEX_LOCK_KEY, os.getpid(), nx=True, ex=300):
+            return False
+        try:
+            # Удаляем старые индексы, в том числе по атрибутам, которые больше не индексируются
+            for attribute in current | configured:
+                stale = [key async for key in self.client.scan_iter(match=f"index:{attribute}:*", count=500)]
+                for i in range(0, len(stale), 500):
+                    await self.client.delete(*stale[i:i + 500])
+
+            attributes = sorted(configured)
+            if attributes:
+                keys: List[str] = []
+                async for key in self.client.scan_iter(count=500, _type="hash"):
+                    keys.append(key)
+                    if len(keys) >= 500:
+                        await self._index_batch(keys, attributes)
+                        keys = []
+                await self._index_batch(keys, attributes)
+
+            pipeline = self.client.pipeline(transaction=True)
+            pipeline.delete(self.INDEX_ATTRIBUTES_KEY)
+            if attributes:
+                pipeline.sadd(self.INDEX_ATTRIBUTES_KEY, *attributes)
+            await pipeline.execute()
+            return True
+        finally:
+            await self.client.delete(self.INDEX_LOCK_KEY)
+
+
+    async def _index_batch(self, keys: List[str], attributes: List[str]):
+        """
+        Внутренний метод: добавить пачку сущностей в индексы.
+        """
+        if not keys:
+            return
+        values = await self.get_attributes_many(keys, attributes)
+        pipeline = self.client.pipeline()
+        for entity_id, attrs in values.items():
+            for attr, value in attrs.items():
+                if value is not None:
+                    pipeline.zadd(self._index_key(attr, value), {entity_id: 0})
+        await pipeline.execute()
+
+
+    async def _set(self, entity_id: str, attributes: Dict[str, Any], indexed: List[str], replace: bool = False, ttl: Optional[int] = None):
+        """
+        Внутренний метод: записать атрибуты и обновить индексы одним скриптом.
+
+        :param indexed: индексируемые атрибуты, индексы которых нужно обновить
+        :param replace: заменить сущность целиком (атрибуты, которых нет в attributes, удаляются)
+        """
+        args: List[Any] = ["1" if replace else "0", "" if ttl is None else ttl, len(indexed), *indexed]
+        for attr, value in attributes.items():
+            args.extend((attr, value))
+        return await self.scripts.run("eav_set", [f"{entity_id}"], args)
+
+
+    def _indexed(self, attributes) -> List[str]:
+        """
+        Внутренний метод: индексируемые атрибуты из переданных.
+        """
+        return [attr for attr in attributes if attr in self.indexed_attributes]
+
 
-    # def _index_key(self, attribute: str, value: Any) -> str:
-    #     """
-    #     Внутренний метод: формирование ключа индекса по атрибуту и значению.
-    #     """
-    #     return f"index:{attribute}:{value}"
+    @staticmethod
+    def _lex_range(prefix: str) -> Tuple[str, str]:
+        """
+        Внутренний метод: границы ZRANGEBYLEX для entity_id с префиксом.
+        """
+        if not prefix:
+            return "-", "+"
+        return f"[{prefix}", f"({prefix[:-1]}{chr(ord(prefix[-1]) + 1)}"
+
+
+    def _index_key(self, attribute: str, value: Any) -> str:
+        """
+        Внутренний метод: формирование ключа индекса по атрибуту и значению.
+        """
+        return f"index:{attribute}:{value}"
 
 # Инициализация EAV
 eav = AsyncEAVWithIndex()
@@ -0,0 +1,106 @@
+# backend/benchmarks/common.py
+
+import time
+import asyncio
+from typing import Dict, Any, List, Callable, Awaitable
+
+
+def percentile(ordered: List[float], share: float) -> float:
+    """
+    Перцентиль отсортированного списка (0, если список пуст).
+    """
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def summarize(name: str, latencies: List[float], elapsed: float, errors: Dict[str, int] = None) -> Dict[str, Any]:
+    """
+    Итог серии замеров: число операций, пропускная способность и задержки (мс).
+
+    :param name: название замера
+    :param latencies: длительности операций (сек)
+    :param elapsed: общее время серии (сек)
+    :param errors: число ошибок по виду (например, HTTP-коду)
+    """
+    ordered = sorted(latencies)
+    return {
+        "name": name,
+        "count": len(ordered),
+        "errors": dict(errors or {}),
+        "throughput": len(ordered) / elapsed if elapsed else 0.0,
+        "mean_ms": sum(ordered) / len(ordered) * 1000 if ordered else 0.0,
+        "p50_ms": percentile(ordered, 0.5) * 1000,
+        "p90_ms": percentile(ordered, 0.9) * 1000,
+        "p95_ms": percentile(ordered, 0.95) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+        "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+    }
+
+
+def print_table(rows: List[Dict[str, Any]]):
+    """
+    Вывести итоги замеров таблицей.
+    """
+    header = f"{'замер':<40} {'n':>7} {'ops/s':>10} {'mean':>9} {'p50':>9} {'p90':>9} {'p95':>9} {'p99':>9} {'max':>9}  ошибки"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        errors = ", ".join(f"{kind}: {count}" for kind, count in sorted(row["errors"].items())) or "-"
+        print(
+            f"{row['name']:<40} {row['count']:>7} {row['throughput']:>10.1f} {row['mean_ms']:>9.3f} "
+            f"{row['p50_ms']:>9.3f} {row['p90_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['p99_ms']:>9.3f} {row['max_ms']:>9.3f}  {errors}"
+        )
+    print("(задержки в мс)")
+
+
+def bench(name: str, func: Callable[[], Any], iterations: int) -> Dict[str, Any]:
+    """
+    Замерить синхронную функцию iterations раз.
+    """
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(name, latencies, time.perf_counter() - started)
+
+
+async def abench(name: str, func: Callable[[], Awaitable[Any]], iterations: int) -> Dict[str, Any]:
+    """
+    Замерить асинхронную функцию iterations раз последовательно.
+    """
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        await func()
+        latencies.append(time.perf_counter() - call_started)
+    return summarize(name, latencies, time.perf_counter() - started)
+
+
+async def run_concurrent(name: str, func: Callable[[int], Awaitable[str]], requests: int, concurrency: int) -> Dict[str, Any]:
+    """
+    Выполнить requests вызовов func(i) не более чем concurrency одновременно.
+    func возвращает вид результата: "ok" или вид ошибки (HTTP-код, имя исключения).
+    """
+    latencies = []
+    errors: Dict[str, int] = {}
+    counter = iter(range(requests))
+
+    async def client():
+        for i in counter:
+            call_started = time.perf_counter()
+            try:
+                outcome = await func(i)
+            except Exception as e:
+                outcome = type(e).__name__
+            if outcome == "ok":
+                latencies.append(time.perf_counter() - call_started)
+            else:
+                errors[outcome] = errors.get(outcome, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(name, latencies, time.perf_counter() - started, errors)
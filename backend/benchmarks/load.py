@@ -0,0 +1,200 @@
+# backend/benchmarks/load.py
+
+"""
+Нагрузочный тест /api/generate, /api/user/login и /api/models с заглушкой llama.cpp
+(benchmarks/stubs): запускает API через uvicorn, создаёт тестового пользователя и выполняет
+запросы с заданной параллельностью, выводит пропускную способность и перцентили задержки.
+
+Запуск из каталога backend (нужен Redis; используйте отдельную БД — реестр моделей
+синхронизируется с каталогом заглушки):
+
+    python -m benchmarks.load [--mode server|cli] [--requests 200] [--concurrency 16] [--workers 1]
+
+Скорость заглушки задаётся переменными FAKE_LLAMA_* (см. stubs/fake_llama.py),
+параметры API — обычными переменными окружения (SCHEDULER_GLOBAL_LIMIT и т.д.).
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+from benchmarks.common import run_concurrent, print_table
+from settings import settings
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUBS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "stubs")
+USERNAME = "bench-load"
+PASSWORD = "bench-load-password"
+
+
+def prepare_environment(mode: str, redis_url: str, workers: int, workdir: str) -> dict:
+    """
+    Каталоги модели, исполняемых файлов и кэша prompt'ов для запуска API с заглушкой.
+    """
+    model_dir = os.path.join(workdir, "models")
+    bin_dir = os.path.join(workdir, "bin")
+    os.makedirs(model_dir)
+    os.makedirs(bin_dir)
+    # Пустой файл: метаданные GGUF не читаются, модель описывается значениями по умолчанию
+    open(os.path.join(model_dir, "bench.gguf"), "wb").close()
+    executables = ["llama-cli", "llama-server"] if mode == "server" else ["llama-cli"]
+    for name in executables:
+        os.symlink(os.path.join(STUBS_DIR, name), os.path.join(bin_dir, name))
+
+    env = dict(os.environ)
+    env.update({
+        "MODEL_DIR": model_dir,
+        "LLAMA_BIN_DIR": bin_dir,
+        "PROMPT_CACHE_DIR": os.path.join(workdir, "prompts"),
+        "REDIS_URL": redis_url,
+    })
+    if workers > 1:
+        env["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(workdir, "metrics")
+        os.makedirs(env["PROMETHEUS_MULTIPROC_DIR"])
+    else:
+        env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    return env
+
+
+async def wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("API завершился при запуске")
+            try:
+                if (await client.get("/api/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"API не запустился за {timeout} с")
+
+
+async def create_user(redis_url: str):
+    """
+    Создать тестового пользователя напрямую в EAV (без прав администратора).
+    """
+    from async_eav import AsyncEAVWithIndex
+    from hashing import password_hasher
+
+    eav = AsyncEAVWithIndex(redis_url)
+    try:
+        await eav.create_entity(
+            f"user:{USERNAME}",
+            {"username": USERNAME, "password": await password_hasher.hash(PASSWORD), "role": "user"},
+        )
+    finally:
+        password_hasher.shutdown()
+        await eav.client.aclose()
+
+
+async def cleanup(redis_url: str):
+    """
+    Удалить тестового пользователя, его историю и токены, а также замеры скорости заглушки.
+    """
+    from async_eav import AsyncEAVWithIndex
+    from timings import ThroughputStats
+
+    eav = AsyncEAVWithIndex(redis_url)
+    try:
+        await eav.delete_entity(f"user:{USERNAME}")
+        keys = [key async for key in eav.client.scan_iter(match=f"history:{USERNAME}:*", count=500)]
+        keys += [key async for key in eav.client.scan_iter(match="timings:bench:*", count=500)]
+        tokens = [key async for key in eav.client.scan_iter(match="token:*", count=500)]
+        owners = await eav.get_attributes_many(tokens, ["user"])
+        keys += [key for key in tokens if owners.get(key, {}).get("user") == USERNAME]
+        if keys:
+            await eav.client.delete(*keys)
+        await eav.client.srem(ThroughputStats.MODELS_KEY, "bench")
+    finally:
+        await eav.client.aclose()
+
+
+async def run_load(base_url: str, args) -> list:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=settings.generation_timeout + 30, limits=limits) as client:
+        response = await client.post("/api/user/login", json={"username": USERNAME, "password": PASSWORD})
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        # Прогрев: запуск воркера модели не входит в замеры
+        await client.post("/api/generate", json={"text": "Прогрев", "session_id": "warmup", "n_tokens": args.tokens}, headers=headers)
+
+        async def models(i: int) -> str:
+            response = await client.get("/api/models", headers=headers)
+            return "ok" if response.status_code == 200 else str(response.status_code)
+
+        async def login(i: int) -> str:
+            response = await client.post("/api/user/login", json={"username": USERNAME, "password": PASSWORD})
+            return "ok" if response.status_code == 200 else str(response.status_code)
+
+        async def generate(i: int) -> str:
+            response = await client.post(
+                "/api/generate",
+                json={"text": f"Вопрос номер {i}: как дела?", "session_id": f"load-{i % args.sessions}", "n_tokens": args.tokens},
+                headers=headers,
+            )
+            if response.status_code != 200:
+                return str(response.status_code)
+            return "error" if "error" in response.json() else "ok"
+
+        scenarios = {"models": models, "login": login, "generate": generate}
+        rows = []
+        for name in args.endpoints.split(","):
+            requests = args.requests if name != "generate" else args.generate_requests
+            rows.append(await run_concurrent(f"{name} (c={args.concurrency})", scenarios[name], requests, args.concurrency))
+        return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест API с заглушкой llama.cpp")
+    parser.add_argument("--mode", choices=["server", "cli"], default="server", help="заглушка llama-server или только llama-cli")
+    parser.add_argument("--requests", type=int, default=500, help="число запросов /api/models и /api/user/login")
+    parser.add_argument("--generate-requests", type=int, default=100, help="число запросов /api/generate")
+    parser.add_argument("--concurrency", type=int, default=16, help="одновременных клиентов")
+    parser.add_argument("--sessions", type=int, default=16, help="число сессий, по которым распределяются генерации")
+    parser.add_argument("--tokens", type=int, default=16, help="n_tokens запроса генерации")
+    parser.add_argument("--endpoints", default="models,login,generate", help="сценарии через запятую")
+    parser.add_argument("--workers", type=int, default=1, help="число процессов uvicorn")
+    parser.add_argument("--port", type=int, default=5599)
+    parser.add_argument("--verbose", action="store_true", help="показывать лог API")
+    parser.add_argument("--redis-url", default=re.sub(r"/\d*$", "/15", settings.redis_url), help="Redis (отдельная БД)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="llm-bench-")
+    env = prepare_environment(args.mode, args.redis_url, args.workers, workdir)
+    asyncio.run(create_user(args.redis_url))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=None if args.verbose else subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        asyncio.run(wait_ready(base_url, process))
+        rows = asyncio.run(run_load(base_url, args))
+        print(f"Режим: {args.mode}, процессов uvicorn: {args.workers}")
+        print_table(rows)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        asyncio.run(cleanup(args.redis_url))
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# backend/benchmarks/micro.py
+
+"""
+Микробенчмарки горячего пути запроса: оценка токенов, сборка prompt'а, извлечение ответа
+и методы EAV на локальном Redis (REDIS_URL). Запуск из каталога backend:
+
+    python -m benchmarks.micro [--iterations 2000] [--redis-url redis://localhost:6379/15]
+"""
+
+import os
+import asyncio
+import argparse
+import contextlib
+from datetime import datetime, timedelta
+
+from benchmarks.common import bench, abench, print_table
+from controllers.generate import estimate_tokens_smart, build_prompt, extract_assistant_response
+from async_eav import AsyncEAVWithIndex
+from settings import settings
+
+SHORT_TEXT = "Привет, как дела? Расскажи про погоду в Москве."
+LONG_TEXT = ("Большие языковые модели (LLM) обрабатывают текст токенами. " * 40).strip()
+CODE_TEXT = "def handler(request):\n    return {'status': 'ok', 'items': [1, 2, 3]}\n" * 20
+
+# Сколько сущностей создаётся для замеров EAV и их префикс (удаляются после замеров)
+ENTITIES = 200
+PREFIX = "bench:user:"
+
+
+def make_messages(count: int):
+    started = datetime(2025, 1, 1)
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"Сообщение номер {i}: {SHORT_TEXT}",
+            "timestamp": (started + timedelta(seconds=i)).isoformat(),
+        }
+        for i in range(count)
+    ]
+
+
+def make_raw_output(prompt_text: str, answer: str) -> str:
+    return f"user\n\n{prompt_text}\nassistant\n\n{answer}\n\n> EOF by user\n"
+
+
+def text_benchmarks(iterations: int):
+    messages = make_messages(50)
+    prompt_text = build_prompt(messages)
+    raw_output = make_raw_output(prompt_text, LONG_TEXT)
+    # extract_assistant_response печатает prompt и ответ; печать входит в замер, но не в вывод бенчмарка
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        extract = bench("extract_assistant_response", lambda: extract_assistant_response(raw_output, prompt_text), iterations)
+    return [
+        bench("estimate_tokens_smart (короткий)", lambda: estimate_tokens_smart(SHORT_TEXT), iterations),
+        bench("estimate_tokens_smart (длинный)", lambda: estimate_tokens_smart(LONG_TEXT), iterations),
+        bench("estimate_tokens_smart (код)", lambda: estimate_tokens_smart(CODE_TEXT), iterations),
+        bench("build_prompt (10 сообщений)", lambda: build_prompt(messages[:10]), iterations),
+        bench("build_prompt (50 сообщений)", lambda: build_prompt(messages), iterations),
+        extract,
+    ]
+
+
+async def eav_benchmarks(redis_url: str, iterations: int):
+    eav = AsyncEAVWithIndex(redis_url, indexed_attributes=["role"])
+    ids = [f"{PREFIX}{i}" for i in range(ENTITIES)]
+    counter = iter(range(10 ** 9))
+
+    def entity_id():
+        return ids[next(counter) % ENTITIES]
+
+    try:
+        rows = [
+            await abench(
+                "eav.create_entity",
+                lambda: eav.create_entity(entity_id(), {"username": "bench", "role": "user", "password": "x" * 60}),
+                ENTITIES,
+            ),
+            await abench("eav.get_all_attributes", lambda: eav.get_all_attributes(entity_id()), iterations),
+            await abench("eav.get_attribute", lambda: eav.get_attribute(entity_id(), "role"), iterations),
+            await abench("eav.update_entity (индекс)", lambda: eav.update_entity(entity_id(), {"role": "user"}), iterations),
+            await abench("eav.get_many (50)", lambda: eav.get_many(ids[:50]), max(1, iterations // 10)),
+            await abench(
+                "eav.find_entities_by_attribute (индекс)",
+                lambda: eav.find_entities_by_attribute("role", "user", prefix=PREFIX),
+                max(1, iterations // 10),
+            ),
+            await abench(
+                "eav.find_entities_page (50)",
+                lambda: eav.find_entities_page("role", "user", prefix=PREFIX, limit=50),
+                max(1, iterations // 10),
+            ),
+        ]
+    finally:
+        await eav.delete_many(ids)
+        await eav.client.aclose()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки backend")
+    parser.add_argument("--iterations", type=int, default=2000, help="число повторов каждого замера")
+    parser.add_argument("--redis-url", default=settings.redis_url, help="Redis для замеров EAV")
+    parser.add_argument("--skip-redis", action="store_true", help="не выполнять замеры EAV")
+    args = parser.parse_args()
+
+    rows = text_benchmarks(args.iterations)
+    if not args.skip_redis:
+        rows += asyncio.run(eav_benchmarks(args.redis_url, args.iterations))
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# backend/benchmarks/stubs/fake_llama.py
+
+"""
+Общая часть заглушек llama-cli и llama-server для бенчмарков: ответ и время работы
+моделируются по скорости реального CPU-сервера, модель не загружается.
+
+Скорость задаётся переменными окружения:
+FAKE_LLAMA_LOAD_MS (загрузка модели, мс), FAKE_LLAMA_PROMPT_TPS (prompt eval, токенов/с),
+FAKE_LLAMA_GEN_TPS (генерация одной последовательности, токенов/с), FAKE_LLAMA_MAX_TOKENS
+(максимум токенов ответа), FAKE_LLAMA_BATCH_COST (во сколько раз дороже шаг декодирования
+за каждую дополнительную последовательность в батче: 0.15 — батч из 4 идёт в 1.45 раза дольше одной).
+"""
+
+import os
+import time
+from typing import Dict, Any, List, Optional
+
+LOAD_MS = float(os.environ.get("FAKE_LLAMA_LOAD_MS", 300))
+PROMPT_TPS = float(os.environ.get("FAKE_LLAMA_PROMPT_TPS", 400))
+GEN_TPS = float(os.environ.get("FAKE_LLAMA_GEN_TPS", 40))
+MAX_TOKENS = int(os.environ.get("FAKE_LLAMA_MAX_TOKENS", 32))
+BATCH_COST = float(os.environ.get("FAKE_LLAMA_BATCH_COST", 0.15))
+
+WORDS = ["Это", " тестовый", " ответ", " заглушки", " llama", ".cpp", " для", " нагрузочного", " теста", "."]
+
+
+def count_tokens(text: str) -> int:
+    """
+    Грубая оценка числа токенов prompt'а (около 4 символов на токен).
+    """
+    return max(1, len(text) // 4)
+
+
+def answer_tokens(n_predict: int) -> List[str]:
+    """
+    Фрагменты ответа: по одному на токен.
+    """
+    n = min(n_predict if n_predict > 0 else MAX_TOKENS, MAX_TOKENS)
+    return [WORDS[i % len(WORDS)] for i in range(n)]
+
+
+def load_model():
+    time.sleep(LOAD_MS / 1000)
+
+
+def prompt_eval(prompt: str) -> Dict[str, float]:
+    """
+    Имитировать prompt eval и вернуть его замеры.
+    """
+    tokens = count_tokens(prompt)
+    ms = tokens * 1000 / PROMPT_TPS
+    time.sleep(ms / 1000)
+    return {"prompt_n": tokens, "prompt_ms": ms}
+
+
+def decode_delay(batch: int = 1) -> float:
+    """
+    Время генерации одного токена (сек), когда в батче batch последовательностей.
+    """
+    return (1 + BATCH_COST * (max(1, batch) - 1)) / GEN_TPS
+
+
+def timings(prompt: Dict[str, float], generated: int, predicted_ms: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Замеры в формате поля timings ответа llama-server; predicted_ms — измеренное время генерации
+    (по умолчанию — без батча).
+    """
+    if predicted_ms is None:
+        predicted_ms = generated * 1000 / GEN_TPS
+    return {
+        "prompt_n": prompt["prompt_n"],
+        "prompt_ms": prompt["prompt_ms"],
+        "prompt_per_second": PROMPT_TPS,
+        "predicted_n": generated,
+        "predicted_ms": predicted_ms,
+        "predicted_per_second": generated * 1000 / predicted_ms if predicted_ms else GEN_TPS,
+    }
+
+
+def perf_lines(prompt: Dict[str, float], generated: int) -> str:
+    """
+    Замеры в формате stderr llama-cli (llama_perf_context_print).
+    """
+    predicted_ms = generated * 1000 / GEN_TPS
+    return (
+        f"llama_perf_context_print:        load time = {LOAD_MS:10.2f} ms\n"
+        f"llama_perf_context_print: prompt eval time = {prompt['prompt_ms']:10.2f} ms / {prompt['prompt_n']:5d} tokens "
+        f"({prompt['prompt_ms'] / prompt['prompt_n']:8.2f} ms per token, {PROMPT_TPS:8.2f} tokens per second)\n"
+        f"llama_perf_context_print:        eval time = {predicted_ms:10.2f} ms / {generated:5d} runs   "
+        f"({1000 / GEN_TPS:8.2f} ms per token, {GEN_TPS:8.2f} tokens per second)\n"
+        f"llama_perf_context_print:       total time = {LOAD_MS + prompt['prompt_ms'] + predicted_ms:10.2f} ms / "
+        f"{prompt['prompt_n'] + generated:5d} tokens\n"
+    )
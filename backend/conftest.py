@@ -0,0 +1,14 @@
+import pytest_asyncio
+import redis.asyncio as redis
+
+
+@pytest_asyncio.fixture
+async def client():
+    """
+    Клиент Redis тестов: база 0 очищается до и после теста.
+    """
+    client = redis.from_url("redis://redis:6379/0", decode_responses=True)
+    await client.flushdb()
+    yield client
+    await client.flushdb()
+    await client.aclose()
@@ -0,0 +1,111 @@
+# backend/context_window.py
+
+from typing import Dict, Any, List, Callable, Optional
+
+from settings import settings
+
+# Заголовок краткого содержания в prompt'е и задание модели на его обновление
+SUMMARY_HEADER = "Краткое содержание предыдущей части беседы: "
+SUMMARY_INSTRUCTION = (
+    "Кратко перескажи на русском языке ключевые факты, вопросы и договоренности из беседы ниже, "
+    "не более 5 предложений. Не добавляй ничего от себя.\n"
+)
+
+
+def generation_ctx(model_config: Dict[str, Any], server: bool = True) -> Optional[int]:
+    """
+    Контекст одной генерации в токенах: слота llama-server или, для разового llama-cli, всей модели.
+
+    :param model_config: конфигурация модели
+    :param server: генерация выполняется на llama-server
+    :return: контекст или None, если он неизвестен
+    """
+    ctx = (model_config.get("slot_ctx") if server else None) or model_config.get("max_ctx")
+    return int(ctx) if ctx else None
+
+
+def context_budget(model_config: Dict[str, Any], n_tokens: int, server: bool = True) -> int:
+    """
+    Бюджет prompt'а модели в токенах: заданный для модели (context_budget) или в настройках,
+    но не больше контекста генерации (generation_ctx) за вычетом места под ответ.
+
+    :param model_config: конфигурация модели
+    :param n_tokens: максимальная длина ответа в токенах
+    :param server: генерация выполняется на llama-server
+    """
+    ctx = generation_ctx(model_config, server)
+    if ctx:
+        limit = ctx - n_tokens
+    else:
+        limit = int(model_config.get("max_tokens", 2048))
+    configured = int(model_config.get("context_budget") or settings.context_budget_tokens or 0)
+    return min(configured, limit) if configured > 0 else limit
+
+
+def select_window(
+    counts: Callable[[int], int],
+    length: int,
+    budget: int,
+    previous_start: int = 0,
+    refill_ratio: float = settings.context_refill_ratio,
+) -> Optional[int]:
+    """
+    Выбрать начало окна истории: последнее сообщение (текущий ход пользователя) входит всегда,
+    остальные добавляются от новых к старым, пока помещаются в бюджет.
+
+    Окно сдвигается скачками: пока сообщения от previous_start до конца помещаются в бюджет,
+    начало не меняется (префикс prompt'а стабилен и KV-кэш сессии переиспользуется),
+    а при переполнении окно заполняется заново только до refill_ratio бюджета.
+
+    :param counts: функция «индекс сообщения -> число токенов»
+    :param length: число сообщений
+    :param budget: бюджет на сообщения истории в токенах
+    :param previous_start: начало окна на предыдущем ходе
+    :param refill_ratio: доля бюджета, до которой заполняется окно после сдвига
+    :return: индекс первого сообщения окна или None, если не помещается даже последнее сообщение
+    """
+    if length == 0:
+        return 0
+    last = length - 1
+    total = counts(last)
+    if total > budget:
+        return None
+
+    # Прежнее окно ещё помещается — оставляем его начало
+    previous_start = min(max(previous_start, 0), last)
+    index = last
+    while index > previous_start and total + counts(index - 1) <= budget:
+        index -= 1
+        total += counts(index)
+    if index == previous_start:
+        return previous_start
+
+    # Сдвиг окна: берём свежие сообщения с запасом до следующего сдвига
+    target = max(int(budget * refill_ratio), counts(last))
+    index = last
+    total = counts(last)
+    while index > 0 and total + counts(index - 1) <= target:
+        index -= 1
+        total += counts(index)
+    return index
+
+
+def summary_line(summary: str) -> str:
+    """
+    Строка prompt'а с кратким содержанием вытесненной части беседы.
+    """
+    return f"<|system|>{SUMMARY_HEADER}{summary.strip()}\n"
+
+
+def summary_prompt(previous_summary: Optional[str], lines: List[str]) -> str:
+    """
+    Prompt обновления краткого содержания: прежнее содержание и вытесненные из окна сообщения.
+
+    :param previous_summary: текущее краткое содержание или None
+    :param lines: строки prompt'а вытесненных сообщений
+    """
+    prompt = f"<|system|>{SUMMARY_INSTRUCTION}"
+    if previous_summary:
+        prompt += summary_line(previous_summary)
+    prompt += "".join(lines)
+    return prompt.strip()
@@ -4,7 +4,8 @@ from fastapi import HTTPException
 from datetime import datetime, timedelta
 
 from async_eav import eav
-from security import pwd_context, create_access_token
+from security import create_access_token
+from hashing import password_hasher
 from models import LoginRequest
 
 from settings import settings
@@ -15,23 +16,26 @@ async def login_user(request: LoginRequest) -> dict:
     user_id = f"user:{request.username}"
     user_data = await eav.get_all_attributes(user_id)
 
-    if not user_data or not pwd_context.verify(request.password, user_data.get("password")):
+    if not user_data:
         raise HTTPException(status_code=401, detail="Неверные данные")
+    valid, new_hash = await password_hasher.verify_and_update(request.password, user_data.get("password"))
+    if not valid:
+        raise HTTPException(status_code=401, detail="Неверные данные")
+    if new_hash:
+        # Хеш сделан старой схемой или с другими параметрами — заменяем
+        await eav.set_attribute(user_id, "password", new_hash)
     
     role = user_data.get("role", "")
     if not role:
         raise HTTPException(status_code=401, detail="Нет роли")
 
     token = create_access_token({"sub": request.username, "role": role})
-    await eav.set_attribute(f"token:{token}", "user", request.username)
-    # await eav.set_attribute(
-    #     f"token:{token}",
-    #     "expires",
-    #     (datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)).isoformat()
-    # )
-    await eav.set_attribute(
+    await eav.create_entity(
         f"token:{token}",
-        "expires", (datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)).isoformat(),
+        {
+            "user": request.username,
+            "expires": (datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)).isoformat()
+        },
         ttl=ACCESS_TOKEN_EXPIRE
     )
     
@@ -3,25 +3,58 @@
 import os
 import re
 import json
-import subprocess
+import asyncio
+import weakref
 import httpx
 import logging
 from datetime import datetime
-from typing import Dict, Any, List, Optional, Union
+from typing import Dict, Any, List, Optional, Tuple, Union, AsyncIterator
+
+from fastapi import HTTPException
 
 from controllers.models import list_models
-from async_eav import eav
+from history_store import history_store, HistoryEntry
+from llama_workers import worker_pool, find_server_executable
+from scheduler import scheduler
+from search import web_search
+from response_cache import response_cache
+from timings import throughput, parse_llama_cli, from_server
+from prompt_cache import prompt_cache
+from gguf_tokenizer import get_tokenizer, GGUFTokenizer
+from context_window import context_budget, generation_ctx, select_window, summary_line, summary_prompt
+from cpu_topology import cpu_allocator, CpuLease
 from settings import settings
+from utils import SingleFlight, Broadcast
+import metrics
 
 ACCESS_TOKEN_EXPIRE = settings.access_token_expire
-# Глобальная настройка поиска
-SEARCH_ENABLED = os.getenv("SEARCH_ENABLED", "true").lower() == "true"
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
+CYRILLIC_RE = re.compile(r'[а-яА-ЯёЁ]+')
+
+# Фоновые обновления краткого содержания истории: не больше одного на сессию
+_summary_tasks: Dict[str, asyncio.Task] = {}
+# Пользователь, от имени которого служебные генерации встают в очередь планировщика
+SUMMARY_USER = "system:summary"
+
+# Одинаковые одновременные запросы генерации (повторная отправка, ретрай фронтенда)
+# присоединяются к уже выполняющемуся, а не запускают модель второй раз
+_generation_flight = SingleFlight()
+_stream_flight = SingleFlight()
+_streams: Dict[str, Broadcast] = {}
+
+# Системный prompt, с которого начинается каждый prompt модели
+SYSTEM_PROMPT = (
+    "Ты — русскоязычный помощник. Отвечай строго на русском языке, лаконично, понятно и в формате Markdown.\n"
+)
+# Размер системного prompt'а в токенах для каждого словаря: считается один раз
+_system_prompt_tokens: "weakref.WeakKeyDictionary[GGUFTokenizer, int]" = weakref.WeakKeyDictionary()
+
+
 def estimate_tokens_smart(text: Union[str, List[int]]) -> int:
     """
     Оценивает количество токенов в тексте или списке токенов.
@@ -41,8 +74,8 @@ def estimate_tokens_smart(text: Union[str, List[int]]) -> int:
     if not text:
         return 0
     
-    latin_chars = len(re.findall(r'[a-zA-Z]', text))
-    cyrillic_chars = len(re.findall(r'[а-яА-ЯёЁ]', text))
+    # Подсчет без построения списков совпадений
+    cyrillic_chars = len(text) - len(CYRILLIC_RE.sub("", text))
     total_chars = len(text)
     
     ratio = cyrillic_chars / total_chars if total_chars else 0
@@ -60,17 +93,104 @@ def build_prompt(messages: List[Dict[str, Any]]) -> str:
     Returns:
         Строковый prompt для модели.
     """
-    system_prompt = (
-        "Ты — русскоязычный помощник. Отвечай строго на русском языке, лаконично, понятно и в формате Markdown.\n"
-    )
-    prompt = system_prompt
+    prompt = SYSTEM_PROMPT
     for msg in sorted(messages, key=lambda m: m.get("timestamp", "")):
-        role = msg.get("role")
-        content = msg.get("content", "").strip()
-        prompt += f"<|{role}|>{content}\n"
+        prompt += render_message(msg)
     return prompt.strip()
 
 
+def render_message(msg: Dict[str, Any]) -> str:
+    """
+    Формирует строку prompt'а для одного сообщения.
+    
+    Args:
+        msg: Сообщение с ролью и содержимым.
+    
+    Returns:
+        Строка вида <|role|>content с переводом строки.
+    """
+    role = msg.get("role")
+    content = msg.get("content", "").strip()
+    return f"<|{role}|>{content}\n"
+
+
+async def count_tokens(model_config: Dict[str, Any], text: str) -> int:
+    """
+    Считает токены текста словарем модели; если словарь недоступен — оценка по символам.
+    
+    Args:
+        model_config: Конфигурация модели.
+        text: Текст.
+    
+    Returns:
+        Количество токенов.
+    """
+    tokenizer = await get_tokenizer(model_config)
+    if tokenizer is None:
+        return estimate_tokens_smart(text)
+    return await tokenize_count(tokenizer, text)
+
+
+async def tokenize_count(tokenizer: GGUFTokenizer, text: str, add_bos: bool = False) -> int:
+    """
+    Считает токены текста словарем модели. Токенизатор написан на Python, поэтому длинные тексты
+    (больше TOKENIZE_INLINE_CHARS символов) считаются в пуле потоков, чтобы не блокировать event loop.
+    
+    Args:
+        tokenizer: Токенизатор модели.
+        text: Текст.
+        add_bos: Учитывать токен начала последовательности.
+    
+    Returns:
+        Количество токенов.
+    """
+    if len(text) > settings.tokenize_inline_chars:
+        return await asyncio.to_thread(tokenizer.count, text, add_bos)
+    return tokenizer.count(text, add_bos=add_bos)
+
+
+async def count_header_tokens(tokenizer: Optional[GGUFTokenizer], header: str) -> int:
+    """
+    Считает токены заголовка prompt'а (системный prompt и краткое содержание) с токеном начала;
+    размер одного системного prompt'а запоминается для словаря.
+    
+    Args:
+        tokenizer: Токенизатор модели или None.
+        header: Заголовок prompt'а.
+    
+    Returns:
+        Количество токенов.
+    """
+    if tokenizer is None:
+        return estimate_tokens_smart(header)
+    if header != SYSTEM_PROMPT:
+        return await tokenize_count(tokenizer, header, add_bos=True)
+    count = _system_prompt_tokens.get(tokenizer)
+    if count is None:
+        count = _system_prompt_tokens[tokenizer] = tokenizer.count(header, add_bos=True)
+    return count
+
+
+def message_tokens(tokenizer: Optional[GGUFTokenizer], msg: Dict[str, Any], model_name: Optional[str]) -> int:
+    """
+    Возвращает число токенов строки prompt'а сообщения: сохраненный счетчик, если он посчитан
+    словарем этой модели, иначе подсчет на месте.
+    
+    Args:
+        tokenizer: Токенизатор модели или None.
+        msg: Сообщение истории.
+        model_name: Имя модели.
+    
+    Returns:
+        Количество токенов.
+    """
+    if tokenizer is None:
+        return estimate_tokens_smart(render_message(msg))
+    if msg.get("tokens_model") == model_name and "tokens" in msg:
+        return msg["tokens"]
+    return tokenizer.count(render_message(msg))
+
+
 def find_executable() -> Optional[str]:
     """
     Ищет исполняемый файл llama.cpp.
@@ -79,6 +199,7 @@ def find_executable() -> Optional[str]:
         Путь к исполняемому файлу или None, если не найден.
     """
     possible_paths = [
+        os.path.join(settings.llama_bin_dir, "llama-cli") if settings.llama_bin_dir else "",
         "/llama.cpp/build/bin/llama-cli",
         "/llama.cpp/build/llama-cli",
         "/llama.cpp/build/bin/main",
@@ -120,7 +241,13 @@ def find_executable() -> Optional[str]:
     
 #     return command
 
-def build_command(main_path: str, model_config: Dict[str, Any], prompt_text: str, params: Dict) -> List[str]:
+def build_command(
+    main_path: str,
+    model_config: Dict[str, Any],
+    prompt_text: str,
+    params: Dict,
+    lease: Optional[CpuLease] = None,
+) -> List[str]:
     """
     Формирует команду для запуска модели с максимальным использованием ресурсов.
     
@@ -129,6 +256,7 @@ def build_command(main_path: str, model_config: Dict[str, Any], prompt_text: str
         model_config: Конфигурация модели.
         prompt_text: Текст prompt'а.
         params: Параметры генерации.
+        lease: Ядра CPU, выделенные генерации (задают число потоков); None — все ядра.
     
     Returns:
         Список аргументов команды.
@@ -146,10 +274,12 @@ def build_command(main_path: str, model_config: Dict[str, Any], prompt_text: str
         "--rope-scale", "1.0",  # или больше, если нужно расширить контекст
     ]
 
-    # === CPU: используем ВСЕ ядра ===
-    import multiprocessing
-    n_threads = params.get("n_threads", multiprocessing.cpu_count())
-    command.extend(["-t", str(n_threads)])  # максимальное число потоков CPU
+    # === CPU: потоки по выделенным генерации ядрам ===
+    topology = cpu_allocator.topology
+    threads = lease.threads if lease is not None else len(topology.cores)
+    batch_threads = lease.batch_threads if lease is not None else len(topology.cpus)
+    command.extend(["-t", str(params.get("n_threads", threads))])  # decode: по потоку на физическое ядро
+    command.extend(["-tb", str(params.get("n_threads", batch_threads))])  # prompt eval: с SMT-соседями
 
     # === GPU: если доступен Vulkan/CUDA/Metal ===
     if params.get("gpu_layers", 0) > 0:
@@ -158,7 +288,7 @@ def build_command(main_path: str, model_config: Dict[str, Any], prompt_text: str
         # Пример: --gpu-split 45,45 (для двух GPU)
 
     # === Контекст: используем максимальный размер ===
-    ctx_size = params.get("ctx_size", model_config.get("max_ctx", 8192))
+    ctx_size = params.get("ctx_size", model_config.get("max_ctx", settings.max_ctx_size))
     command.extend(["-c", str(ctx_size)])
 
     # === Опциональные параметры ===
@@ -235,14 +365,83 @@ def extract_assistant_response(raw_output: str, prompt_text: str) -> str:
         return ""
 
 
-async def save_user_message(text: str, history_key: str, eav) -> None:
+async def add_token_count(message: Dict[str, Any], model_config: Dict[str, Any]) -> None:
+    """
+    Добавляет в сообщение число токенов его строки prompt'а, чтобы не токенизировать историю повторно.
+    
+    Args:
+        message: Сообщение с ролью и содержимым.
+        model_config: Конфигурация модели.
+    """
+    message["tokens"] = await count_tokens(model_config, render_message(message))
+    message["tokens_model"] = model_config.get("name")
+
+
+def invalidate_session_cache(history_key: str) -> None:
+    """
+    Сбрасывает кэш prompt'а (KV) сессии и вложенных в ключ сессий
+    и отменяет незавершенные обновления их краткого содержания.
+    
+    Args:
+        history_key: Ключ истории сессии или history:{username} для всех сессий пользователя.
+    """
+    prompt_cache.invalidate(history_key)
+    worker_pool.forget_sessions(history_key)
+    for key, task in list(_summary_tasks.items()):
+        if key == history_key or key.startswith(f"{history_key}:"):
+            task.cancel()
+
+
+def generation_key(prompt: Dict[str, Any], current_user: dict) -> str:
+    """
+    Ключ запроса генерации для объединения дубликатов: сессия, нормализованный текст и остальные параметры запроса.
+    
+    Args:
+        prompt: Словарь с запросом пользователя.
+        current_user: Данные текущего пользователя.
+    
+    Returns:
+        Строковый ключ запроса.
+    """
+    session_id = prompt.get("session_id", f"user:{current_user['username']}")
+    history_key = f"history:{current_user['username']}:{session_id}"
+    text = " ".join(re.sub(r"<\|.*?\|>", "", str(prompt.get("text", ""))).split())
+    options = {key: value for key, value in prompt.items() if key not in ("text", "session_id")}
+    return json.dumps([history_key, text, options], ensure_ascii=False, sort_keys=True, default=str)
+
+
+def dedup_stats() -> Dict[str, Any]:
+    """
+    Статистика объединения одинаковых запросов генерации.
     """
-    Сохраняет сообщение пользователя в EAV хранилище.
+    return {
+        "generate": _generation_flight.stats(),
+        "stream": {**_stream_flight.stats(), "streams": len(_streams)}
+    }
+
+
+async def save_user_message(
+    text: str,
+    history_key: str,
+    store,
+    model_config: Optional[Dict[str, Any]] = None,
+    request_id: Optional[str] = None,
+    tokens: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Сохраняет сообщение пользователя в историю сессии.
     
     Args:
         text: Текст сообщения.
         history_key: Ключ истории.
-        eav: Объект для работы с EAV хранилищем.
+        store: Хранилище истории.
+        model_config: Конфигурация модели; если задана, вместе с сообщением сохраняется число его токенов.
+        request_id: Идентификатор повторяемого запроса (задания очереди); повторная попытка
+            не добавляет сообщение ещё раз, а возвращает сохранённое ранее.
+        tokens: Уже посчитанное словарем модели число токенов строки prompt'а сообщения.
+    
+    Returns:
+        Сохраненное сообщение.
     """
     timestamp = datetime.utcnow().isoformat()
     user_message = {
@@ -250,22 +449,26 @@ async def save_user_message(text: str, history_key: str, eav) -> None:
         "content": text,
         "timestamp": timestamp
     }
-    await eav.set_attribute(
-        history_key,
-        f"message:{timestamp}",
-        json.dumps(user_message, ensure_ascii=False),
-        ttl=ACCESS_TOKEN_EXPIRE
-    )
+    if model_config is not None and tokens is not None:
+        user_message["tokens"] = tokens
+        user_message["tokens_model"] = model_config.get("name")
+    elif model_config is not None:
+        await add_token_count(user_message, model_config)
+    if request_id is not None:
+        return await store.append_once(history_key, user_message, request_id)
+    await store.append(history_key, user_message)
+    return user_message
 
 
-async def save_assistant_response(response: str, history_key: str, eav) -> None:
+async def save_assistant_response(response: str, history_key: str, store, model_config: Optional[Dict[str, Any]] = None) -> None:
     """
-    Сохраняет ответ модели в EAV хранилище.
+    Сохраняет ответ модели в историю сессии.
     
     Args:
         response: Ответ модели.
         history_key: Ключ истории.
-        eav: Объект для работы с EAV хранилищем.
+        store: Хранилище истории.
+        model_config: Конфигурация модели; если задана, вместе с ответом сохраняется число его токенов.
     """
     timestamp = datetime.utcnow().isoformat()
     assistant_message = {
@@ -273,32 +476,25 @@ async def save_assistant_response(response: str, history_key: str, eav) -> None:
         "content": response,
         "timestamp": timestamp
     }
-    await eav.set_attribute(
-        history_key,
-        f"message:{timestamp}",
-        json.dumps(assistant_message, ensure_ascii=False),
-        ttl=ACCESS_TOKEN_EXPIRE
-    )
+    if model_config is not None:
+        await add_token_count(assistant_message, model_config)
+    await store.append(history_key, assistant_message)
 
 
-async def clear_previous_assistant_messages(history_key: str, eav) -> None:
+async def clear_previous_assistant_messages(history_key: str, store) -> None:
     """
-    Удаляет предыдущие сообщения ассистента из EAV хранилища.
+    Удаляет предыдущие сообщения ассистента из истории сессии.
     
     Args:
         history_key: Ключ истории.
-        eav: Объект для работы с EAV хранилищем.
+        store: Хранилище истории.
     """
-    history_data = await eav.get_all_attributes(history_key)
-    for key, value in history_data.items():
-        msg = json.loads(value)
-        if msg.get("role") == "assistant":
-            await eav.delete_attribute(history_key, key)
+    await store.remove_role(history_key, "assistant")
 
 
 async def search_internet(query: str) -> str:
     """
-    Выполняет поиск в интернете через API DuckDuckGo.
+    Выполняет поиск в интернете (общий клиент, кэш и объединение одинаковых запросов — в search.py).
     
     Args:
         query: Поисковый запрос.
@@ -306,160 +502,493 @@ async def search_internet(query: str) -> str:
     Returns:
         Результат поиска или сообщение об ошибке.
     """
-    if not SEARCH_ENABLED:
-        logger.info("Поиск в интернете отключен")
-        return "Поиск в интернете отключен."
+    return await web_search.search(query)
+
+
+def history_prompt(entry: HistoryEntry) -> str:
+    """
+    Формирует prompt из кэшированной истории сессии без повторного рендеринга сообщений.
+    
+    Args:
+        entry: История сессии из хранилища.
+    
+    Returns:
+        Строковый prompt для модели (то же, что build_prompt по сообщениям истории).
+    """
+    return (SYSTEM_PROMPT + entry.text).strip()
+
+
+async def assemble_prompt(history_key: str, entry: HistoryEntry, model_config: Dict[str, Any], n_tokens: int) -> Optional[Tuple[str, int]]:
+    """
+    Собирает prompt, который помещается в бюджет токенов модели: системный prompt,
+    краткое содержание вытесненной части беседы (если включено) и окно последних сообщений.
+    Текущее сообщение пользователя входит всегда, более старые — пока хватает бюджета,
+    поэтому время обработки prompt'а ограничено независимо от длины сессии.
+    
+    Args:
+        history_key: Ключ истории сессии.
+        entry: История сессии из хранилища (последнее сообщение — текущий ход пользователя).
+        model_config: Конфигурация модели.
+        n_tokens: Максимальная длина ответа в токенах.
+    
+    Returns:
+        Prompt и его размер в токенах или None, если не помещается даже текущее сообщение.
+    """
+    tokenizer = await get_tokenizer(model_config)
+    model_name = model_config.get("name")
+    messages = entry.messages
+    counts: Dict[int, int] = {}
+    
+    def count(index: int) -> int:
+        if index not in counts:
+            counts[index] = message_tokens(tokenizer, messages[index], model_name)
+        return counts[index]
+    
+    header = SYSTEM_PROMPT
+    summary = None
+    if settings.context_summary_enabled and entry.window_from is not None:
+        summary = await history_store.get_summary(history_key)
+        if summary:
+            header += summary_line(summary["text"])
+    header_tokens = await count_header_tokens(tokenizer, header)
+    
+    budget = context_budget(model_config, n_tokens, find_server_executable() is not None)
+    start = select_window(count, len(messages), budget - header_tokens, entry.index_from(entry.window_from))
+    if start is None:
+        return None
+    if start > 0:
+        entry.window_from = messages[start].get("timestamp", "")
+        logger.info(f"Окно контекста {history_key}: сообщения {start}..{len(messages) - 1} из {len(messages)}")
+        if settings.context_summary_enabled:
+            schedule_summary(history_key, model_config, entry, start, summary, count)
+    else:
+        entry.window_from = None
+        if summary:
+            # Вся история поместилась в окно — краткое содержание не нужно
+            header = SYSTEM_PROMPT
+            header_tokens = await count_header_tokens(tokenizer, header)
+    
+    prompt_text = (header + entry.text[entry.offsets[start]:]).strip()
+    prompt_tokens = header_tokens + sum(count(index) for index in range(start, len(messages)))
+    return prompt_text, prompt_tokens
+
+
+def schedule_summary(history_key: str, model_config: Dict[str, Any], entry: HistoryEntry, start: int, summary: Optional[Dict[str, str]], count) -> None:
+    """
+    Запускает в фоне обновление краткого содержания, если из окна вытеснены сообщения,
+    которые в нем еще не учтены.
     
+    Args:
+        history_key: Ключ истории сессии.
+        model_config: Конфигурация модели.
+        entry: История сессии.
+        start: Индекс первого сообщения окна.
+        summary: Текущее краткое содержание или None.
+        count: Функция «индекс сообщения -> число токенов».
+    """
+    until = entry.messages[start - 1].get("timestamp", "")
+    covered = summary.get("until", "") if summary else ""
+    task = _summary_tasks.get(history_key)
+    if covered >= until or (task is not None and not task.done()):
+        return
+    
+    # Вытесненные и еще не учтенные сообщения — от новых к старым, сколько поместится в тот же бюджет
+    previous = summary["text"] if summary else None
+    budget = context_budget(model_config, settings.context_summary_tokens) - estimate_tokens_smart(summary_prompt(previous, []))
+    lines: List[str] = []
+    total = 0
+    for index in range(start - 1, -1, -1):
+        msg = entry.messages[index]
+        if msg.get("timestamp", "") <= covered or total + count(index) > budget:
+            break
+        total += count(index)
+        lines.append(render_message(msg))
+    if not lines:
+        return
+    lines.reverse()
+    
+    prompt_text = summary_prompt(previous, lines)
+    _summary_tasks[history_key] = asyncio.create_task(
+        update_summary(history_key, model_config, prompt_text, until, total)
+    )
+
+
+async def update_summary(history_key: str, model_config: Dict[str, Any], prompt_text: str, until: str, prompt_tokens: int) -> None:
+    """
+    Обновляет краткое содержание вытесненной части беседы отдельной генерацией модели.
+    Служебная генерация проходит через планировщик наравне с запросами пользователей.
+    
+    Args:
+        history_key: Ключ истории сессии.
+        model_config: Конфигурация модели.
+        prompt_text: Prompt обновления краткого содержания.
+        until: Timestamp последнего учтенного сообщения.
+        prompt_tokens: Размер prompt'а в токенах.
+    """
+    model_name = model_config.get("name")
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            response = await client.get(
-                "https://api.duckduckgo.com/",
-                params={"q": query, "format": "json", "no_html": 1}
-            )
-            data = response.json()
-            result = data.get("Abstract") or (
-                data.get("RelatedTopics", [{}])[0].get("Text", "Ничего не найдено.")
-            )
-            logger.info(f"Результат поиска: {result}")
-            return result
+        worker = await worker_pool.get_worker(model_name, model_config)
+        if worker is None:
+            # Без llama-server не строим: разовый запуск llama-cli ради краткого содержания слишком дорог
+            return
+        ticket = await scheduler.acquire(model_name, SUMMARY_USER, prompt_tokens)
+        try:
+            params = {"n_tokens": settings.context_summary_tokens, "temperature": 0.2}
+            completion = await worker.complete(prompt_text, params)
+        finally:
+            scheduler.release(ticket)
+        text = re.sub(r"<\|.*?\|>", "", completion.get("content", "")).strip()
+        if text:
+            await history_store.set_summary(history_key, text, until)
+            logger.info(f"Краткое содержание {history_key} обновлено по {until}")
+    except HTTPException:
+        logger.info(f"Обновление краткого содержания {history_key} отложено: очередь генерации занята")
+    except asyncio.CancelledError:
+        pass
     except Exception as e:
-        logger.error(f"Ошибка поиска в интернете: {str(e)}", exc_info=True)
-        return "Ошибка при попытке поиска в интернете."
+        logger.warning(f"Не удалось обновить краткое содержание {history_key}: {str(e)}")
+    finally:
+        if _summary_tasks.get(history_key) is asyncio.current_task():
+            del _summary_tasks[history_key]
 
 
-async def generate_text(prompt: Dict[str, Any], current_user: dict) -> Dict[str, Any]:
+async def prepare_generation(prompt: Dict[str, Any], current_user: dict) -> Dict[str, Any]:
     """
-    Обрабатывает запрос пользователя, вызывает модель и возвращает ответ.
+    Готовит генерацию: проверяет запрос, сохраняет сообщение пользователя и формирует prompt.
     
     Args:
-        prompt: Словарь с запросом пользователя.
+        prompt: Словарь с запросом пользователя; job_id (задаёт воркер заданий) делает сохранение
+            сообщения пользователя идемпотентным при повторных попытках задания.
         current_user: Данные текущего пользователя.
     
     Returns:
-        Словарь с ответом модели, историей и параметрами или ошибкой.
+        Контекст генерации (сессия, модель, prompt, параметры) или словарь с ошибкой.
     """
-    try:
-        # Валидация входных данных
-        if "text" not in prompt:
-            logger.error("Поле 'text' отсутствует в запросе")
-            return {"error": "Поле 'text' обязательно в запросе"}
-        
-        # Инициализация сессии
-        session_id = prompt.get("session_id", f"user:{current_user['username']}")
-        history_key = f"history:{current_user['username']}:{session_id}"
-        
-        if prompt.get("reset"):
-            await eav.delete_entity(history_key)
-            logger.info(f"История для сессии {session_id} очищена")
-        
-        # Очистка пользовательского ввода
-        text_input = re.sub(r"<\|.*?\|>", "", prompt["text"]).strip()
-        
-        # Поиск в интернете, если включен
-        if prompt.get("use_search", False):
-            internet_info = await search_internet(text_input)
-            text_input += f"\n\n<%info%>Информация из интернета: {internet_info}<%info%>"
-        
-        # Загрузка конфигурации моделей
+    # Валидация входных данных
+    if "text" not in prompt:
+        logger.error("Поле 'text' отсутствует в запросе")
+        return {"error": "Поле 'text' обязательно в запросе"}
+    
+    # Инициализация сессии
+    session_id = prompt.get("session_id", f"user:{current_user['username']}")
+    history_key = f"history:{current_user['username']}:{session_id}"
+    
+    if prompt.get("reset"):
+        await history_store.delete(history_key)
+        invalidate_session_cache(history_key)
+        logger.info(f"История для сессии {session_id} очищена")
+    
+    # Очистка пользовательского ввода
+    text_input = re.sub(r"<\|.*?\|>", "", prompt["text"]).strip()
+    
+    # Поиск в интернете, если включен
+    if prompt.get("use_search", False):
+        internet_info = await search_internet(text_input)
+        text_input += f"\n\n<%info%>Информация из интернета: {internet_info}<%info%>"
+    
+    # Загрузка конфигурации моделей
+    with metrics.stage("list_models"):
         models_config = await list_models(current_user)
-        model_name = prompt.get("model", list(models_config.keys())[0])
-        model_config = models_config.get(model_name)
-        if not model_config:
-            logger.error(f"Модель '{model_name}' не найдена")
-            return {"error": f"Модель '{model_name}' не найдена"}
-        
-        # Подсчет токенов в пользовательском вводе
-        token_count = estimate_tokens_smart(text_input)
-        max_tokens = model_config.get("max_tokens", 2048)
-        logger.info(f"Количество токенов в пользовательском вводе: {token_count}")
-        if token_count > max_tokens:
-            logger.error(f"Превышен лимит токенов: {token_count} > {max_tokens}")
-            return {"error": f"Превышен лимит токенов: {token_count} > {max_tokens}"}
-        
-        # Сохранение пользовательского сообщения
-        await save_user_message(text_input, history_key, eav)
-        
-        # Загрузка истории
-        history_data = await eav.get_all_attributes(history_key)
-        messages_raw = [
-            json.loads(value)
-            for key, value in sorted(history_data.items())
-            if key.startswith("message:")
-        ]
-        
-        # Формирование prompt'а
-        prompt_text = build_prompt(messages_raw)
-        prompt_token_count = estimate_tokens_smart(prompt_text)
-        logger.info(f"Количество токенов в полном prompt: {prompt_token_count}")
-        if prompt_token_count > max_tokens:
-            logger.error(f"Превышен лимит токенов в полном prompt: {prompt_token_count} > {max_tokens}")
-            return {"error": f"Превышен лимит токенов в полном prompt: {prompt_token_count} > {max_tokens}"}
-        
-        # Формирование параметров
-        params = {
-            "n_tokens": prompt.get("n_tokens", model_config.get("default_tokens", 512)),
-            "temperature": prompt.get("temp", model_config.get("default_temp", 0.7)),
-            "top_p": prompt.get("top_p"),
-            "top_k": prompt.get("top_k"),
-            "repeat_penalty": prompt.get("repeat_penalty"),
-            "seed": prompt.get("seed")
-        }
-        
-        # Поиск исполняемого файла
-        main_path = find_executable()
-        if not main_path:
-            logger.error("Исполняемый файл llama.cpp не найден")
-            return {"error": "Не найден исполняемый файл llama.cpp"}
-        
+    model_name = prompt.get("model", list(models_config.keys())[0])
+    model_config = models_config.get(model_name)
+    if not model_config:
+        logger.error(f"Модель '{model_name}' не найдена")
+        return {"error": f"Модель '{model_name}' не найдена"}
+    metrics.set_model(model_name)
+    
+    # Подсчет токенов в пользовательском вводе: строка prompt'а сообщения считается один раз,
+    # результат сохраняется вместе с сообщением
+    token_count = await count_tokens(model_config, render_message({"role": "user", "content": text_input}))
+    max_tokens = model_config.get("max_tokens", 2048)
+    logger.info(f"Количество токенов в пользовательском вводе: {token_count}")
+    if token_count > max_tokens:
+        logger.error(f"Превышен лимит токенов: {token_count} > {max_tokens}")
+        return {"error": f"Превышен лимит токенов: {token_count} > {max_tokens}"}
+    
+    # Формирование параметров
+    params = {
+        "n_tokens": prompt.get("n_tokens", model_config.get("default_tokens", 512)),
+        "temperature": prompt.get("temp", model_config.get("default_temp", 0.7)),
+        "top_p": prompt.get("top_p"),
+        "top_k": prompt.get("top_k"),
+        "repeat_penalty": prompt.get("repeat_penalty"),
+        "seed": prompt.get("seed")
+    }
+    ctx = generation_ctx(model_config, find_server_executable() is not None)
+    if ctx and params["n_tokens"] >= ctx:
+        logger.error(f"Длина ответа {params['n_tokens']} не меньше контекста модели {ctx}")
+        return {"error": f"Длина ответа (n_tokens={params['n_tokens']}) должна быть меньше контекста модели ({ctx} токенов)"}
+    
+    # Под перегрузкой отказ (429) — до записи в историю; допуск с выбором полосы — после сборки prompt'а.
+    # Детерминированный запрос не отклоняется заранее: ответ может оказаться в кэше
+    if not response_cache.applies(params, prompt.get("cache")):
+        scheduler.check(model_name, current_user["username"])
+    
+    # Сохранение пользовательского сообщения
+    user_message = await save_user_message(
+        text_input, history_key, history_store, model_config, prompt.get("job_id"), token_count
+    )
+    
+    # Загрузка истории (читаются только новые сообщения) и сборка prompt'а в бюджет токенов модели
+    with metrics.stage("history_load"):
+        entry = await history_store.load(history_key, render_message)
+    with metrics.stage("prompt_build"):
+        assembled = await assemble_prompt(history_key, entry, model_config, params["n_tokens"])
+    if assembled is None:
+        logger.error(f"Сообщение не помещается в контекст модели {model_name}")
+        return {"error": f"Сообщение не помещается в контекст модели {model_name}"}
+    prompt_text, prompt_token_count = assembled
+    logger.info(f"Количество токенов в prompt: {prompt_token_count}")
+    
+    context = {
+        "session_id": session_id,
+        "history_key": history_key,
+        "user_message": user_message,
+        "model": model_name,
+        "model_config": model_config,
+        "prompt_text": prompt_text,
+        "params": params,
+        "ticket": None,
+        "cache_key": None,
+        "cached_response": None,
+        "timings": None
+    }
+    
+    # Детерминированная генерация: ответ может быть в кэше, тогда модель не нужна
+    if response_cache.applies(params, prompt.get("cache")):
+        context["cache_key"] = response_cache.key(model_name, model_config, prompt_text, params)
+        context["cached_response"] = await response_cache.get(context["cache_key"])
+        if context["cached_response"] is not None:
+            logger.info(f"Ответ для сессии {session_id} взят из кэша")
+            return context
+    
+    # Допуск к генерации: ждем свободного места или получаем 429, если очередь заполнилась
+    # после проверки выше (тогда сообщение убирается из истории).
+    # Полоса очереди выбирается по размеру всего prompt'а, который будет вычисляться, а не только нового ввода
+    try:
+        context["ticket"] = await scheduler.acquire(model_name, current_user["username"], prompt_token_count)
+    except BaseException:
+        await history_store.discard(history_key, user_message)
+        raise
+    return context
+
+
+async def run_llama_cli(model_config: Dict[str, Any], prompt_text: str, params: Dict[str, Any]) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """
+    Разовый запуск llama-cli (если llama-server не собран) без блокировки event loop.
+    
+    Args:
+        model_config: Конфигурация модели.
+        prompt_text: Текст prompt'а.
+        params: Параметры генерации.
+    
+    Returns:
+        Ответ модели (или пустая строка) и замеры из stderr llama-cli (или None).
+    """
+    main_path = find_executable()
+    if not main_path:
+        raise RuntimeError("Не найден исполняемый файл llama.cpp")
+    
+    # Ядра CPU на время генерации: наборы одновременных запусков не пересекаются
+    lease = cpu_allocator.acquire(f"llama-cli:{model_config.get('name')}")
+    try:
         # Формирование и выполнение команды
-        command = build_command(main_path, model_config, prompt_text, params)
+        command = build_command(main_path, model_config, prompt_text, params, lease)
         logger.info(f"Команда запуска: {' '.join(command)}")
         
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            timeout=300
+        # Запуск процесса, загрузка модели, prompt eval и decode — одним замером
+        with metrics.stage("llama_cli", model_config.get("name")):
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            cpu_allocator.attach(lease, process.pid)
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=settings.generation_timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise
+    finally:
+        cpu_allocator.release(lease)
+    
+    stderr_text = stderr.decode("utf-8", errors="replace")
+    if process.returncode != 0:
+        logger.error(f"Ошибка выполнения команды: {stderr_text}")
+        raise RuntimeError(f"Ошибка выполнения: {stderr_text}")
+    
+    # Замеры загрузки, prompt eval и генерации из stderr
+    timings = parse_llama_cli(stderr_text)
+    await throughput.record(model_config.get("name"), timings)
+    
+    # Извлечение ответа
+    with metrics.stage("extract", model_config.get("name")):
+        return extract_assistant_response(stdout.decode("utf-8", errors="replace"), prompt_text), timings
+
+
+async def run_generation(context: Dict[str, Any]) -> str:
+    """
+    Выполняет генерацию целиком и возвращает ответ модели; замеры генерации сохраняются в context["timings"].
+    
+    Args:
+        context: Контекст генерации из prepare_generation.
+    
+    Returns:
+        Ответ модели или пустая строка.
+    """
+    # Долгоживущий воркер модели: модель уже загружена, платим только за prompt eval и decode
+    with metrics.stage("model_load", context["model"]):
+        worker = await worker_pool.get_worker(context["model"], context["model_config"])
+    if worker is None:
+        # llama-server не собран — разовый запуск llama-cli
+        response, context["timings"] = await run_llama_cli(context["model_config"], context["prompt_text"], context["params"])
+        return response
+    
+    completion = await worker.complete(context["prompt_text"], context["params"], session=context["history_key"])
+    context["timings"] = from_server(completion.get("timings"))
+    with metrics.stage("extract", context["model"]):
+        return re.sub(r"<\|.*?\|>", "", completion.get("content", "")).strip()
+
+
+async def stream_generation(context: Dict[str, Any]) -> AsyncIterator[str]:
+    """
+    Выполняет генерацию и отдает фрагменты ответа по мере их появления;
+    замеры генерации сохраняются в context["timings"] по завершении.
+    
+    Args:
+        context: Контекст генерации из prepare_generation.
+    
+    Yields:
+        Фрагменты ответа модели.
+    """
+    with metrics.stage("model_load", context["model"]):
+        worker = await worker_pool.get_worker(context["model"], context["model_config"])
+    if worker is None:
+        # llama-cli не отдает ответ отдельно от эха prompt'а — отправляем ответ одним фрагментом
+        response, context["timings"] = await run_llama_cli(context["model_config"], context["prompt_text"], context["params"])
+        yield response
+        return
+    
+    timings: Dict[str, Any] = {}
+    async for chunk in worker.stream(context["prompt_text"], context["params"], session=context["history_key"], timings=timings):
+        yield chunk
+    context["timings"] = timings or None
+
+
+async def finish_generation(context: Dict[str, Any], assistant_response: str) -> Dict[str, Any]:
+    """
+    Сохраняет ответ модели в историю (и в кэш ответов, если генерация детерминированная)
+    и формирует итоговый ответ API.
+    
+    Args:
+        context: Контекст генерации из prepare_generation.
+        assistant_response: Ответ модели.
+    
+    Returns:
+        Словарь с ответом модели, историей и параметрами.
+    """
+    history_key = context["history_key"]
+    
+    # Число токенов ответа: по замерам llama.cpp, без замеров — подсчетом
+    timings = context["timings"]
+    if timings and timings.get("generated_tokens") is not None:
+        response_token_count = timings["generated_tokens"]
+    else:
+        response_token_count = await count_tokens(context["model_config"], assistant_response)
+    logger.info(f"Количество токенов в ответе: {response_token_count}")
+    if timings:
+        logger.info(
+            f"Скорость {context['model']}: prompt {timings.get('prompt_tokens_per_second')} ток/с, "
+            f"генерация {timings.get('generation_tokens_per_second')} ток/с"
         )
+    
+    # Удаление старых сообщений ассистента — только для llama-cli. У llama-server prompt следующего хода
+    # продолжает prompt этого хода вместе с ответом, и KV-кэш сессии переиспользуется целиком;
+    # длину истории ограничивает окно контекста
+    if find_server_executable() is None:
+        await clear_previous_assistant_messages(history_key, history_store)
+    
+    # Сохранение ответа
+    await save_assistant_response(assistant_response, history_key, history_store, context["model_config"])
+    if context["cache_key"] is not None and context["cached_response"] is None:
+        await response_cache.put(context["cache_key"], assistant_response)
+    
+    metrics.GENERATIONS.labels(context["model"], cache_status(context)).inc()
+    
+    # Формирование истории
+    history = history_prompt(await history_store.load(history_key, render_message))
+    
+    return {
+        "session_id": context["session_id"],
+        "model": context["model"],
+        "history": history.strip(),
+        "response": assistant_response,
+        "parameters": context["params"],
+        "cache": cache_status(context),
+        "timings": timings
+    }
+
+
+def cache_status(context: Dict[str, Any]) -> str:
+    """
+    Состояние кэша ответов для генерации.
+    
+    Args:
+        context: Контекст генерации из prepare_generation.
+    
+    Returns:
+        hit — ответ из кэша, miss — ответ сгенерирован и сохранен в кэш, bypass — генерация не кэшируется.
+    """
+    if context["cached_response"] is not None:
+        return "hit"
+    return "miss" if context["cache_key"] is not None else "bypass"
+
+
+async def generate_text(prompt: Dict[str, Any], current_user: dict) -> Dict[str, Any]:
+    """
+    Обрабатывает запрос пользователя, вызывает модель и возвращает ответ.
+    Одинаковый запрос, уже выполняющийся для той же сессии, не запускается повторно:
+    дубликат получает тот же результат, история записывается один раз.
+    
+    Args:
+        prompt: Словарь с запросом пользователя.
+        current_user: Данные текущего пользователя.
+    
+    Returns:
+        Словарь с ответом модели, историей и параметрами или ошибкой.
+    """
+    key = generation_key(prompt, current_user)
+    if _generation_flight.in_flight(key):
+        logger.info(f"Повторный запрос генерации для пользователя {current_user['username']} присоединен к выполняющемуся")
+    return await _generation_flight.do(key, lambda: _generate(prompt, current_user))
+
+
+async def _generate(prompt: Dict[str, Any], current_user: dict) -> Dict[str, Any]:
+    """
+    Внутренний метод: подготовка, генерация и сохранение ответа.
+    """
+    try:
+        context = await prepare_generation(prompt, current_user)
+        if "error" in context:
+            return context
         
-        if result.returncode != 0:
-            logger.error(f"Ошибка выполнения команды: {result.stderr}")
-            return {"error": f"Ошибка выполнения: {result.stderr}"}
-        
-        # Извлечение ответа
-        assistant_response = extract_assistant_response(result.stdout, prompt_text)
+        if context["cached_response"] is not None:
+            assistant_response = context["cached_response"]
+        else:
+            try:
+                assistant_response = await run_generation(context)
+            finally:
+                scheduler.release(context["ticket"])
         if not assistant_response:
             logger.error("Не удалось извлечь ответ модели")
             return {"error": "Не удалось извлечь ответ модели"}
         
-        # Подсчет токенов в ответе
-        response_token_count = estimate_tokens_smart(assistant_response)
-        logger.info(f"Количество токенов в ответе: {response_token_count}")
-        
-        # Удаление старых сообщений ассистента
-        await clear_previous_assistant_messages(history_key, eav)
-        
-        # Сохранение ответа
-        await save_assistant_response(assistant_response, history_key, eav)
-        
-        # Формирование истории
-        history_data = await eav.get_all_attributes(history_key)
-        messages = [
-            json.loads(value)
-            for key, value in sorted(history_data.items())
-            if key.startswith("message:")
-        ]
-        history = build_prompt(messages)
-        
-        return {
-            "session_id": session_id,
-            "model": model_name,
-            "history": history.strip(),
-            "response": assistant_response,
-            "parameters": params
-        }
-    
-    except subprocess.TimeoutExpired:
+        return await finish_generation(context, assistant_response)
+    
+    except HTTPException:
+        raise
+    except (asyncio.TimeoutError, httpx.TimeoutException):
         logger.error("Превышено время ожидания генерации")
         return {"error": "Превышено время ожидания генерации"}
     except Exception as e:
@@ -467,6 +996,116 @@ async def generate_text(prompt: Dict[str, Any], current_user: dict) -> Dict[str,
         return {"error": f"Ошибка при генерации: {str(e)}"}
 
 
+def _sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """
+    Внутренний метод: форматирование события Server-Sent Events.
+    """
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n" if event else f"data: {payload}\n\n"
+
+
+async def generate_text_stream(prompt: Dict[str, Any], current_user: dict) -> Union[Dict[str, Any], AsyncIterator[str]]:
+    """
+    Потоковая генерация: готовит запрос и возвращает поток событий SSE.
+    Допуск к генерации проверяется до начала потока, чтобы отказ вернулся обычным ответом 429.
+    
+    Args:
+        prompt: Словарь с запросом пользователя.
+        current_user: Данные текущего пользователя.
+    
+    Returns:
+        Асинхронный итератор событий SSE или словарь с ошибкой.
+    """
+    key = generation_key(prompt, current_user)
+    stream = _streams.get(key)
+    if stream is None or stream.cancelled:
+        stream = await _stream_flight.do(key, lambda: _start_stream(key, prompt, current_user))
+        if isinstance(stream, dict):
+            return stream
+    else:
+        logger.info(f"Повторный потоковый запрос для пользователя {current_user['username']} присоединен к выполняющемуся")
+    return stream.subscribe()
+
+
+async def _start_stream(key: str, prompt: Dict[str, Any], current_user: dict) -> Union[Dict[str, Any], Broadcast]:
+    """
+    Внутренний метод: подготовка генерации и запуск потока событий, общего для одинаковых запросов.
+    Поток доступен дубликатам, пока генерация не завершится.
+    """
+    try:
+        context = await prepare_generation(prompt, current_user)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка при подготовке генерации: {str(e)}", exc_info=True)
+        return {"error": f"Ошибка при генерации: {str(e)}"}
+    if "error" in context:
+        return context
+    stream = Broadcast(stream_events(context))
+    _streams[key] = stream
+    
+    def forget(_):
+        if _streams.get(key) is stream:
+            del _streams[key]
+    
+    stream.task.add_done_callback(forget)
+    return stream
+
+
+async def stream_events(context: Dict[str, Any]) -> AsyncIterator[str]:
+    """
+    Отдает токены клиенту в формате SSE по мере их появления.
+    Итоговый ответ сохраняется в историю по завершении потока и отправляется событием 'done'.
+    
+    Args:
+        context: Контекст генерации из prepare_generation.
+    
+    Yields:
+        События SSE: data с фрагментом ответа, 'done' с итогом или 'error'.
+    """
+    finished = False
+    try:
+        chunks = []
+        if context["cached_response"] is not None:
+            # Ответ из кэша отдается одним фрагментом
+            chunks.append(context["cached_response"])
+            yield _sse_event({"token": context["cached_response"]})
+        else:
+            try:
+                async for chunk in stream_generation(context):
+                    chunks.append(chunk)
+                    yield _sse_event({"token": chunk})
+            finally:
+                scheduler.release(context["ticket"])
+        
+        with metrics.stage("extract", context["model"]):
+            assistant_response = re.sub(r"<\|.*?\|>", "", "".join(chunks)).strip()
+        if not assistant_response:
+            logger.error("Не удалось извлечь ответ модели")
+            yield _sse_event({"error": "Не удалось извлечь ответ модели"}, event="error")
+            return
+        
+        result = await finish_generation(context, assistant_response)
+        finished = True
+        yield _sse_event(result, event="done")
+    
+    except (asyncio.CancelledError, GeneratorExit):
+        # Поток прерван (ушли все подписчики): ответа не будет, сообщение пользователя убирается
+        # из истории, как при отказе планировщика, чтобы следующий ход не строился на нём
+        if not finished:
+            try:
+                await history_store.discard(context["history_key"], context["user_message"])
+            except Exception as e:
+                logger.warning(f"Не удалось убрать сообщение прерванной генерации из истории: {str(e)}")
+        raise
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        logger.error("Превышено время ожидания генерации")
+        yield _sse_event({"error": "Превышено время ожидания генерации"}, event="error")
+    except Exception as e:
+        logger.error(f"Ошибка при потоковой генерации: {str(e)}", exc_info=True)
+        yield _sse_event({"error": f"Ошибка при генерации: {str(e)}"}, event="error")
+
+
 async def clear_history(current_user: dict) -> Dict[str, Any]:
     """
     Очищает историю запросов и ответов AI для текущего пользователя.
@@ -478,11 +1117,11 @@ async def clear_history(current_user: dict) -> Dict[str, Any]:
         Словарь с результатом операции.
     """
     try:
+        # Сессия по умолчанию, как в prepare_generation
         session_id = f"user:{current_user['username']}"
-        print(f"session_id = {session_id}")
-        history_key = f"history:{current_user['username']}"
-        print(f"history_key = {history_key}")
-        await eav.delete_entity(history_key)
+        history_key = f"history:{current_user['username']}:{session_id}"
+        await history_store.delete(history_key)
+        invalidate_session_cache(history_key)
         logger.info(f"История для пользователя {current_user['username']} очищена")
         return {"message": "История успешно очищена"}
     except Exception as e:
@@ -0,0 +1,67 @@
+# backend/controllers/jobs.py
+
+import logging
+from typing import Dict, Any, AsyncIterator, Union
+
+from fastapi import HTTPException
+
+from jobs import job_queue
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+async def create_job(prompt: Dict[str, Any], current_user: dict) -> Dict[str, Any]:
+    """
+    Ставит запрос генерации в очередь заданий и сразу возвращает id задания.
+    """
+    return await job_queue.enqueue(prompt, current_user)
+
+
+async def get_job(job_id: str, wait: float, current_user: dict) -> Dict[str, Any]:
+    """
+    Возвращает состояние задания; при wait > 0 ждёт его завершения (long-poll), но не дольше JOB_MAX_WAIT.
+    """
+    job = await job_queue.wait(job_id, current_user["username"], min(wait, settings.job_max_wait))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job
+
+
+async def job_events(job_id: str, current_user: dict) -> AsyncIterator[str]:
+    """
+    Подписка на задание: события SSE по мере выполнения (status, фрагменты ответа, done или error).
+    """
+    events = await job_queue.events(job_id, current_user["username"])
+    if events is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return events
+
+
+async def generate_via_queue(prompt: Dict[str, Any], current_user: dict) -> Dict[str, Any]:
+    """
+    Синхронная генерация через очередь заданий (API без локального инференса):
+    задание ставится в очередь, ответ ждётся не дольше времени генерации.
+    Если время вышло, возвращается id задания, чтобы забрать результат позже.
+    """
+    created = await job_queue.enqueue(prompt, current_user)
+    job = await job_queue.wait(created["job_id"], current_user["username"], settings.generation_timeout)
+    if job is None:
+        return {"error": "Задание не найдено", "job_id": created["job_id"]}
+    if job["status"] == "done":
+        return job["result"]
+    if job["status"] == "failed":
+        return job.get("result") or {"error": job.get("error", "Ошибка выполнения задания")}
+    logger.warning(f"Задание {created['job_id']} не выполнено за {settings.generation_timeout} с")
+    return {"error": "Превышено время ожидания генерации", "job_id": created["job_id"]}
+
+
+async def stream_via_queue(prompt: Dict[str, Any], current_user: dict) -> Union[Dict[str, Any], AsyncIterator[str]]:
+    """
+    Потоковая генерация через очередь заданий: события SSE подписки на задание.
+    """
+    created = await job_queue.enqueue(prompt, current_user)
+    events = await job_queue.events(created["job_id"], current_user["username"])
+    if events is None:
+        return {"error": "Задание не найдено", "job_id": created["job_id"]}
+    return events
@@ -2,19 +2,20 @@
 
 from fastapi import HTTPException
 from datetime import datetime
-from passlib.context import CryptContext
 import logging
 
 from async_eav import eav
+from user_cache import user_cache
+from hashing import password_hasher
 from models import CreateUserRequest, UpdateUserRequest, DeleteUserRequest
 
 logger = logging.getLogger(__name__)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 async def delete_user(data: DeleteUserRequest):
     user_id = f"user:{data.username}"
     await eav.delete_entity(user_id)
+    await user_cache.invalidate(data.username)
     return {"message": f"Пользователь {data.username} удалён"}
 
 async def update_user(data: UpdateUserRequest):
@@ -23,12 +24,15 @@ async def update_user(data: UpdateUserRequest):
     if not user_data:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
+    updates = {}
     if data.password:
-        hashed_password = pwd_context.hash(data.password)
-        await eav.set_attribute(user_id, "password", hashed_password)
+        updates["password"] = await password_hasher.hash(data.password)
 
     if data.role:
-        await eav.set_attribute(user_id, "role", data.role)
+        updates["role"] = data.role
+
+    await eav.update_entity(user_id, updates)
+    await user_cache.invalidate(data.username)
 
     return {"message": "Пользователь обновлён"}
 
@@ -54,7 +58,7 @@ async def create_user(data: CreateUserRequest):
         raise HTTPException(status_code=400, detail="Пользователь уже существует")
 
     # Хешируем пароль
-    hashed_password = pwd_context.hash(data.password)
+    hashed_password = await password_hasher.hash(data.password)
     await eav.create_entity(
         f"user:{data.username}",
         attributes={
@@ -64,4 +68,5 @@ async def create_user(data: CreateUserRequest):
             "created_at": datetime.utcnow().isoformat()
         }
     )
+    await user_cache.invalidate(data.username)
     return {"message": f"Пользователь {data.username} создан"}
@@ -1,7 +1,7 @@
 # backend/controllers/users.py
 
 from fastapi import Request, HTTPException
-from typing import List
+from typing import List, Optional
 import logging
 
 from async_eav import eav
@@ -9,28 +9,29 @@ from async_eav import eav
 logger = logging.getLogger(__name__)
 
 # # async def list_users(field: str, value: str, current_user: dict = Depends(get_current_user)):
-async def list_users(field: str, value: str, request: Request) -> dict:
-    logger.info(f"Received GET /api/users with field={field}, value={value}, scheme={request.scope['scheme']}")
+async def list_users(field: str, value: str, request: Request, cursor: Optional[str] = None, limit: int = 50) -> dict:
+    logger.info(f"Received GET /api/users with field={field}, value={value}, cursor={cursor}, scheme={request.scope['scheme']}")
     users: List[str] = []
-    cursor = "0"
+    next_cursor: Optional[str] = None
     try:
-        while True:
-            logger.info(f"Scanning Redis with cursor={cursor!r}, type={type(cursor)}")
-            cursor, keys = await eav.client.scan(cursor=cursor, match="user:*", count=100)
-            logger.info(f"Received {len(keys)} keys: {keys}")
-            for key in keys:
-                logger.info(f"Fetching attribute {field} for key {key}")
-                attr_value = await eav.client.hget(key, field)
-                logger.info(f"Attribute value: {attr_value}")
-                if attr_value and attr_value == value:
-                    user_id = key.split(":", 1)[1]
-                    users.append(user_id)
-                    logger.info(f"Added user: {user_id} (direct match)")
-            if cursor in (b"0", 0, "0"):
-                logger.info("Finished scanning Redis")
-                break
+        if field in eav.indexed_attributes:
+            # Поле с индексом: страница из index:{field}:{value}, курсор — последний username страницы
+            entity_ids, last = await eav.find_entities_page(
+                field, value, prefix="user:", cursor=f"user:{cursor}" if cursor else None, limit=limit
+            )
+            users = [entity_id.split(":", 1)[1] for entity_id in entity_ids]
+            next_cursor = last.split(":", 1)[1] if last else None
+        else:
+            # Поле без индекса: пачки SCAN, пока не наберётся страница; курсор — курсор SCAN
+            scan_cursor: Optional[int] = int(cursor) if cursor else 0
+            while scan_cursor is not None and len(users) < limit:
+                keys, scan_cursor = await eav.scan_entities_by_attribute(field, value, "user:*", scan_cursor)
+                users.extend(key.split(":", 1)[1] for key in keys)
+            next_cursor = str(scan_cursor) if scan_cursor is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
     except Exception as e:
-        logger.error(f"Error during Redis scan: {str(e)}")
+        logger.error(f"Error during Redis lookup: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Redis error: {str(e)}")
-    logger.info(f"Returning users: {users}")
-    return {"matched_users": users}
+    logger.info(f"Returning {len(users)} users, next_cursor={next_cursor}")
+    return {"matched_users": users, "next_cursor": next_cursor}
@@ -0,0 +1,304 @@
+# backend/cpu_topology.py
+
+import os
+import glob
+import logging
+from typing import Dict, Any, List, Optional, Set
+
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def parse_cpu_list(text: str) -> List[int]:
+    """
+    Разобрать список CPU в формате sysfs: "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11].
+    """
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+
+def format_cpu_list(cpus: List[int]) -> str:
+    """
+    Список CPU в формате sysfs (для логов и статистики): [0, 1, 2, 5] -> "0-2,5".
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+class CpuTopology:
+    def __init__(self, cores: List[List[int]], nodes: Dict[int, int]):
+        """
+        Топология CPU: физические ядра (логические CPU каждого ядра, первым — основной поток,
+        остальные — SMT-соседи) в порядке NUMA-узлов.
+
+        :param cores: логические CPU каждого физического ядра
+        :param nodes: NUMA-узел каждого логического CPU
+        """
+        self.cores = cores
+        self.nodes = nodes
+
+    @classmethod
+    def read(cls, root: str = settings.cpu_sysfs_root, allowed: Optional[Set[int]] = None) -> "CpuTopology":
+        """
+        Прочитать топологию из sysfs: включённые CPU, ядра и пакеты (cpu/cpuN/topology), NUMA-узлы (node/nodeN/cpulist).
+        Если файлов топологии нет, каждый CPU считается отдельным ядром в узле 0.
+
+        :param root: каталог /sys/devices/system
+        :param allowed: CPU, доступные процессу (cpuset контейнера); None — все включённые
+        """
+        online = _read(os.path.join(root, "cpu", "online"))
+        cpus = parse_cpu_list(online) if online else sorted(allowed or range(os.cpu_count() or 1))
+        if allowed is not None:
+            cpus = [cpu for cpu in cpus if cpu in allowed] or sorted(allowed)
+
+        nodes: Dict[int, int] = {}
+        for node_dir in glob.glob(os.path.join(root, "node", "node[0-9]*")):
+            node = int(os.path.basename(node_dir)[len("node"):])
+            for cpu in parse_cpu_list(_read(os.path.join(node_dir, "cpulist")) or ""):
+                nodes[cpu] = node
+
+        groups: Dict[tuple, List[int]] = {}
+        for cpu in cpus:
+            topology_dir = os.path.join(root, "cpu", f"cpu{cpu}", "topology")
+            package = _read(os.path.join(topology_dir, "physical_package_id"))
+            core = _read(os.path.join(topology_dir, "core_id"))
+            key = (nodes.get(cpu, 0), int(package or 0), int(core) if core is not None else -1 - cpu)
+            groups.setdefault(key, []).append(cpu)
+        cores = [sorted(groups[key]) for key in sorted(groups, key=lambda key: (key[0], key[1], min(groups[key])))]
+        return cls(cores, {cpu: nodes.get(cpu, 0) for cpu in cpus})
+
+    @property
+    def cpus(self) -> List[int]:
+        return sorted(self.nodes)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cpus": len(self.nodes),
+            "physical_cores": len(self.cores),
+            "numa_nodes": len(set(self.nodes.values())),
+        }
+
+
+class CpuLease:
+    def __init__(self, owner: str, weight: int = 1, fixed: bool = False):
+        """
+        Набор ядер, выделенный одному потребителю: разовому запуску llama-cli или воркеру llama-server.
+
+        :param owner: имя потребителя (для логов и статистики)
+        :param weight: доля нагрузки: сколько генераций потребитель выполняет одновременно
+        :param fixed: набор не меняется, пока выделен (долгоживущий процесс с числом потоков, заданным при запуске)
+        """
+        self.owner = owner
+        self.weight = weight
+        self.fixed = fixed
+        self.cores: List[List[int]] = []
+        self.pids: List[int] = []
+
+    @property
+    def cpus(self) -> List[int]:
+        """
+        Маска привязки: все логические CPU выделенных ядер.
+        """
+        return sorted(cpu for core in self.cores for cpu in core)
+
+    @property
+    def threads(self) -> int:
+        """
+        Потоки генерации (-t): decode упирается в пропускную способность памяти,
+        SMT-соседи не ускоряют его — по одному потоку на физическое ядро.
+        """
+        return max(1, len(self.cores))
+
+    @property
+    def batch_threads(self) -> int:
+        """
+        Потоки prompt eval (-tb): вычисления батча выигрывают от SMT — по потоку на логический CPU.
+        """
+        return max(1, len(self.cpus))
+
+
+class CoreAllocator:
+    def __init__(
+        self,
+        topology: Optional[CpuTopology] = None,
+        min_cores: int = settings.cpu_min_cores,
+        enabled: bool = settings.cpu_pinning,
+    ):
+        """
+        Распределитель ядер CPU между одновременными генерациями.
+        Физические ядра делятся между потребителями пропорционально их нагрузке непрерывными
+        участками в порядке NUMA-узлов, так что наборы не пересекаются и по возможности не выходят
+        за узел; процессы закрепляются за своими ядрами (sched_setaffinity для всех потоков).
+        Число потоков llama.cpp задаётся при запуске процесса, поэтому наборы долгоживущих воркеров
+        llama-server фиксированы: выделяются при запуске и не меняются, пока воркер работает.
+        Между разовыми запусками llama-cli делятся ядра, не занятые воркерами; при их появлении
+        и завершении эти наборы пересчитываются.
+        Если потребителей больше, чем ядер по min_cores, наборы вынужденно пересекаются.
+
+        :param topology: топология CPU; по умолчанию — из sysfs с учётом CPU, доступных процессу
+        :param min_cores: минимум физических ядер на потребителя
+        :param enabled: закреплять ли процессы за ядрами (без закрепления выдаются только числа потоков)
+        """
+        if topology is None:
+            allowed = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else None
+            topology = CpuTopology.read(allowed=allowed)
+        self.topology = topology
+        self.min_cores = max(1, min_cores)
+        self.enabled = enabled and hasattr(os, "sched_setaffinity")
+        self.leases: List[CpuLease] = []
+        self.rebalances = 0
+
+    def acquire(self, owner: str, weight: int = 1, fixed: bool = False, cores: int = 0) -> CpuLease:
+        """
+        Выделить набор ядер новому потребителю.
+
+        :param owner: имя потребителя
+        :param weight: сколько генераций потребитель выполняет одновременно
+        :param fixed: фиксированный набор (воркер llama-server): ядра, не занятые другими воркерами,
+            а если таких нет — наименее занятые, по равной доле на воркер; наборы llama-cli уступают их
+        :param cores: число физических ядер фиксированного набора (0 — все свободные от других воркеров)
+        :return: набор ядер; вернуть через release()
+        """
+        lease = CpuLease(owner, max(1, weight), fixed)
+        if fixed:
+            lease.cores = self._reserve(cores)
+        self.leases.append(lease)
+        self._rebalance()
+        return lease
+
+    def release(self, lease: Optional[CpuLease]):
+        """
+        Освободить набор ядер (наборы остальных растут).
+        """
+        if lease is None or lease not in self.leases:
+            return
+        self.leases.remove(lease)
+        lease.pids.clear()
+        self._rebalance()
+
+    def attach(self, lease: CpuLease, pid: int):
+        """
+        Закрепить процесс потребителя за его ядрами.
+        """
+        lease.pids.append(pid)
+        self._apply(lease)
+
+    def _reserve(self, count: int) -> List[List[int]]:
+        """
+        Внутренний метод: ядра для фиксированного набора — наименее занятые другими фиксированными наборами,
+        в порядке NUMA-узлов.
+        """
+        cores = self.topology.cores
+        usage = [sum(core in lease.cores for lease in self.leases if lease.fixed) for core in cores]
+        free = usage.count(0)
+        if count <= 0:
+            servers = sum(1 for lease in self.leases if lease.fixed)
+            count = free or len(cores) // (servers + 1)
+        count = min(len(cores), max(self.min_cores, count))
+        chosen = sorted(sorted(range(len(cores)), key=lambda i: usage[i])[:count])
+        return [cores[i] for i in chosen]
+
+    def _layout(self, leases: List[CpuLease]) -> List[List[List[int]]]:
+        """
+        Внутренний метод: разбить ядра, не занятые фиксированными наборами (если таких нет — все),
+        на участки по нагрузке потребителей (метод наибольших остатков).
+        """
+        reserved = [core for lease in self.leases if lease.fixed for core in lease.cores]
+        cores = [core for core in self.topology.cores if core not in reserved] or self.topology.cores
+        total = sum(lease.weight for lease in leases)
+        exact = [len(cores) * lease.weight / total for lease in leases]
+        quotas = [max(self.min_cores, int(share)) for share in exact]
+        spare = len(cores) - sum(quotas)
+        for index in sorted(range(len(quotas)), key=lambda i: exact[i] - int(exact[i]), reverse=True):
+            if spare <= 0:
+                break
+            quotas[index] += 1
+            spare -= 1
+
+        layout = []
+        start = 0
+        for quota in quotas:
+            quota = min(quota, len(cores))
+            layout.append([cores[(start + i) % len(cores)] for i in range(quota)])
+            start += quota
+        return layout
+
+    def _rebalance(self):
+        """
+        Внутренний метод: пересчитать наборы ядер llama-cli и перезакрепить процессы, чьи наборы изменились.
+        """
+        leases = [lease for lease in self.leases if not lease.fixed]
+        if not leases:
+            return
+        self.rebalances += 1
+        for lease, cores in zip(leases, self._layout(leases)):
+            if cores == lease.cores:
+                continue
+            lease.cores = cores
+            self._apply(lease)
+
+    def _apply(self, lease: CpuLease):
+        """
+        Внутренний метод: закрепить все потоки процессов потребителя за его CPU
+        (маска потока наследуется только создаваемыми потоками, поэтому меняется у каждого).
+        """
+        if not self.enabled:
+            return
+        cpus = set(lease.cpus)
+        for pid in list(lease.pids):
+            try:
+                tids = [int(tid) for tid in os.listdir(f"/proc/{pid}/task")]
+            except OSError:
+                tids = [pid]
+            for tid in tids:
+                try:
+                    os.sched_setaffinity(tid, cpus)
+                except ProcessLookupError:
+                    continue
+                except OSError as e:
+                    logger.warning(f"Не удалось закрепить поток {tid} ({lease.owner}) за CPU {format_cpu_list(cpus)}: {str(e)}")
+                    return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.topology.stats(),
+            "pinning": self.enabled,
+            "rebalances": self.rebalances,
+            "leases": [
+                {
+                    "owner": lease.owner,
+                    "cpus": format_cpu_list(lease.cpus),
+                    "threads": lease.threads,
+                    "batch_threads": lease.batch_threads,
+                    "weight": lease.weight,
+                    "fixed": lease.fixed,
+                }
+                for lease in self.leases
+            ],
+        }
+
+
+# Инициализация распределителя ядер
+cpu_allocator = CoreAllocator()
@@ -0,0 +1,208 @@
+# backend/gguf_reader.py
+
+import mmap
+import struct
+from typing import Dict, Any, Optional, Iterable, Tuple
+
+GGUF_MAGIC = b"GGUF"
+
+# Типы значений метаданных GGUF
+GGUF_UINT8 = 0
+GGUF_INT8 = 1
+GGUF_UINT16 = 2
+GGUF_INT16 = 3
+GGUF_UINT32 = 4
+GGUF_INT32 = 5
+GGUF_FLOAT32 = 6
+GGUF_BOOL = 7
+GGUF_STRING = 8
+GGUF_ARRAY = 9
+GGUF_UINT64 = 10
+GGUF_INT64 = 11
+GGUF_FLOAT64 = 12
+
+# Формат struct для скалярных типов
+_SCALAR_FORMATS = {
+    GGUF_UINT8: "<B",
+    GGUF_INT8: "<b",
+    GGUF_UINT16: "<H",
+    GGUF_INT16: "<h",
+    GGUF_UINT32: "<I",
+    GGUF_INT32: "<i",
+    GGUF_FLOAT32: "<f",
+    GGUF_BOOL: "<?",
+    GGUF_UINT64: "<Q",
+    GGUF_INT64: "<q",
+    GGUF_FLOAT64: "<d",
+}
+
+# general.file_type -> тип квантизации (enum llama_ftype из llama.cpp)
+FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1",
+    10: "Q2_K", 11: "Q3_K_S", 12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M",
+    16: "Q5_K_S", 17: "Q5_K_M", 18: "Q6_K", 19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S",
+    22: "IQ3_XS", 23: "IQ3_XXS", 24: "IQ1_S", 25: "IQ4_NL", 26: "IQ3_S", 27: "IQ3_M",
+    28: "IQ2_S", 29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M", 32: "BF16",
+}
+
+
+class GGUFError(ValueError):
+    pass
+
+
+class GGUFReader:
+    def __init__(self, path: str):
+        """
+        Чтение заголовка GGUF-файла через mmap: читаются только заголовок, метаданные (KV)
+        и описания тензоров, сами веса модели с диска не загружаются.
+
+        :param path: путь к *.gguf файлу
+        """
+        self.path = path
+        self.version = 0
+        self.tensor_count = 0
+        self.kv_count = 0
+        self._buf: Optional[mmap.mmap] = None
+        self._offset = 0
+
+    def __enter__(self) -> "GGUFReader":
+        with open(self.path, "rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._buf[:4] != GGUF_MAGIC:
+            self._buf.close()
+            raise GGUFError(f"{self.path}: не GGUF-файл")
+        self._offset = 4
+        self.version = self._read(GGUF_UINT32)
+        if self.version == 1:
+            # В GGUF v1 счётчики 32-битные
+            self.tensor_count = self._read(GGUF_UINT32)
+            self.kv_count = self._read(GGUF_UINT32)
+        else:
+            self.tensor_count = self._read(GGUF_UINT64)
+            self.kv_count = self._read(GGUF_UINT64)
+        return self
+
+    def __exit__(self, *exc):
+        self._buf.close()
+        self._buf = None
+
+    def _read(self, value_type: int) -> Any:
+        fmt = _SCALAR_FORMATS[value_type]
+        value = struct.unpack_from(fmt, self._buf, self._offset)[0]
+        self._offset += struct.calcsize(fmt)
+        return value
+
+    def _read_length(self) -> int:
+        return self._read(GGUF_UINT32 if self.version == 1 else GGUF_UINT64)
+
+    def _read_string(self) -> str:
+        length = self._read_length()
+        data = self._buf[self._offset:self._offset + length]
+        self._offset += length
+        return data.decode("utf-8", errors="replace")
+
+    def _skip_string(self):
+        length = self._read_length()
+        self._offset += length
+
+    def _read_value(self, value_type: int, load_array: bool) -> Any:
+        if value_type == GGUF_STRING:
+            return self._read_string()
+        if value_type == GGUF_ARRAY:
+            item_type = self._read(GGUF_UINT32)
+            count = self._read_length()
+            if load_array:
+                return [self._read_value(item_type, True) for _ in range(count)]
+            self._skip_array(item_type, count)
+            return count
+        if value_type in _SCALAR_FORMATS:
+            return self._read(value_type)
+        raise GGUFError(f"{self.path}: неизвестный тип значения {value_type}")
+
+    def _skip_array(self, item_type: int, count: int):
+        """
+        Внутренний метод: пропустить массив, не создавая Python-объекты.
+        """
+        if item_type in _SCALAR_FORMATS:
+            self._offset += struct.calcsize(_SCALAR_FORMATS[item_type]) * count
+        elif item_type == GGUF_STRING:
+            for _ in range(count):
+                self._skip_string()
+        else:
+            for _ in range(count):
+                self._read_value(item_type, False)
+
+    def metadata(self, arrays: Iterable[str] = ()) -> Dict[str, Any]:
+        """
+        Прочитать все метаданные (KV) файла.
+        Массивы (например, словарь токенизатора) по умолчанию пропускаются и заменяются длиной.
+
+        :param arrays: ключи массивов, которые нужно загрузить целиком
+        :return: словарь {ключ: значение}
+        """
+        load = set(arrays)
+        result = {}
+        for _ in range(self.kv_count):
+            key = self._read_string()
+            value_type = self._read(GGUF_UINT32)
+            result[key] = self._read_value(value_type, key in load)
+        return result
+
+    def tensors(self) -> Iterable[Tuple[str, Tuple[int, ...]]]:
+        """
+        Описания тензоров (имя и размерности). Вызывать после metadata().
+        """
+        for _ in range(self.tensor_count):
+            name = self._read_string()
+            n_dims = self._read(GGUF_UINT32)
+            dims = tuple(self._read_length() for _ in range(n_dims))
+            self._read(GGUF_UINT32)  # тип тензора
+            self._read(GGUF_UINT64)  # смещение данных
+            yield name, dims
+
+
+def format_parameters(count: int) -> str:
+    """
+    Число параметров в привычном виде: 7.24B, 494M.
+    """
+    if count >= 1_000_000_000:
+        return f"{count / 1_000_000_000:.2f}B"
+    return f"{count / 1_000_000:.0f}M"
+
+
+def describe_model(path: str) -> Dict[str, Any]:
+    """
+    Метаданные модели из заголовка GGUF: архитектура, число параметров, обученный контекст,
+    квантизация, токенизатор и шаблон чата.
+
+    :param path: путь к *.gguf файлу
+    :return: словарь метаданных (поля, которых нет в файле, отсутствуют)
+    """
+    with GGUFReader(path) as reader:
+        meta = reader.metadata()
+        parameter_count = meta.get("general.parameter_count")
+        if parameter_count is None:
+            parameter_count = 0
+            for _, dims in reader.tensors():
+                size = 1
+                for dim in dims:
+                    size *= dim
+                parameter_count += size
+        version = reader.version
+
+    arch = meta.get("general.architecture", "unknown")
+    info = {
+        "version": f"gguf v{version}",
+        "architecture": arch,
+        "parameter_count": parameter_count,
+        "parameters": format_parameters(parameter_count) if parameter_count else "unknown",
+        "context_length": meta.get(f"{arch}.context_length"),
+        "embedding_length": meta.get(f"{arch}.embedding_length"),
+        "block_count": meta.get(f"{arch}.block_count"),
+        "head_count": meta.get(f"{arch}.attention.head_count"),
+        "head_count_kv": meta.get(f"{arch}.attention.head_count_kv"),
+        "quantization": FILE_TYPES.get(meta.get("general.file_type"), "unknown"),
+        "tokenizer": meta.get("tokenizer.ggml.model"),
+        "chat_template": meta.get("tokenizer.chat_template"),
+    }
+    return {key: value for key, value in info.items() if value is not None}
@@ -0,0 +1,231 @@
+# backend/gguf_tokenizer.py
+
+import re
+import heapq
+import struct
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+
+from gguf_reader import GGUFReader
+
+logger = logging.getLogger(__name__)
+
+# Типы токенов в tokenizer.ggml.token_type
+TOKEN_TYPE_CONTROL = 3
+TOKEN_TYPE_USER_DEFINED = 4
+
+# Регулярные выражения предварительной разбивки BPE (tokenizer.ggml.pre).
+# В модуле re нет \p{L}/\p{N}: буквы — [^\W\d_], цифры — \d.
+_GPT2_PATTERN = r"""'s|'t|'re|'ve|'m|'ll|'d| ?[^\W\d_]+| ?\d+| ?[^\s\w]+|\s+(?!\S)|\s+"""
+_LLAMA3_PATTERN = (
+    r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\w]?[^\W\d_]+|\d{1,3}| ?[^\s\w]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+PRE_TOKENIZER_PATTERNS = {
+    "llama3": _LLAMA3_PATTERN,
+    "llama-bpe": _LLAMA3_PATTERN,
+    "smaug-bpe": _LLAMA3_PATTERN,
+    "default": _GPT2_PATTERN,
+    "gpt-2": _GPT2_PATTERN,
+}
+
+
+def _bytes_to_unicode() -> Dict[int, str]:
+    """
+    Внутренний метод: таблица байт -> символ для byte-level BPE (как в GPT-2).
+    """
+    bs = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, map(chr, cs)))
+
+
+BYTE_ENCODER = _bytes_to_unicode()
+
+
+class GGUFTokenizer:
+    # Максимальный размер кэша слов BPE
+    WORD_CACHE_SIZE = 100_000
+
+    def __init__(self, meta: Dict[str, Any]):
+        """
+        Токенизатор модели по словарю из GGUF (SentencePiece и byte-level BPE, как в llama.cpp).
+
+        :param meta: метаданные GGUF с загруженными массивами tokenizer.ggml.*
+        """
+        self.model = meta["tokenizer.ggml.model"]
+        tokens: List[str] = meta["tokenizer.ggml.tokens"]
+        self.token_to_id: Dict[str, int] = {token: i for i, token in enumerate(tokens)}
+        self.scores: List[float] = meta.get("tokenizer.ggml.scores") or [0.0] * len(tokens)
+        self.add_bos = bool(meta.get("tokenizer.ggml.add_bos_token", self.model == "llama"))
+        self.add_space_prefix = bool(meta.get("tokenizer.ggml.add_space_prefix", True))
+        self.merge_ranks: Dict[Tuple[str, str], int] = {}
+        for rank, merge in enumerate(meta.get("tokenizer.ggml.merges") or []):
+            left, _, right = merge.partition(" ")
+            self.merge_ranks[(left, right)] = rank
+        pattern = PRE_TOKENIZER_PATTERNS.get(meta.get("tokenizer.ggml.pre", "default"), _GPT2_PATTERN)
+        self.pre_tokenizer = re.compile(pattern)
+        self._word_cache: Dict[str, int] = {}
+
+        # Управляющие и пользовательские токены (<|user|>, <|im_start|> ...) распознаются целиком
+        token_types = meta.get("tokenizer.ggml.token_type") or []
+        special = [
+            tokens[i] for i, token_type in enumerate(token_types)
+            if token_type in (TOKEN_TYPE_CONTROL, TOKEN_TYPE_USER_DEFINED) and len(tokens[i]) > 1
+        ]
+        special.sort(key=len, reverse=True)
+        self.special_pattern = re.compile("|".join(map(re.escape, special))) if special else None
+
+    @classmethod
+    def from_gguf(cls, path: str) -> Optional["GGUFTokenizer"]:
+        """
+        Загрузить токенизатор из GGUF-файла.
+
+        :return: токенизатор или None, если тип токенизатора не поддерживается
+        """
+        arrays = [
+            "tokenizer.ggml.tokens",
+            "tokenizer.ggml.scores",
+            "tokenizer.ggml.token_type",
+            "tokenizer.ggml.merges",
+        ]
+        with GGUFReader(path) as reader:
+            meta = reader.metadata(arrays=arrays)
+        if meta.get("tokenizer.ggml.model") not in ("llama", "gpt2") or not isinstance(meta.get("tokenizer.ggml.tokens"), list):
+            return None
+        return cls(meta)
+
+    def count(self, text: str, add_bos: bool = False) -> int:
+        """
+        Точное число токенов в тексте.
+
+        :param text: текст
+        :param add_bos: учитывать ли BOS-токен в начале (для целого prompt'а)
+        """
+        total = 1 if add_bos and self.add_bos else 0
+        position = 0
+        after_special = True
+        fragments = self.special_pattern.finditer(text) if self.special_pattern else ()
+        for match in fragments:
+            if match.start() > position:
+                total += self._count_fragment(text[position:match.start()], after_special)
+            total += 1
+            position = match.end()
+            after_special = True
+        if position < len(text):
+            total += self._count_fragment(text[position:], after_special)
+        return total
+
+    def _count_fragment(self, text: str, after_special: bool) -> int:
+        if self.model == "llama":
+            if self.add_space_prefix and after_special:
+                text = " " + text
+            return len(self._spm(text.replace(" ", "▁")))
+        return sum(self._bpe_word(word) for word in self.pre_tokenizer.findall(text))
+
+    def _spm(self, text: str) -> List[str]:
+        """
+        Внутренний метод: SentencePiece — жадное слияние соседних символов с наибольшим score.
+        """
+        symbols: List[Optional[str]] = list(text)
+        n = len(symbols)
+        if n == 0:
+            return []
+        prev = list(range(-1, n - 1))
+        nxt = list(range(1, n + 1))
+        nxt[-1] = -1
+        heap: List[Tuple[float, int, str]] = []
+
+        def push(i: int):
+            j = nxt[i]
+            if j == -1:
+                return
+            merged = symbols[i] + symbols[j]
+            token_id = self.token_to_id.get(merged)
+            if token_id is not None:
+                heapq.heappush(heap, (-self.scores[token_id], i, merged))
+
+        for i in range(n - 1):
+            push(i)
+        while heap:
+            _, i, merged = heapq.heappop(heap)
+            j = nxt[i]
+            if symbols[i] is None or j == -1 or symbols[j] is None or symbols[i] + symbols[j] != merged:
+                continue  # пара устарела после другого слияния
+            symbols[i] = merged
+            symbols[j] = None
+            nxt[i] = nxt[j]
+            if nxt[j] != -1:
+                prev[nxt[j]] = i
+            if prev[i] != -1:
+                push(prev[i])
+            push(i)
+
+        pieces = []
+        i = 0
+        while i != -1:
+            symbol = symbols[i]
+            if symbol in self.token_to_id:
+                pieces.append(symbol)
+            else:
+                # Нет в словаре — byte fallback: по токену <0xXX> на каждый байт UTF-8
+                pieces.extend(f"<0x{b:02X}>" for b in symbol.encode("utf-8"))
+            i = nxt[i]
+        return pieces
+
+    def _bpe_word(self, word: str) -> int:
+        """
+        Внутренний метод: byte-level BPE одного слова после предварительной разбивки (с кэшем).
+        """
+        cached = self._word_cache.get(word)
+        if cached is not None:
+            return cached
+        symbols = [BYTE_ENCODER[b] for b in word.encode("utf-8")]
+        while len(symbols) > 1:
+            best_rank = None
+            best = -1
+            for i in range(len(symbols) - 1):
+                rank = self.merge_ranks.get((symbols[i], symbols[i + 1]))
+                if rank is not None and (best_rank is None or rank < best_rank):
+                    best_rank, best = rank, i
+            if best_rank is None:
+                break
+            symbols[best:best + 2] = [symbols[best] + symbols[best + 1]]
+        if len(self._word_cache) >= self.WORD_CACHE_SIZE:
+            self._word_cache.clear()
+        self._word_cache[word] = len(symbols)
+        return len(symbols)
+
+
+# Токенизаторы загружаются один раз на файл модели
+_tokenizers: Dict[str, Optional[GGUFTokenizer]] = {}
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def get_tokenizer(model_config: Dict[str, Any]) -> Optional[GGUFTokenizer]:
+    """
+    Получить токенизатор модели; при первом обращении словарь читается из GGUF в отдельном потоке.
+
+    :param model_config: конфигурация модели (нужен path)
+    :return: токенизатор или None, если словарь недоступен
+    """
+    path = model_config.get("path")
+    if not path:
+        return None
+    # Файл модели могут заменить — ключ включает дату изменения
+    key = f"{path}:{model_config.get('modified', '')}"
+    if key in _tokenizers:
+        return _tokenizers[key]
+    async with _locks.setdefault(key, asyncio.Lock()):
+        if key not in _tokenizers:
+            try:
+                _tokenizers[key] = await asyncio.to_thread(GGUFTokenizer.from_gguf, path)
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"Не удалось загрузить словарь токенизатора {path}: {str(e)}")
+                _tokenizers[key] = None
+    return _tokenizers[key]
@@ -0,0 +1,132 @@
+# backend/hashing.py
+
+import time
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних замеров хранить для перцентилей
+LATENCY_SAMPLES = 1000
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        schemes: List[str] = settings.password_schemes,
+        workers: int = settings.password_hash_workers,
+        max_pending: int = settings.password_hash_max_pending,
+    ):
+        """
+        Единый сервис хеширования паролей.
+        Хеширование и проверка выполняются в пуле потоков (argon2 и bcrypt отпускают GIL),
+        поэтому вход пользователей не блокирует цикл событий и потоковую генерацию.
+
+        :param schemes: схемы хеширования; первая — для новых паролей, остальные принимаются
+            при проверке и заменяются при следующем входе
+        :param workers: максимум одновременных вычислений хеша
+        :param max_pending: максимум ожидающих и выполняющихся операций, после него — 429
+        """
+        self.context = CryptContext(
+            schemes=schemes,
+            deprecated="auto",
+            bcrypt__rounds=settings.password_bcrypt_rounds,
+            argon2__time_cost=settings.password_argon2_time_cost,
+            argon2__memory_cost=settings.password_argon2_memory_cost,
+            argon2__parallelism=settings.password_argon2_parallelism,
+        )
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._pending = 0
+        self._latency: Dict[str, deque] = {"hash": deque(maxlen=LATENCY_SAMPLES), "verify": deque(maxlen=LATENCY_SAMPLES)}
+        self._counts: Dict[str, int] = {"hash": 0, "verify": 0}
+        self.rehashed = 0
+        self.rejected = 0
+
+    async def _run(self, operation: str, func, *args):
+        """
+        Внутренний метод: выполнить операцию в пуле потоков с учётом лимита и времени.
+        """
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            logger.warning(f"Очередь хеширования паролей переполнена ({self._pending})")
+            raise HTTPException(
+                status_code=429,
+                detail="Слишком много запросов на вход, повторите позже",
+                headers={"Retry-After": "1"}
+            )
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+            self._latency[operation].append(time.perf_counter() - started)
+            self._counts[operation] += 1
+
+    async def hash(self, password: str) -> str:
+        """
+        Хешировать пароль текущей схемой и параметрами.
+        """
+        return await self._run("hash", self.context.hash, password)
+
+    async def verify(self, password: str, hashed: Optional[str]) -> bool:
+        """
+        Проверить пароль; неизвестный или пустой хеш — неверный пароль.
+        """
+        valid, _ = await self.verify_and_update(password, hashed)
+        return valid
+
+    async def verify_and_update(self, password: str, hashed: Optional[str]) -> Tuple[bool, Optional[str]]:
+        """
+        Проверить пароль и, если хеш сделан устаревшей схемой или параметрами, вернуть новый хеш.
+
+        :return: (пароль верен, новый хеш для сохранения или None)
+        """
+        try:
+            valid, new_hash = await self._run("verify", self.context.verify_and_update, password, hashed)
+        except ValueError as e:
+            logger.warning(f"Не удалось проверить хеш пароля: {str(e)}")
+            return False, None
+        if valid and new_hash is not None:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Статистика: число операций, задержка (среднее, p50, p95, максимум, мс), очередь и перехеширования.
+        """
+        latency = {}
+        for operation, samples in self._latency.items():
+            ordered = sorted(samples)
+            latency[operation] = {
+                "count": self._counts[operation],
+                "avg_ms": round(sum(ordered) / len(ordered) * 1000, 1) if ordered else 0.0,
+                "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1) if ordered else 0.0,
+                "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1) if ordered else 0.0,
+                "max_ms": round(ordered[-1] * 1000, 1) if ordered else 0.0,
+            }
+        return {
+            "scheme": self.context.default_scheme(),
+            "workers": self.workers,
+            "pending": self._pending,
+            "rehashed": self.rehashed,
+            "rejected": self.rejected,
+            "latency": latency,
+        }
+
+
+# Инициализация сервиса хеширования паролей
+password_hasher = PasswordHasher()
@@ -0,0 +1,266 @@
+# backend/history_store.py
+
+import json
+import logging
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Dict, Any, List, Callable, Optional
+
+from async_eav import eav
+from redis_scripts import RedisScripts
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryEntry:
+    def __init__(self):
+        """
+        Кэш истории одной сессии в памяти процесса: разобранные сообщения
+        и отрендеренный текст prompt'а с границами сообщений.
+        """
+        self.messages: List[Dict[str, Any]] = []
+        self.text = ""
+        # offsets[i] — начало строки i-го сообщения в text, offsets[-1] == len(text)
+        self.offsets: List[int] = [0]
+        # timestamp первого сообщения окна контекста на прошлом ходе
+        self.window_from: Optional[str] = None
+        # Версия истории в Redis и длина списка при этой версии, с которыми согласован кэш
+        self.version = 0
+        self.length = 0
+
+    def index_from(self, timestamp: Optional[str]) -> int:
+        """
+        Индекс первого сообщения не раньше timestamp (0, если timestamp не задан).
+        """
+        if timestamp is None:
+            return 0
+        return bisect_left(self.messages, timestamp, key=lambda msg: msg.get("timestamp", ""))
+
+    def extend(self, raw_messages: List[str], render_line: Callable[[Dict[str, Any]], str]):
+        lines = []
+        position = self.offsets[-1]
+        for raw in raw_messages:
+            msg = json.loads(raw)
+            line = render_line(msg)
+            self.messages.append(msg)
+            lines.append(line)
+            position += len(line)
+            self.offsets.append(position)
+        if lines:
+            self.text += "".join(lines)
+
+    def truncate(self, count: int):
+        """
+        Оставить только первые count сообщений.
+        """
+        del self.messages[count:]
+        del self.offsets[count + 1:]
+        self.text = self.text[:self.offsets[-1]]
+
+
+class HistoryStore:
+    def __init__(self, client=eav.client, ttl: int = settings.access_token_expire, max_cached: int = settings.history_cache_sessions):
+        """
+        История диалогов: список Redis на сессию (добавление O(1), чтение диапазона)
+        и кэш отрендеренного prompt'а, который дописывается новыми сообщениями, а не строится заново.
+        Каждое изменение истории увеличивает её версию; если с версии кэша историю не только дополняли
+        (удаления в любом процессе), кэш строится заново.
+
+        :param client: клиент Redis
+        :param ttl: время жизни истории в секундах
+        :param max_cached: сколько сессий держать в кэше процесса
+        """
+        self.client = client
+        self.scripts = RedisScripts(client)
+        self.ttl = ttl
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[str, HistoryEntry]" = OrderedDict()
+
+    @staticmethod
+    def _key(history_key: str) -> str:
+        return f"{history_key}:messages"
+
+    @staticmethod
+    def _version_key(history_key: str) -> str:
+        return f"{history_key}:version"
+
+    @staticmethod
+    def _summary_key(history_key: str) -> str:
+        return f"{history_key}:summary"
+
+    async def append(self, history_key: str, message: Dict[str, Any]):
+        """
+        Добавить сообщение в конец истории и продлить её время жизни (один round-trip).
+        """
+        key = self._key(history_key)
+        version_key = self._version_key(history_key)
+        pipeline = self.client.pipeline()
+        pipeline.rpush(key, json.dumps(message, ensure_ascii=False))
+        pipeline.expire(key, self.ttl)
+        pipeline.incr(version_key)
+        pipeline.expire(version_key, self.ttl)
+        await pipeline.execute()
+
+    async def append_once(self, history_key: str, message: Dict[str, Any], request_id: str, window: int = 4) -> Dict[str, Any]:
+        """
+        Добавить сообщение повторяемого запроса (задания очереди) не более одного раза:
+        если среди последних window сообщений уже есть сообщение этого запроса, повторно оно не добавляется.
+
+        :param message: сообщение; в историю оно сохраняется с полем request_id
+        :param request_id: идентификатор запроса
+        :return: сообщение из истории — сохранённое сейчас или при прошлой попытке
+        """
+        raw = await self.scripts.run(
+            "history_append_once",
+            [self._key(history_key), self._version_key(history_key)],
+            [json.dumps({**message, "request_id": request_id}, ensure_ascii=False), request_id, self.ttl, window],
+        )
+        return json.loads(raw)
+
+    async def recent(self, history_key: str, count: int) -> List[Dict[str, Any]]:
+        """
+        Последние count сообщений истории.
+        """
+        raw = await self.client.lrange(self._key(history_key), -count, -1)
+        return [json.loads(item) for item in raw]
+
+    async def load(self, history_key: str, render_line: Callable[[Dict[str, Any]], str]) -> HistoryEntry:
+        """
+        Получить историю сессии. Из Redis читаются только сообщения, которых ещё нет в кэше.
+
+        :param history_key: ключ истории сессии
+        :param render_line: функция, превращающая сообщение в строку prompt'а
+        :return: кэшированная запись истории (не изменять снаружи)
+        """
+        key = self._key(history_key)
+        version_key = self._version_key(history_key)
+        entry = self._cache.get(history_key)
+        if entry is None:
+            entry = HistoryEntry()
+        cached = len(entry.messages)
+
+        pipeline = self.client.pipeline()
+        pipeline.get(version_key)
+        pipeline.llen(key)
+        pipeline.lindex(key, 0)
+        pipeline.lrange(key, cached, -1)
+        version, length, first, new_items = await pipeline.execute()
+        version = int(version or 0)
+
+        if not self._only_appended(entry, version, length, first):
+            # Историю изменили не только добавлением (удаление, пересоздание) — строим заново
+            pipeline = self.client.pipeline()
+            pipeline.get(version_key)
+            pipeline.lrange(key, 0, -1)
+            version, new_items = await pipeline.execute()
+            version = int(version or 0)
+            length = len(new_items)
+            entry = HistoryEntry()
+        entry.extend(new_items, render_line)
+        entry.version = version
+        entry.length = length
+
+        self._cache[history_key] = entry
+        self._cache.move_to_end(history_key)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def _only_appended(entry: HistoryEntry, version: int, length: int, first: Optional[str]) -> bool:
+        """
+        Внутренний метод: проверить, что с версии кэша в историю только добавляли сообщения.
+        Каждое добавление увеличивает и версию, и длину на 1, любое удаление — версию на 1, а длину уменьшает;
+        пересозданную после удаления или истечения историю выдаёт другое первое сообщение.
+        """
+        appended = version - entry.version
+        if appended < 0 or length - entry.length != appended:
+            return False
+        return not entry.messages or (first is not None and json.loads(first) == entry.messages[0])
+
+    async def remove_role(self, history_key: str, role: str):
+        """
+        Удалить из истории все сообщения с указанной ролью (один Lua-скрипт, атомарно).
+        """
+        first_removed, length, version = await self.scripts.run(
+            "history_remove_role",
+            [self._key(history_key), self._version_key(history_key)],
+            [role, self.ttl],
+        )
+        if first_removed < 0:
+            return
+
+        entry = self._cache.get(history_key)
+        if entry is None:
+            return
+        if entry.version != version - 1:
+            # Кэш отстал от Redis — строится заново при следующей загрузке
+            self._cache.pop(history_key, None)
+            return
+        # Кэш до первого удалённого сообщения остаётся верным
+        entry.truncate(min(first_removed, len(entry.messages)))
+        entry.version = version
+        entry.length = length
+
+    async def discard(self, history_key: str, message: Dict[str, Any]):
+        """
+        Удалить последнее добавленное сообщение (например, если генерация не была допущена).
+        """
+        key = self._key(history_key)
+        version_key = self._version_key(history_key)
+        raw = json.dumps(message, ensure_ascii=False)
+        pipeline = self.client.pipeline()
+        pipeline.lindex(key, -1)
+        pipeline.lrem(key, -1, raw)
+        pipeline.incr(version_key)
+        pipeline.expire(version_key, self.ttl)
+        pipeline.llen(key)
+        last, removed, version, _, length = await pipeline.execute()
+        entry = self._cache.get(history_key)
+        if entry is None:
+            return
+        if entry.version != version - 1 or (removed and last != raw):
+            # Кэш отстал от Redis или сообщение было не последним — кэш строится заново при следующей загрузке
+            self._cache.pop(history_key, None)
+            return
+        if removed and len(entry.messages) == entry.length:
+            entry.truncate(len(entry.messages) - 1)
+        entry.version = version
+        entry.length = length
+
+    async def get_summary(self, history_key: str) -> Optional[Dict[str, str]]:
+        """
+        Краткое содержание вытесненной из окна части истории.
+
+        :return: {"text": ..., "until": timestamp последнего учтённого сообщения} или None
+        """
+        summary = await self.client.hgetall(self._summary_key(history_key))
+        return summary if summary.get("text") else None
+
+    async def set_summary(self, history_key: str, text: str, until: str):
+        """
+        Сохранить краткое содержание истории по сообщение с timestamp until включительно.
+        """
+        key = self._summary_key(history_key)
+        pipeline = self.client.pipeline()
+        pipeline.hset(key, mapping={"text": text, "until": until})
+        pipeline.expire(key, self.ttl)
+        await pipeline.execute()
+
+    async def delete(self, history_key: str):
+        """
+        Удалить историю сессии вместе с кратким содержанием.
+        """
+        self._cache.pop(history_key, None)
+        # Версия не удаляется, а увеличивается: иначе другой процесс мог бы принять новую историю за продолжение старой
+        version_key = self._version_key(history_key)
+        pipeline = self.client.pipeline()
+        pipeline.delete(self._key(history_key), self._summary_key(history_key))
+        pipeline.incr(version_key)
+        pipeline.expire(version_key, self.ttl)
+        await pipeline.execute()
+
+
+# Инициализация хранилища истории
+history_store = HistoryStore()
@@ -0,0 +1,221 @@
+# backend/job_worker.py
+
+"""
+Воркер инференса: выполняет задания генерации из очереди Redis (jobs.py).
+Запускается отдельно от API, в том числе на других узлах с тем же Redis и каталогом моделей:
+
+    python job_worker.py
+"""
+
+import os
+import json
+import signal
+import socket
+import asyncio
+import logging
+from typing import Dict, Any, Optional, Tuple
+
+from fastapi import HTTPException
+
+from async_eav import eav
+from controllers.generate import generate_text_stream
+from jobs import JobQueue, job_queue
+from llama_workers import worker_pool
+from model_registry import model_registry
+from scheduler import scheduler
+from search import web_search
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def parse_sse(event: str) -> Tuple[Optional[str], Dict[str, Any]]:
+    """
+    Разобрать событие SSE потоковой генерации: (имя события или None, данные).
+    """
+    name = None
+    data: Dict[str, Any] = {}
+    for line in event.strip().split("\n"):
+        if line.startswith("event: "):
+            name = line[len("event: "):]
+        elif line.startswith("data: "):
+            data = json.loads(line[len("data: "):])
+    return name, data
+
+
+class JobWorker:
+    def __init__(
+        self,
+        queue: JobQueue = job_queue,
+        consumer: str = settings.job_consumer,
+        concurrency: int = settings.job_worker_concurrency,
+    ):
+        """
+        Цикл воркера инференса: берёт задания из очереди, пока есть свободные места,
+        выполняет их потоковой генерацией (фрагменты ответа рассылаются подписчикам) и подтверждает.
+        Выполняющиеся задания периодически продлеваются, чтобы их не забрал другой воркер;
+        задания, прерванные остановкой или падением воркера, остаются неподтверждёнными и выполняются повторно.
+
+        :param queue: очередь заданий
+        :param consumer: имя воркера в группе (по умолчанию — хост и pid)
+        :param concurrency: максимум одновременно выполняемых заданий
+        """
+        self.queue = queue
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.concurrency = concurrency
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._stopping = asyncio.Event()
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.deferred = 0
+
+    async def process(self, entry_id: str, job_id: str):
+        """
+        Выполнить одно задание. Ошибка генерации (ответ с error) завершает задание;
+        исключение оставляет его в очереди для повторной попытки. Отказ планировщика (429) попыткой
+        не считается: задание ждёт Retry-After и выполняется этим же воркером снова.
+        """
+        while True:
+            job = await self.queue.start(entry_id, job_id, self.consumer)
+            if job is None:
+                return
+            logger.info(f"Задание {job_id} выполняется воркером {self.consumer}")
+            try:
+                result = await self.execute(job_id, job)
+                break
+            except asyncio.CancelledError:
+                await self.queue.requeue(job_id)
+                raise
+            except HTTPException as e:
+                if e.status_code != 429:
+                    self.retried += 1
+                    logger.warning(f"Задание {job_id} не выполнено: {e.detail}")
+                    await self.queue.requeue(job_id)
+                    return
+                self.deferred += 1
+                delay = min(float((e.headers or {}).get("Retry-After", 1)), settings.scheduler_max_wait)
+                logger.info(f"Задание {job_id} отложено на {delay:.0f} с: {e.detail}")
+                await self.queue.requeue(job_id, refund=True)
+            except Exception as e:
+                self.retried += 1
+                logger.error(f"Ошибка выполнения задания {job_id}: {str(e)}", exc_info=True)
+                await self.queue.requeue(job_id)
+                return
+            await asyncio.sleep(delay)
+        await self.queue.complete(entry_id, job_id, result)
+        if "error" in result:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    async def execute(self, job_id: str, job: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Потоковая генерация задания; фрагменты ответа публикуются подписчикам задания.
+        Сообщение пользователя сохраняется в историю с id задания, поэтому повторная попытка
+        (после падения или остановки воркера) его не дублирует.
+
+        :return: итог генерации (как у /api/generate) или словарь с ошибкой
+        """
+        events = await generate_text_stream({**job["prompt"], "job_id": job_id}, job["user"])
+        if isinstance(events, dict):
+            return events
+        result: Optional[Dict[str, Any]] = None
+        async for event in events:
+            name, data = parse_sse(event)
+            if name is None and "token" in data:
+                await self.queue.publish(job_id, "token", token=data["token"])
+            elif name in ("done", "error"):
+                result = data
+        return result or {"error": "Генерация завершилась без результата"}
+
+    async def _heartbeat(self):
+        """
+        Внутренний метод: продлевать владение выполняющимися заданиями.
+        """
+        interval = max(1.0, self.queue.claim_idle_ms / 3000)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.queue.touch(self.consumer, list(self._tasks))
+            except Exception as e:
+                logger.warning(f"Не удалось продлить задания воркера {self.consumer}: {str(e)}")
+
+    async def run(self):
+        """
+        Брать и выполнять задания до вызова stop(); при остановке дождаться выполняющихся заданий
+        (не дольше времени генерации), остальные вернутся в очередь.
+        """
+        logger.info(f"Воркер заданий {self.consumer} запущен (одновременно до {self.concurrency})")
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while not self._stopping.is_set():
+                # Заданий берётся не больше, чем планировщик допустит сразу: лишние ждали бы в его очереди
+                free = min(self.concurrency - len(self._tasks), scheduler.free_capacity())
+                if free <= 0:
+                    if self._tasks:
+                        await asyncio.wait(list(self._tasks.values()), timeout=1, return_when=asyncio.FIRST_COMPLETED)
+                    else:
+                        await asyncio.sleep(1)
+                    continue
+                try:
+                    entries = await self.queue.claim(self.consumer, free, block_ms=settings.job_poll_ms)
+                except Exception as e:
+                    logger.error(f"Ошибка чтения очереди заданий: {str(e)}")
+                    await asyncio.sleep(1)
+                    continue
+                for entry_id, job_id in entries:
+                    if entry_id in self._tasks:
+                        continue
+                    task = asyncio.create_task(self.process(entry_id, job_id))
+                    self._tasks[entry_id] = task
+                    task.add_done_callback(lambda _, entry_id=entry_id: self._tasks.pop(entry_id, None))
+            if self._tasks:
+                logger.info(f"Остановка воркера {self.consumer}: ожидание {len(self._tasks)} заданий")
+                _, pending = await asyncio.wait(list(self._tasks.values()), timeout=settings.generation_timeout)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        finally:
+            heartbeat.cancel()
+
+    def stop(self):
+        self._stopping.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "consumer": self.consumer,
+            "running": len(self._tasks),
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "deferred": self.deferred,
+        }
+
+
+async def main():
+    worker = JobWorker()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+
+    await model_registry.load()
+    await eav.scripts.load()
+    await web_search.start()
+    worker_pool.start_monitor()
+    preload = {}
+    for model_name in settings.model_preload:
+        model_config = await model_registry.get(model_name)
+        if model_config is not None:
+            preload[model_name] = model_config
+    worker_pool.start_preload(preload)
+    try:
+        await worker.run()
+    finally:
+        await web_search.close()
+        await worker_pool.shutdown()
+        logger.info(f"Воркер заданий {worker.consumer} остановлен: {worker.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
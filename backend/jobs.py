@@ -0,0 +1,336 @@
+# backend/jobs.py
+
+import json
+import time
+import uuid
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
+
+from redis.exceptions import ResponseError, TimeoutError as RedisTimeoutError
+
+from async_eav import eav
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Состояния задания: queued — в очереди, running — выполняется воркером,
+# done — готов результат, failed — ошибка генерации или задание в dead-letter
+FINAL_STATUSES = ("done", "failed")
+
+
+class JobQueue:
+    # Поток заданий, группа воркеров инференса и поток заданий, исчерпавших попытки
+    STREAM = "jobs:stream"
+    GROUP = "inference"
+    DEAD_LETTER = "jobs:dead"
+
+    def __init__(
+        self,
+        client=eav.client,
+        result_ttl: int = settings.job_result_ttl,
+        max_attempts: int = settings.job_max_attempts,
+        claim_idle_ms: int = settings.job_claim_idle_ms,
+        stream_maxlen: int = settings.job_stream_maxlen,
+    ):
+        """
+        Очередь асинхронных заданий генерации на Redis Streams.
+        API ставит задание в поток и сразу возвращает его id; воркеры инференса (в том числе на других
+        узлах) читают поток через группу потребителей и подтверждают задание (XACK) после записи результата.
+        Задание упавшего воркера остаётся неподтверждённым и после claim_idle_ms простоя забирается
+        другим воркером (XAUTOCLAIM); после max_attempts попыток оно уходит в dead-letter.
+        Состояние и результат хранятся в хеше job:{id}, изменения публикуются в канал job:{id}:events.
+
+        :param client: клиент Redis
+        :param result_ttl: сколько хранить задание после завершения (сек)
+        :param max_attempts: попыток выполнения до переноса в dead-letter
+        :param claim_idle_ms: простой неподтверждённого задания, после которого его забирает другой воркер (мс)
+        :param stream_maxlen: примерная максимальная длина потока заданий
+        """
+        self.client = client
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self.claim_idle_ms = claim_idle_ms
+        self.stream_maxlen = stream_maxlen
+        self._group_ready = False
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"job:{job_id}"
+
+    @staticmethod
+    def channel(job_id: str) -> str:
+        return f"job:{job_id}:events"
+
+    async def ensure_group(self):
+        """
+        Создать поток и группу воркеров, если их ещё нет.
+        """
+        if self._group_ready:
+            return
+        try:
+            await self.client.xgroup_create(self.STREAM, self.GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._group_ready = True
+
+    async def enqueue(self, prompt: Dict[str, Any], current_user: dict) -> Dict[str, Any]:
+        """
+        Поставить запрос генерации в очередь.
+
+        :param prompt: запрос в формате /api/generate
+        :param current_user: данные текущего пользователя
+        :return: {"job_id", "status"}
+        """
+        await self.ensure_group()
+        job_id = uuid.uuid4().hex
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "username": current_user["username"],
+            "user": json.dumps(current_user, ensure_ascii=False),
+            "prompt": json.dumps(prompt, ensure_ascii=False),
+            "attempts": 0,
+            "created_at": time.time(),
+        }
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job_id), mapping=job)
+            # Страховка от заданий, которые никто не выполнит: хранятся не дольше result_ttl после постановки
+            pipe.expire(self._key(job_id), self.result_ttl)
+            pipe.xadd(self.STREAM, {"job_id": job_id}, maxlen=self.stream_maxlen, approximate=True)
+            await pipe.execute()
+        logger.info(f"Задание {job_id} пользователя {current_user['username']} поставлено в очередь")
+        return {"job_id": job_id, "status": "queued"}
+
+    async def get(self, job_id: str, username: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Состояние задания (с результатом, если оно завершено) или None, если задания нет
+        или оно принадлежит другому пользователю.
+        """
+        raw = await self.client.hgetall(self._key(job_id))
+        if not raw or (username is not None and raw.get("username") != username):
+            return None
+        job = {
+            "job_id": job_id,
+            "status": raw.get("status"),
+            "attempts": int(raw.get("attempts", 0)),
+            "created_at": float(raw["created_at"]) if raw.get("created_at") else None,
+            "started_at": float(raw["started_at"]) if raw.get("started_at") else None,
+            "finished_at": float(raw["finished_at"]) if raw.get("finished_at") else None,
+        }
+        if raw.get("result"):
+            job["result"] = json.loads(raw["result"])
+        if raw.get("error"):
+            job["error"] = raw["error"]
+        return job
+
+    async def wait(self, job_id: str, username: Optional[str], timeout: float) -> Optional[Dict[str, Any]]:
+        """
+        Long-poll: дождаться завершения задания, но не дольше timeout секунд.
+
+        :return: состояние задания (завершённого или текущее по истечении timeout) или None
+        """
+        pubsub = self.client.pubsub()
+        try:
+            # Подписка до чтения состояния, чтобы не пропустить завершение между ними
+            await pubsub.subscribe(self.channel(job_id))
+            job = await self.get(job_id, username)
+            if job is None or job["status"] in FINAL_STATUSES or timeout <= 0:
+                return job
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + timeout
+            while (remaining := deadline - loop.time()) > 0:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+                if message is not None and json.loads(message["data"]).get("event") in FINAL_STATUSES:
+                    break
+            return await self.get(job_id, username)
+        finally:
+            await pubsub.aclose()
+
+    async def events(self, job_id: str, username: Optional[str]) -> Optional[AsyncIterator[str]]:
+        """
+        Подписка на задание: поток событий SSE — status при смене состояния, фрагменты ответа
+        по мере генерации и итоговое событие done (или error).
+
+        :return: асинхронный итератор событий SSE или None, если задания нет
+        """
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self.channel(job_id))
+        job = await self.get(job_id, username)
+        if job is None:
+            await pubsub.aclose()
+            return None
+
+        async def stream() -> AsyncIterator[str]:
+            try:
+                yield _sse_event({"status": job["status"]}, event="status")
+                if job["status"] in FINAL_STATUSES:
+                    yield _final_event(job)
+                    return
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = json.loads(message["data"])
+                    if data["event"] == "token":
+                        yield _sse_event({"token": data["token"]})
+                    elif data["event"] in FINAL_STATUSES:
+                        yield _final_event(await self.get(job_id, username))
+                        return
+                    else:
+                        yield _sse_event({"status": data["event"]}, event="status")
+            finally:
+                await pubsub.aclose()
+
+        return stream()
+
+    async def publish(self, job_id: str, event: str, **data):
+        """
+        Разослать событие задания подписчикам (status, token, done, failed).
+        """
+        await self.client.publish(self.channel(job_id), json.dumps({"event": event, **data}, ensure_ascii=False))
+
+    async def claim(self, consumer: str, count: int, block_ms: int) -> List[Tuple[str, str]]:
+        """
+        Взять задания для воркера: сначала зависшие задания упавших воркеров, затем новые.
+
+        :param consumer: имя воркера в группе
+        :param count: максимум заданий
+        :param block_ms: сколько ждать новых заданий (мс)
+        :return: список (id записи в потоке, id задания)
+        """
+        await self.ensure_group()
+        claimed = await self.client.xautoclaim(
+            self.STREAM, self.GROUP, consumer, min_idle_time=self.claim_idle_ms, start_id="0-0", count=count
+        )
+        entries = claimed[1]
+        if not entries:
+            try:
+                streams = await self.client.xreadgroup(self.GROUP, consumer, {self.STREAM: ">"}, count=count, block=block_ms)
+            except RedisTimeoutError:
+                # Ожидание дольше таймаута сокета клиента Redis — новых заданий нет
+                streams = []
+            entries = streams[0][1] if streams else []
+        return [(entry_id, fields["job_id"]) for entry_id, fields in entries if fields]
+
+    async def touch(self, consumer: str, entry_ids: List[str]):
+        """
+        Продлить владение выполняющимися заданиями (сбросить время простоя),
+        чтобы их не забрал другой воркер, пока генерация идёт дольше claim_idle_ms.
+        """
+        if entry_ids:
+            await self.client.xclaim(self.STREAM, self.GROUP, consumer, 0, entry_ids, justid=True)
+
+    async def start(self, entry_id: str, job_id: str, consumer: str) -> Optional[Dict[str, Any]]:
+        """
+        Начать выполнение задания: учесть попытку и отметить его выполняющимся.
+        Задание, исчерпавшее попытки, переносится в dead-letter.
+
+        :return: {"prompt", "user"} для генерации или None, если выполнять не нужно
+        """
+        key = self._key(job_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hincrby(key, "attempts", 1)
+            pipe.hmget(key, "status", "prompt", "user")
+            attempts, (status, prompt, user) = await pipe.execute()
+        if prompt is None or status in FINAL_STATUSES:
+            # Задание истекло или уже выполнено (воркер упал после записи результата, но до XACK)
+            await self.client.xack(self.STREAM, self.GROUP, entry_id)
+            if prompt is None:
+                await self.client.delete(key)
+            return None
+        if attempts > self.max_attempts:
+            await self.dead_letter(entry_id, job_id, f"Превышено число попыток выполнения ({self.max_attempts})")
+            return None
+        await self.client.hset(key, mapping={"status": "running", "consumer": consumer, "started_at": time.time()})
+        await self.publish(job_id, "running")
+        return {"prompt": json.loads(prompt), "user": json.loads(user)}
+
+    async def requeue(self, job_id: str, refund: bool = False):
+        """
+        Вернуть задание в состояние queued (запись остаётся неподтверждённой и будет забрана повторно).
+
+        :param refund: не засчитывать попытку (генерация не начиналась, например из-за занятости планировщика)
+        """
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job_id), "status", "queued")
+            if refund:
+                pipe.hincrby(self._key(job_id), "attempts", -1)
+            await pipe.execute()
+        await self.publish(job_id, "queued")
+
+    async def complete(self, entry_id: str, job_id: str, result: Dict[str, Any]):
+        """
+        Сохранить результат и подтвердить задание. Результат с полем error — неуспешная генерация
+        (повторять её бессмысленно), задание завершается состоянием failed.
+        """
+        status = "failed" if "error" in result else "done"
+        fields = {"status": status, "finished_at": time.time(), "result": json.dumps(result, ensure_ascii=False)}
+        if "error" in result:
+            fields["error"] = str(result["error"])
+        await self._finish(entry_id, job_id, fields)
+
+    async def dead_letter(self, entry_id: str, job_id: str, error: str):
+        """
+        Перенести задание в dead-letter: оно больше не выполняется и доступно для разбора в jobs:dead.
+        """
+        logger.error(f"Задание {job_id} перенесено в dead-letter: {error}")
+        await self.client.xadd(
+            self.DEAD_LETTER,
+            {"job_id": job_id, "entry_id": entry_id, "error": error, "failed_at": time.time()},
+            maxlen=self.stream_maxlen,
+            approximate=True,
+        )
+        await self._finish(entry_id, job_id, {"status": "failed", "finished_at": time.time(), "error": error})
+
+    async def _finish(self, entry_id: str, job_id: str, fields: Dict[str, Any]):
+        """
+        Внутренний метод: записать итог задания, подтвердить и удалить запись потока, уведомить подписчиков.
+        """
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(self._key(job_id), mapping=fields)
+            pipe.expire(self._key(job_id), self.result_ttl)
+            pipe.xack(self.STREAM, self.GROUP, entry_id)
+            pipe.xdel(self.STREAM, entry_id)
+            await pipe.execute()
+        await self.publish(job_id, fields["status"])
+
+    async def stats(self) -> Dict[str, Any]:
+        """
+        Длина очереди, число выполняющихся (неподтверждённых) заданий по воркерам и размер dead-letter.
+        """
+        await self.ensure_group()
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.xlen(self.STREAM)
+            pipe.xpending(self.STREAM, self.GROUP)
+            pipe.xlen(self.DEAD_LETTER)
+            length, pending, dead = await pipe.execute()
+        return {
+            "stream_length": length,
+            "pending": pending["pending"],
+            "pending_by_consumer": {c["name"]: c["pending"] for c in pending.get("consumers") or []},
+            "dead_letter": dead,
+        }
+
+
+def _sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """
+    Внутренний метод: форматирование события Server-Sent Events.
+    """
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n" if event else f"data: {payload}\n\n"
+
+
+def _final_event(job: Optional[Dict[str, Any]]) -> str:
+    """
+    Внутренний метод: итоговое событие задания — done с результатом или error.
+    """
+    if job is None:
+        return _sse_event({"error": "Задание не найдено"}, event="error")
+    if job["status"] == "done":
+        return _sse_event(job["result"], event="done")
+    return _sse_event({"error": job.get("error", "Ошибка выполнения задания")}, event="error")
+
+
+# Инициализация очереди заданий
+job_queue = JobQueue()
@@ -0,0 +1,661 @@
+# backend/llama_workers.py
+
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, AsyncIterator
+
+import httpx
+
+from prompt_cache import prompt_cache
+from settings import settings
+from timings import throughput, from_server
+from residency import estimate_footprint_mb, process_rss_mb, memory_budget_mb
+from scheduler import scheduler
+from cpu_topology import cpu_allocator, CpuLease
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Пользователь, от имени которого прогрев моделей встаёт в очередь планировщика
+PRELOAD_USER = "system:preload"
+
+
+def find_server_executable() -> Optional[str]:
+    """
+    Ищет исполняемый файл llama-server (HTTP-сервер llama.cpp).
+
+    Returns:
+        Путь к исполняемому файлу или None, если не найден.
+    """
+    possible_paths = [
+        os.path.join(settings.llama_bin_dir, "llama-server") if settings.llama_bin_dir else "",
+        "/llama.cpp/build/bin/llama-server",
+        "/llama.cpp/build/llama-server",
+        "/llama.cpp/build/bin/server",
+        "/llama.cpp/build/server"
+    ]
+    return next((p for p in possible_paths if os.path.isfile(p)), None)
+
+
+def _free_port() -> int:
+    """
+    Внутренний метод: получить свободный локальный порт для воркера.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def build_server_command(
+    server_path: str,
+    model_config: Dict[str, Any],
+    port: int,
+    lease: Optional[CpuLease] = None,
+) -> List[str]:
+    """
+    Формирует команду запуска долгоживущего llama-server для одной модели.
+
+    Args:
+        server_path: Путь к исполняемому файлу llama-server.
+        model_config: Конфигурация модели.
+        port: Локальный порт, на котором будет слушать воркер.
+        lease: Ядра CPU, выделенные воркеру (задают число потоков); None — все ядра.
+
+    Returns:
+        Список аргументов команды.
+    """
+    n_slots = int(model_config.get("n_slots", 1))
+    topology = cpu_allocator.topology
+    threads = lease.threads if lease is not None else len(topology.cores)
+    batch_threads = lease.batch_threads if lease is not None else len(topology.cpus)
+    slot_ctx = int(model_config.get("slot_ctx") or model_config.get("max_ctx", settings.max_ctx_size))
+    command = [
+        server_path,
+        "-m", model_config["path"],
+        "--host", "127.0.0.1",
+        "--port", str(port),
+        "--no-mmap",  # модель читается в память один раз при старте воркера
+        # Контекст делится между слотами поровну: -c — суммарный контекст всех слотов
+        "-c", str(slot_ctx * n_slots),
+        "-np", str(n_slots),
+        "-cb",  # непрерывный батчинг: слоты декодируются одним батчем, запросы входят и выходят между токенами
+        "-t", str(model_config.get("n_threads", threads)),  # decode: по потоку на физическое ядро
+        "-tb", str(model_config.get("n_threads", batch_threads)),  # prompt eval: с SMT-соседями
+        "--slot-save-path", prompt_cache.cache_dir + os.sep,  # KV-кэши сессий между ходами диалога
+    ]
+    if int(model_config.get("gpu_layers", 0)) > 0:
+        command.extend(["-ngl", str(model_config["gpu_layers"])])
+    if topology.stats()["numa_nodes"] > 1:
+        # Распределять потоки по NUMA-узлам согласно маске привязки процесса
+        command.extend(["--numa", "numactl"])
+    return command
+
+
+# Соответствие параметров генерации полям запроса /completion llama-server
+COMPLETION_PARAMS = [
+    ("n_tokens", "n_predict"),
+    ("temperature", "temperature"),
+    ("top_p", "top_p"),
+    ("top_k", "top_k"),
+    ("repeat_penalty", "repeat_penalty"),
+    ("seed", "seed"),
+    ("typical_p", "typical_p"),
+    ("mirostat", "mirostat"),
+    ("mirostat_lr", "mirostat_eta"),
+    ("mirostat_ent", "mirostat_tau"),
+]
+
+
+class LlamaWorker:
+    def __init__(self, model_name: str, model_config: Dict[str, Any], server_path: str):
+        """
+        Долгоживущий процесс llama-server для одной модели.
+        Модель загружается один раз, дальше воркер принимает prompt'ы по HTTP.
+        Одновременные запросы выполняются в параллельных слотах сервера и декодируются
+        одним батчем; каждый запрос занимает свой слот до конца генерации.
+
+        :param model_name: имя модели
+        :param model_config: конфигурация модели (путь, контекст, потоки)
+        :param server_path: путь к исполняемому файлу llama-server
+        """
+        self.model_name = model_name
+        self.model_config = model_config
+        self.server_path = server_path
+        self.port: Optional[int] = None
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.restarts = 0
+        # Последние строки stderr — для диагностики падений
+        self.stderr_tail: deque = deque(maxlen=50)
+        self._stderr_task: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        # Какая сессия (history_key) сейчас находится в KV-кэше слота
+        self.n_slots = int(model_config.get("n_slots", 1))
+        self.slot_sessions: Dict[int, Optional[str]] = {slot_id: None for slot_id in range(self.n_slots)}
+        # Свободные слоты: в начале — дольше всех не использовавшиеся
+        self._free_slots: List[int] = list(range(self.n_slots))
+        self._slots_changed = asyncio.Condition()
+        # Время запуска процесса и загрузки модели (мс)
+        self.load_ms: Optional[float] = None
+        # Оценка занимаемой памяти (МБ), число выполняющихся запросов и время последнего использования
+        self.footprint_mb = estimate_footprint_mb(model_config)
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        # Ядра CPU воркера: доля растёт с числом занятых слотов
+        self.cpu_lease: Optional[CpuLease] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    def rss_mb(self) -> Optional[float]:
+        """
+        Резидентная память процесса llama-server (МБ).
+        """
+        return process_rss_mb(self.process.pid) if self.is_running() else None
+
+    def memory_mb(self) -> float:
+        """
+        Память воркера для учёта бюджета: фактическая, если она больше оценки.
+        """
+        return max(self.footprint_mb, self.rss_mb() or 0.0)
+
+    def busy_slots(self) -> int:
+        return self.n_slots - len(self._free_slots)
+
+    def _pick_slot(self, session: Optional[str]) -> int:
+        """
+        Внутренний метод: выбрать свободный слот для сессии — слот, где уже лежит её KV-кэш,
+        иначе пустой, иначе дольше всех не использовавшийся.
+        """
+        for slot_id in self._free_slots:
+            if session is not None and self.slot_sessions.get(slot_id) == session:
+                return slot_id
+        for slot_id in self._free_slots:
+            if self.slot_sessions.get(slot_id) is None:
+                return slot_id
+        return self._free_slots[0]
+
+    @asynccontextmanager
+    async def _slot(self, session: Optional[str]):
+        """
+        Внутренний метод: занять слот на время запроса и подготовить в нём KV-кэш сессии.
+        Если все слоты заняты — ждать освобождения. Пока занят хотя бы один слот, воркер не вытесняется.
+        """
+        self.in_use += 1
+        self.last_used = time.monotonic()
+        slot_id = None
+        try:
+            async with self._slots_changed:
+                await self._slots_changed.wait_for(lambda: self._free_slots)
+                slot_id = self._pick_slot(session)
+                self._free_slots.remove(slot_id)
+            await self._prepare_slot(slot_id, session)
+            yield slot_id
+        finally:
+            if slot_id is not None:
+                async with self._slots_changed:
+                    self._free_slots.append(slot_id)
+                    self._slots_changed.notify()
+            self.in_use -= 1
+            self.last_used = time.monotonic()
+
+    async def start(self):
+        """
+        Запустить процесс llama-server и дождаться загрузки модели.
+        """
+        self.port = _free_port()
+        prompt_cache.prepare_dir()
+        started = time.perf_counter()
+        cpu_allocator.release(self.cpu_lease)
+        # Набор ядер воркера фиксирован на всё время работы: число потоков llama-server задаётся при запуске
+        self.cpu_lease = cpu_allocator.acquire(
+            f"llama-server:{self.model_name}", weight=self.n_slots, fixed=True, cores=settings.cpu_server_cores
+        )
+        command = build_server_command(self.server_path, self.model_config, self.port, self.cpu_lease)
+        logger.info(f"Запуск воркера {self.model_name}: {' '.join(command)}")
+        self.process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        cpu_allocator.attach(self.cpu_lease, self.process.pid)
+        self._stderr_task = asyncio.create_task(self._drain_stderr())
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=settings.generation_timeout
+        )
+        await self.wait_ready()
+        self.load_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Воркер {self.model_name} готов за {self.load_ms:.0f} мс (pid={self.process.pid}, port={self.port})")
+        await throughput.record_load(self.model_name, self.load_ms)
+
+    async def _drain_stderr(self):
+        """
+        Внутренний метод: вычитывает stderr процесса, чтобы не переполнился pipe.
+        """
+        while True:
+            line = await self.process.stderr.readline()
+            if not line:
+                break
+            self.stderr_tail.append(line.decode("utf-8", errors="replace").rstrip())
+
+    async def wait_ready(self):
+        """
+        Ждать, пока llama-server загрузит модель и начнёт отвечать на /health.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.worker_startup_timeout
+        while loop.time() < deadline:
+            if not self.is_running():
+                tail = "\n".join(self.stderr_tail)
+                raise RuntimeError(f"Воркер {self.model_name} завершился при запуске: {tail}")
+            if await self.is_healthy():
+                return
+            await asyncio.sleep(0.5)
+        await self.stop()
+        raise RuntimeError(f"Воркер {self.model_name} не запустился за {settings.worker_startup_timeout} с")
+
+    async def is_healthy(self) -> bool:
+        """
+        Проверить, что процесс жив и llama-server отвечает 200 на /health.
+        """
+        if not self.is_running() or self._client is None:
+            return False
+        try:
+            response = await self._client.get("/health", timeout=5)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    async def _prepare_slot(self, slot_id: int, session: Optional[str]):
+        """
+        Внутренний метод: подготовить KV-кэш слота для сессии.
+        Если в слоте уже эта сессия — кэш используется как есть. Иначе текущая сессия
+        слота сохраняется на диск, а кэш новой сессии восстанавливается из файла, если он есть.
+        Запрос без сессии (служебная генерация) тоже вытесняет сессию слота на диск.
+        """
+        current = self.slot_sessions.get(slot_id)
+        if current == session:
+            return
+        try:
+            if current is not None:
+                await self._save_slot(slot_id, current)
+
+            filename = prompt_cache.lookup(self.model_name, session) if session is not None else None
+            if filename is not None:
+                response = await self._client.post(
+                    f"/slots/{slot_id}",
+                    params={"action": "restore"},
+                    json={"filename": filename}
+                )
+                if response.status_code != 200:
+                    logger.warning(f"Не удалось восстановить кэш сессии {session}: {response.text}")
+        except httpx.HTTPError as e:
+            logger.warning(f"Ошибка работы с кэшем слота {slot_id} воркера {self.model_name}: {str(e)}")
+        self.slot_sessions[slot_id] = session
+
+    async def _save_slot(self, slot_id: int, session: str):
+        """
+        Внутренний метод: сохранить KV-кэш слота в файл сессии.
+        """
+        response = await self._client.post(
+            f"/slots/{slot_id}",
+            params={"action": "save"},
+            json={"filename": prompt_cache.filename(self.model_name, session)}
+        )
+        if response.status_code == 200:
+            prompt_cache.record_saved(self.model_name, session)
+
+    async def save_slots(self):
+        """
+        Сохранить KV-кэши всех слотов на диск (перед остановкой воркера),
+        чтобы сессии продолжились без повторного prompt eval после новой загрузки модели.
+        """
+        for slot_id, session in self.slot_sessions.items():
+            if session is None:
+                continue
+            try:
+                await self._save_slot(slot_id, session)
+            except httpx.HTTPError as e:
+                logger.warning(f"Не удалось сохранить кэш слота {slot_id} воркера {self.model_name}: {str(e)}")
+
+    def forget_sessions(self, prefix: str):
+        """
+        Забыть, что слоты содержат кэш сессии prefix или вложенных в неё ключей prefix:...
+        (после reset или очистки истории).
+        """
+        for slot_id, current in self.slot_sessions.items():
+            if current is not None and (current == prefix or current.startswith(f"{prefix}:")):
+                self.slot_sessions[slot_id] = None
+
+    async def complete(self, prompt_text: str, params: Dict[str, Any], session: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Отправить prompt воркеру и получить ответ модели.
+
+        :param prompt_text: сформированный prompt
+        :param params: параметры генерации
+        :param session: ключ истории сессии для повторного использования KV-кэша
+        :return: JSON-ответ llama-server (поле content содержит ответ, timings — замеры)
+        """
+        async with self._slot(session) as slot_id:
+            payload = self._completion_payload(prompt_text, params, slot_id)
+            response = await self._client.post("/completion", json=payload)
+            response.raise_for_status()
+            completion = response.json()
+        await throughput.record(self.model_name, from_server(completion.get("timings")))
+        return completion
+
+    async def stream(
+        self,
+        prompt_text: str,
+        params: Dict[str, Any],
+        session: Optional[str] = None,
+        timings: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Отправить prompt воркеру и получать фрагменты ответа по мере генерации.
+
+        :param prompt_text: сформированный prompt
+        :param params: параметры генерации
+        :param session: ключ истории сессии для повторного использования KV-кэша
+        :param timings: словарь, в который по завершении записываются замеры генерации
+        :return: асинхронный итератор фрагментов ответа
+        """
+        async with self._slot(session) as slot_id:
+            payload = self._completion_payload(prompt_text, params, slot_id)
+            payload["stream"] = True
+            async with self._client.stream("POST", "/completion", json=payload) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    data = json.loads(line[len("data: "):])
+                    if data.get("content"):
+                        yield data["content"]
+                    if data.get("stop"):
+                        measured = from_server(data.get("timings"))
+                        await throughput.record(self.model_name, measured)
+                        if timings is not None and measured:
+                            timings.update(measured)
+                        break
+
+    def _completion_payload(self, prompt_text: str, params: Dict[str, Any], slot_id: int = 0) -> Dict[str, Any]:
+        """
+        Внутренний метод: тело запроса /completion из prompt'а и параметров генерации для слота slot_id.
+        """
+        payload: Dict[str, Any] = {
+            "prompt": f"{prompt_text}\n<|assistant|>",
+            "stop": ["<|user|>"],
+            # Переиспользовать KV-кэш слота: заново считается только новая часть prompt'а
+            "cache_prompt": True,
+            "id_slot": slot_id,
+        }
+        for param, field in COMPLETION_PARAMS:
+            if params.get(param) is not None:
+                payload[field] = params[param]
+        return payload
+
+    async def stop(self):
+        """
+        Остановить процесс воркера.
+        """
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self.is_running():
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+        if self._stderr_task is not None:
+            self._stderr_task.cancel()
+            self._stderr_task = None
+        cpu_allocator.release(self.cpu_lease)
+        self.cpu_lease = None
+
+
+class LlamaWorkerPool:
+    def __init__(self, budget_mb: Optional[float] = None):
+        """
+        Пул воркеров: по одному долгоживущему llama-server на модель (с несколькими слотами).
+        Воркеры запускаются по требованию, проверяются и перезапускаются при падении.
+        Загруженные модели укладываются в бюджет памяти: для новой модели вытесняются
+        давно не использовавшиеся свободные воркеры (LRU).
+
+        :param budget_mb: бюджет памяти на модели (МБ); по умолчанию — из настроек
+        """
+        self.workers: Dict[str, LlamaWorker] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._monitor_task: Optional[asyncio.Task] = None
+        self._preload_task: Optional[asyncio.Task] = None
+        self.budget_mb = budget_mb if budget_mb is not None else memory_budget_mb()
+        # Загрузки моделей выполняются по одной, чтобы две модели не заняли один и тот же запас памяти
+        self._load_lock = asyncio.Lock()
+        self.loads: Dict[str, int] = {}
+        self.evictions: Dict[str, int] = {}
+
+    async def get_worker(self, model_name: str, model_config: Dict[str, Any]) -> Optional[LlamaWorker]:
+        """
+        Получить готовый воркер модели, запустив или перезапустив его при необходимости.
+
+        :param model_name: имя модели
+        :param model_config: конфигурация модели
+        :return: воркер или None, если llama-server не собран
+        """
+        server_path = find_server_executable()
+        if not server_path:
+            return None
+
+        lock = self._locks.setdefault(model_name, asyncio.Lock())
+        async with lock:
+            worker = self.workers.get(model_name)
+            if worker is not None and worker.is_running():
+                worker.last_used = time.monotonic()
+                return worker
+            if worker is not None:
+                logger.warning(f"Воркер {model_name} упал, перезапуск: {list(worker.stderr_tail)[-5:]}")
+                del self.workers[model_name]
+                await worker.stop()
+                restarts = worker.restarts + 1
+            else:
+                restarts = 0
+            worker = LlamaWorker(model_name, model_config, server_path)
+            worker.restarts = restarts
+            async with self._load_lock:
+                await self._make_room(worker)
+                await worker.start()
+            self.workers[model_name] = worker
+            # Модель обслуживает столько одновременных генераций, сколько у воркера слотов
+            scheduler.set_model_limit(model_name, worker.n_slots)
+            self.loads[model_name] = self.loads.get(model_name, 0) + 1
+            metrics.MODEL_LOADS.labels(model_name).inc()
+            return worker
+
+    def used_mb(self, exclude: Optional[str] = None) -> float:
+        """
+        Память, занятая загруженными моделями (МБ).
+        """
+        return sum(worker.memory_mb() for name, worker in self.workers.items() if name != exclude)
+
+    async def _make_room(self, worker: LlamaWorker):
+        """
+        Внутренний метод: освободить память под модель воркера, вытесняя свободные воркеры
+        в порядке давности использования. Если все воркеры заняты — ждать, пока какой-нибудь
+        освободится (не дольше таймаута загрузки модели).
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.worker_startup_timeout
+        while self.workers and self.used_mb(exclude=worker.model_name) + worker.footprint_mb > self.budget_mb:
+            idle = [
+                other for name, other in self.workers.items()
+                if name != worker.model_name and other.in_use == 0
+                and not self._locks.get(name, asyncio.Lock()).locked()
+            ]
+            if idle:
+                await self.evict(min(idle, key=lambda other: other.last_used).model_name, reason=f"загрузка {worker.model_name}")
+                continue
+            if loop.time() > deadline:
+                raise RuntimeError(
+                    f"Недостаточно памяти для загрузки модели {worker.model_name} "
+                    f"({worker.footprint_mb:.0f} МБ, бюджет {self.budget_mb:.0f} МБ): все загруженные модели заняты"
+                )
+            await asyncio.sleep(0.5)
+        if worker.footprint_mb > self.budget_mb:
+            logger.warning(
+                f"Модель {worker.model_name} ({worker.footprint_mb:.0f} МБ) больше бюджета памяти "
+                f"({self.budget_mb:.0f} МБ), загружается без других моделей"
+            )
+
+    async def evict(self, model_name: str, reason: str = ""):
+        """
+        Выгрузить модель: сохранить KV-кэши слотов на диск и остановить воркер.
+        """
+        worker = self.workers.pop(model_name, None)
+        if worker is None:
+            return
+        logger.info(f"Выгрузка модели {model_name} ({worker.memory_mb():.0f} МБ){': ' + reason if reason else ''}")
+        self.evictions[model_name] = self.evictions.get(model_name, 0) + 1
+        metrics.MODEL_EVICTIONS.labels(model_name).inc()
+        metrics.MODEL_RSS.labels(model_name).set(0)
+        await worker.save_slots()
+        await worker.stop()
+
+    async def preload(self, models: Dict[str, Dict[str, Any]]):
+        """
+        Загрузить и прогреть модели (при старте приложения), не выходя за бюджет памяти:
+        модель, которая уже не помещается, пропускается, ранее загруженные не вытесняются.
+
+        :param models: {имя модели: конфигурация}
+        """
+        for model_name, model_config in models.items():
+            footprint = estimate_footprint_mb(model_config)
+            if model_name not in self.workers and self.used_mb() + footprint > self.budget_mb:
+                logger.warning(f"Модель {model_name} ({footprint:.0f} МБ) не помещается в бюджет памяти, предзагрузка пропущена")
+                continue
+            try:
+                worker = await self.get_worker(model_name, model_config)
+                if worker is None:
+                    return
+                # Первый prompt eval прогревает кэши страниц и буферы вычислений. Прогрев — обычная заявка
+                # планировщика: слот и ядра не отнимаются у допущенных генераций, под нагрузкой прогрев пропускается
+                if scheduler.queue_depth() or not scheduler.free_capacity():
+                    logger.info(f"Модель {model_name} загружена, прогрев пропущен: идут генерации")
+                    continue
+                ticket = await scheduler.acquire(model_name, PRELOAD_USER, 1)
+                try:
+                    await worker.complete("Привет", {"n_tokens": 1, "temperature": 0})
+                finally:
+                    scheduler.release(ticket)
+                logger.info(f"Модель {model_name} загружена и прогрета")
+            except Exception as e:
+                logger.error(f"Не удалось предзагрузить модель {model_name}: {str(e)}")
+
+    def start_preload(self, models: Dict[str, Dict[str, Any]]):
+        """
+        Запустить предзагрузку моделей в фоне.
+        """
+        if models and self._preload_task is None:
+            self._preload_task = asyncio.create_task(self.preload(models))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Резидентность моделей: бюджет и занятая память, по каждой модели — оценка и фактическая
+        память (RSS), занятость слотов и простой; число загрузок и выгрузок.
+        """
+        now = time.monotonic()
+        models = {}
+        for model_name, worker in self.workers.items():
+            rss = worker.rss_mb()
+            if rss is not None:
+                metrics.MODEL_RSS.labels(model_name).set(rss * 1024 * 1024)
+            models[model_name] = {
+                "pid": worker.process.pid if worker.is_running() else None,
+                "footprint_mb": worker.footprint_mb,
+                "rss_mb": rss,
+                "in_use": worker.in_use,
+                "slots": worker.n_slots,
+                "busy_slots": worker.busy_slots(),
+                "idle_seconds": round(now - worker.last_used, 1) if worker.in_use == 0 else 0.0,
+                "load_ms": round(worker.load_ms, 1) if worker.load_ms is not None else None,
+                "restarts": worker.restarts,
+            }
+        return {
+            "budget_mb": self.budget_mb,
+            "used_mb": round(self.used_mb(), 1),
+            "models": models,
+            "loads": dict(self.loads),
+            "evictions": dict(self.evictions),
+        }
+
+    def forget_sessions(self, prefix: str):
+        """
+        Сбросить привязку к слотам всех воркеров для сессии prefix и ключей prefix:...
+        """
+        for worker in self.workers.values():
+            worker.forget_sessions(prefix)
+
+    async def check_workers(self):
+        """
+        Проверить все воркеры и перезапустить упавшие или зависшие; обновить метрику RSS моделей.
+        """
+        for model_name, worker in list(self.workers.items()):
+            lock = self._locks.setdefault(model_name, asyncio.Lock())
+            if lock.locked() or await worker.is_healthy():
+                rss = worker.rss_mb()
+                if rss is not None:
+                    metrics.MODEL_RSS.labels(model_name).set(rss * 1024 * 1024)
+                continue
+            if self.workers.get(model_name) is not worker:
+                # Модель выгружена во время проверки
+                continue
+            logger.warning(f"Воркер {model_name} не прошёл проверку здоровья")
+            async with lock:
+                await worker.stop()
+            try:
+                await self.get_worker(model_name, worker.model_config)
+            except Exception as e:
+                logger.error(f"Не удалось перезапустить воркер {model_name}: {str(e)}")
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(settings.worker_health_interval)
+            try:
+                await self.check_workers()
+            except Exception as e:
+                logger.error(f"Ошибка проверки воркеров: {str(e)}", exc_info=True)
+
+    def start_monitor(self):
+        """
+        Запустить фоновую проверку здоровья воркеров.
+        """
+        if self._monitor_task is None:
+            self._monitor_task = asyncio.create_task(self._monitor())
+
+    async def shutdown(self):
+        """
+        Остановить проверку здоровья и все воркеры.
+        """
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            self._monitor_task = None
+        if self._preload_task is not None:
+            self._preload_task.cancel()
+            self._preload_task = None
+        for worker in self.workers.values():
+            await worker.stop()
+        self.workers.clear()
+
+
+# Инициализация пула воркеров
+worker_pool = LlamaWorkerPool()
@@ -0,0 +1,241 @@
+# backend/metrics.py
+
+import os
+import time
+import functools
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Метрики Prometheus. При запуске нескольких процессов uvicorn задайте PROMETHEUS_MULTIPROC_DIR
+# (пустой каталог, общий для процессов): значения пишутся в файлы и суммируются при выдаче /api/metrics.
+# Каталог создаётся здесь же: процессы, запущенные не через CMD образа (воркер заданий), его не создают.
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+if MULTIPROCESS:
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# Этапы запроса генерации: auth, list_models, history_load, prompt_build,
+# model_load (получение или запуск воркера), llama_cli (разовый запуск llama-cli целиком),
+# prompt_eval и decode (по данным llama-server), extract (извлечение ответа)
+STAGE_SECONDS = Histogram(
+    "llm_stage_seconds",
+    "Время этапов обработки запроса генерации",
+    ["stage", "model"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+REDIS_ROUNDTRIPS = Histogram(
+    "llm_redis_roundtrips",
+    "Число обращений к Redis за запрос",
+    ["model"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+GENERATIONS = Counter(
+    "llm_generations_total",
+    "Завершённые генерации по состоянию кэша ответов (hit, miss, bypass)",
+    ["model", "cache"],
+)
+TOKENS = Counter(
+    "llm_tokens_total",
+    "Токены, обработанные llama-server (prompt — вычисленные токены prompt'а, generated — сгенерированные)",
+    ["model", "kind"],
+)
+QUEUE_DEPTH = Gauge(
+    "llm_queue_depth",
+    "Заявки на генерацию в очереди планировщика",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+MODEL_LOADS = Counter(
+    "llm_model_loads_total",
+    "Загрузки моделей (запуски воркеров llama-server)",
+    ["model"],
+)
+MODEL_EVICTIONS = Counter(
+    "llm_model_evictions_total",
+    "Выгрузки моделей из памяти для загрузки других",
+    ["model"],
+)
+MODEL_RSS = Gauge(
+    "llm_model_rss_bytes",
+    "Резидентная память процессов llama-server по моделям",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+ACTIVE_GENERATIONS = Gauge(
+    "llm_active_generations",
+    "Выполняющиеся генерации",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+
+
+class RequestMetrics:
+    def __init__(self):
+        """
+        Замеры одного HTTP-запроса. Модель становится известна только после разбора запроса,
+        поэтому этапы накапливаются и записываются в гистограммы с меткой модели по завершении запроса.
+        """
+        self.model = ""
+        self.redis_roundtrips = 0
+        self.stages: List[Tuple[str, float]] = []
+        self.finished = False
+
+    def finish(self):
+        self.finished = True
+        for stage, seconds in self.stages:
+            STAGE_SECONDS.labels(stage, self.model).observe(seconds)
+        REDIS_ROUNDTRIPS.labels(self.model).observe(self.redis_roundtrips)
+
+
+_current: contextvars.ContextVar[Optional[RequestMetrics]] = contextvars.ContextVar("request_metrics", default=None)
+
+
+def set_model(model: str):
+    """
+    Указать модель текущего запроса (метка model его метрик).
+    """
+    current = _current.get()
+    if current is not None:
+        current.model = model
+
+
+def observe(stage: str, seconds: float, model: Optional[str] = None):
+    """
+    Записать длительность этапа. Вне запроса или после его завершения (фоновые задачи)
+    значение записывается сразу.
+    """
+    current = _current.get()
+    if current is not None and not current.finished and model in (None, current.model):
+        current.stages.append((stage, seconds))
+    else:
+        STAGE_SECONDS.labels(stage, model if model is not None else (current.model if current else "")).observe(seconds)
+
+
+@contextmanager
+def stage(name: str, model: Optional[str] = None):
+    """
+    Замерить этап: with stage("history_load"): ...
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, model)
+
+
+def timed(name: str):
+    """
+    Декоратор асинхронной функции, замеряющий её как этап (сигнатура сохраняется для Depends).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with stage(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_timings(model: str, timings: Optional[Dict[str, Any]]):
+    """
+    Записать время prompt eval и decode и число токенов из замеров генерации (формат timings.py).
+    """
+    if not timings:
+        return
+    if timings.get("prompt_ms") is not None:
+        observe("prompt_eval", timings["prompt_ms"] / 1000, model)
+    if timings.get("generation_ms") is not None:
+        observe("decode", timings["generation_ms"] / 1000, model)
+    if timings.get("prompt_tokens"):
+        TOKENS.labels(model, "prompt").inc(timings["prompt_tokens"])
+    if timings.get("generated_tokens"):
+        TOKENS.labels(model, "generated").inc(timings["generated_tokens"])
+
+
+def _count_roundtrip():
+    current = _current.get()
+    if current is not None:
+        current.redis_roundtrips += 1
+
+
+def instrument_redis(client):
+    """
+    Считать обращения к Redis текущего запроса: каждая команда, скрипт и pipeline — один round-trip.
+    """
+    if getattr(client, "_metrics_instrumented", False):
+        return
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    async def counted_execute_command(*args, **options):
+        _count_roundtrip()
+        return await execute_command(*args, **options)
+
+    def counted_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def counted_execute(*execute_args, **execute_kwargs):
+            _count_roundtrip()
+            return await execute(*execute_args, **execute_kwargs)
+
+        pipe.execute = counted_execute
+        return pipe
+
+    client.execute_command = counted_execute_command
+    client.pipeline = counted_pipeline
+    client._metrics_instrumented = True
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        """
+        ASGI middleware: создаёт замеры запроса и записывает их после отправки ответа
+        (для потоковых ответов — после завершения потока).
+        """
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        current = RequestMetrics()
+        token = _current.set(current)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            current.finish()
+
+
+def render() -> Tuple[bytes, str]:
+    """
+    Текущие значения метрик в текстовом формате Prometheus (в режиме нескольких процессов — сумма по всем).
+
+    :return: (тело ответа, Content-Type)
+    """
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """
+    Убрать значения gauge завершившегося процесса (при остановке приложения).
+    """
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
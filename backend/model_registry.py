@@ -0,0 +1,186 @@
+# backend/model_registry.py
+
+import os
+import glob
+import time
+import struct
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+
+from async_eav import eav
+from gguf_reader import describe_model
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Числовые поля модели: в EAV хранятся строками
+NUMERIC_FIELDS = {
+    "size": float,
+    "default_tokens": int,
+    "default_temp": float,
+    "max_ctx": int,
+    "max_tokens": int,
+    "context_budget": int,
+    "parameter_count": int,
+    "context_length": int,
+    "embedding_length": int,
+    "block_count": int,
+    "head_count": int,
+    "head_count_kv": int,
+}
+
+
+def slot_layout(model_name: str, max_ctx: int) -> Tuple[int, int]:
+    """
+    Параллельные слоты llama-server для модели: их число и контекст одного слота.
+    Контекст слота не больше контекста модели; если он не задан, каждый слот получает весь контекст модели
+    (KV-кэш растёт с числом слотов и учитывается в бюджете памяти моделей).
+
+    :param model_name: имя модели
+    :param max_ctx: контекст модели в токенах
+    :return: (число слотов, контекст слота)
+    """
+    n_slots = max(1, int(settings.worker_model_slots.get(model_name, settings.worker_slots)))
+    slot_ctx = int(settings.worker_model_slot_ctx.get(model_name, settings.worker_slot_ctx)) or max_ctx
+    return n_slots, max(1, min(slot_ctx, max_ctx))
+
+
+class ModelRegistry:
+    def __init__(self, model_dir: str = settings.model_dir, check_interval: float = settings.model_registry_check_interval):
+        """
+        Реестр моделей в памяти процесса.
+        Загружается один раз при старте и перечитывается только при изменении каталога моделей
+        (проверяется mtime каталога не чаще раза в check_interval секунд),
+        поэтому получение модели на горячем пути не трогает ни диск, ни Redis.
+
+        :param model_dir: каталог с *.gguf моделями
+        :param check_interval: минимальный интервал между проверками mtime каталога (сек)
+        """
+        self.model_dir = model_dir
+        self.check_interval = check_interval
+        self.models: Dict[str, Dict[str, Any]] = {}
+        self._dir_mtime: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _read_dir_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.model_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    async def get_models(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Получить модели; перечитывает каталог, только если изменился его mtime.
+
+        :return: словарь {имя модели: конфигурация}
+        """
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            if self._read_dir_mtime() != self._dir_mtime:
+                await self.load()
+        return self.models
+
+    async def get(self, model_name: str) -> Optional[Dict[str, Any]]:
+        """
+        Получить конфигурацию одной модели или None.
+        """
+        return (await self.get_models()).get(model_name)
+
+    async def load(self):
+        """
+        Просканировать каталог моделей и синхронизировать его с EAV.
+        Модели, которых нет в EAV, добавляются; модели из EAV, которых нет на диске, удаляются.
+        """
+        async with self._lock:
+            dir_mtime = self._read_dir_mtime()
+            if self.models and dir_mtime == self._dir_mtime:
+                return
+
+            # Получаем список моделей с диска
+            model_files = glob.glob(os.path.join(self.model_dir, "*.gguf"))
+            disk_models = {
+                os.path.splitext(os.path.basename(file_path))[0]: file_path
+                for file_path in model_files
+            }
+
+            # Модели, сохранённые в EAV (список model_id хранится в отдельном ключе Redis)
+            eav_model_ids = await eav.client.smembers("models:index")
+
+            # Удаляем из EAV модели, которых нет на диске
+            removed = eav_model_ids - disk_models.keys()
+            if removed:
+                await eav.delete_many([f"model:{model_name}" for model_name in removed])
+                await eav.client.srem("models:index", *removed)
+                logger.info(f"Удалены модели из EAV: {sorted(removed)}")
+
+            # Сохранённые описания всех моделей читаются одним pipeline
+            stored = await eav.get_many([f"model:{model_name}" for model_name in disk_models.keys() & eav_model_ids])
+
+            models = {}
+            for model_name, file_path in disk_models.items():
+                model_data = stored.get(f"model:{model_name}")
+                if model_data and model_data.get("modified") == self._modified(file_path) and "max_ctx" in model_data:
+                    # Преобразуем строковые значения в нужные типы
+                    for field, cast in NUMERIC_FIELDS.items():
+                        if field in model_data:
+                            model_data[field] = cast(model_data[field])
+                else:
+                    # Новая модель, файл заменён или ещё нет метаданных GGUF — описываем заново
+                    model_data = self._describe(model_name, file_path)
+                    await eav.create_entity(f"model:{model_name}", model_data)
+                    await eav.client.sadd("models:index", model_name)
+                    logger.info(f"Добавлена модель в EAV: {model_name}")
+                # Слоты зависят от настроек, а не от файла модели, поэтому в EAV не сохраняются
+                model_data["n_slots"], model_data["slot_ctx"] = slot_layout(model_name, model_data["max_ctx"])
+                models[model_name] = model_data
+
+            self.models = models
+            self._dir_mtime = dir_mtime
+            self._checked_at = time.monotonic()
+            logger.info(f"Реестр моделей загружен: {sorted(models)}")
+
+    @staticmethod
+    def _modified(file_path: str) -> str:
+        """
+        Внутренний метод: дата изменения файла модели в формате EAV.
+        """
+        return datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')
+
+    @classmethod
+    def _describe(cls, model_name: str, file_path: str) -> Dict[str, Any]:
+        """
+        Внутренний метод: описание новой модели по файлу на диске.
+        """
+        file_size = os.path.getsize(file_path) / (1024 * 1024)  # Размер в МБ
+        mod_date = cls._modified(file_path)
+        model_data = {
+            "name": model_name,
+            "path": file_path,
+            "size": round(file_size, 2),
+            "modified": mod_date,
+            "version": "unknown",
+            "parameters": "unknown",
+            "architecture": "unknown",
+            "default_tokens": 128,
+            "default_temp": 0.7
+        }
+
+        # Метаданные из заголовка GGUF (миллисекунды, без запуска llama-cli)
+        try:
+            model_data.update(describe_model(file_path))
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"Не удалось прочитать метаданные GGUF {model_name}: {str(e)}")
+
+        # Размер контекста — по обученному контексту модели, но не больше лимита из настроек
+        max_ctx = min(model_data.get("context_length", settings.max_ctx_size), settings.max_ctx_size)
+        model_data["max_ctx"] = max_ctx
+        model_data["max_tokens"] = max(max_ctx - model_data["default_tokens"], model_data["default_tokens"])
+        return model_data
+
+
+# Инициализация реестра моделей
+model_registry = ModelRegistry()
@@ -0,0 +1,136 @@
+# backend/prompt_cache.py
+
+import os
+import shutil
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PromptCacheManager:
+    def __init__(
+        self,
+        cache_dir: str = settings.prompt_cache_dir,
+        disk_budget_mb: int = settings.prompt_cache_disk_budget_mb,
+        max_sessions: int = settings.prompt_cache_max_sessions,
+    ):
+        """
+        Учёт сохранённых KV-кэшей сессий (файлы слотов llama-server) с LRU-вытеснением.
+        Ключ — пара (модель, history_key), чтобы следующий ход диалога
+        восстанавливал уже вычисленный prompt и считал только новые токены.
+
+        :param cache_dir: корневой каталог файлов кэша; у каждого процесса API свой подкаталог
+            (его получают воркеры в --slot-save-path)
+        :param disk_budget_mb: максимальный суммарный размер файлов кэша на диске (МБ)
+        :param max_sessions: максимальное число сохранённых сессий
+        """
+        self.root_dir = cache_dir
+        self.cache_dir = os.path.join(cache_dir, str(os.getpid()))
+        self.disk_budget = disk_budget_mb * 1024 * 1024
+        self.max_sessions = max_sessions
+        # (модель, history_key) -> размер файла в байтах; порядок — от давно использованных к свежим
+        self.entries: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self.disk_usage = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def prepare_dir(self):
+        """
+        Создать каталог кэша процесса и удалить каталоги завершившихся процессов.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, name)
+            if not name.isdigit() or path == self.cache_dir:
+                continue
+            try:
+                os.kill(int(name), 0)
+            except ProcessLookupError:
+                shutil.rmtree(path, ignore_errors=True)
+            except PermissionError:
+                pass
+
+    @staticmethod
+    def filename(model: str, history_key: str) -> str:
+        """
+        Имя файла кэша для сессии (относительно cache_dir, как ждёт llama-server).
+        """
+        digest = hashlib.sha1(f"{model}|{history_key}".encode("utf-8")).hexdigest()
+        return f"{digest}.bin"
+
+    def lookup(self, model: str, history_key: str) -> Optional[str]:
+        """
+        Найти сохранённый кэш сессии и отметить его как недавно использованный.
+
+        :return: имя файла кэша или None
+        """
+        key = (model, history_key)
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return self.filename(model, history_key)
+
+    def record_saved(self, model: str, history_key: str):
+        """
+        Учесть только что сохранённый воркером файл кэша и вытеснить старые сверх бюджета.
+        """
+        key = (model, history_key)
+        path = os.path.join(self.cache_dir, self.filename(model, history_key))
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        self.disk_usage += size - self.entries.pop(key, 0)
+        self.entries[key] = size
+        self._evict()
+
+    def _evict(self):
+        """
+        Внутренний метод: удалять самые давно использованные кэши, пока не уложимся в бюджет.
+        """
+        while self.entries and (self.disk_usage > self.disk_budget or len(self.entries) > self.max_sessions):
+            (model, history_key), _ = next(iter(self.entries.items()))
+            self._drop(model, history_key)
+            self.evictions += 1
+            logger.info(f"Вытеснен кэш prompt'а {history_key} ({model})")
+
+    def _drop(self, model: str, history_key: str):
+        """
+        Внутренний метод: удалить запись и файл кэша.
+        """
+        self.disk_usage -= self.entries.pop((model, history_key), 0)
+        try:
+            os.remove(os.path.join(self.cache_dir, self.filename(model, history_key)))
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self, prefix: str):
+        """
+        Удалить кэши всех моделей для ключа prefix и вложенных в него ключей (prefix:...):
+        history_key одной сессии (reset) или history:{username} (все сессии пользователя).
+        """
+        for model, key in list(self.entries.keys()):
+            if key == prefix or key.startswith(f"{prefix}:"):
+                self._drop(model, key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self.entries),
+            "disk_usage_mb": round(self.disk_usage / (1024 * 1024), 2),
+            "disk_budget_mb": round(self.disk_budget / (1024 * 1024), 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Инициализация кэша prompt'ов
+prompt_cache = PromptCacheManager()
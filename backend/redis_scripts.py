@@ -0,0 +1,200 @@
+# backend/redis_scripts.py
+
+import logging
+from typing import Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+# Записать атрибуты сущности и обновить индексы index:{атрибут}:{значение}.
+# KEYS[1] — сущность; ARGV: replace (1 — заменить сущность целиком), ttl (пусто — не менять),
+# число индексируемых атрибутов, их имена, затем пары атрибут/значение.
+EAV_SET = """
+local key = KEYS[1]
+local replace = ARGV[1] == '1'
+local ttl = tonumber(ARGV[2])
+local n = tonumber(ARGV[3])
+local new = {}
+local fields = {}
+for i = 4 + n, #ARGV, 2 do
+    new[ARGV[i]] = ARGV[i + 1]
+    fields[#fields + 1] = ARGV[i]
+    fields[#fields + 1] = ARGV[i + 1]
+end
+for i = 1, n do
+    local attr = ARGV[3 + i]
+    local value = new[attr]
+    if replace or value then
+        local old = redis.call('HGET', key, attr)
+        if old and old ~= value then
+            redis.call('ZREM', 'index:' .. attr .. ':' .. old, key)
+        end
+        if value then
+            redis.call('ZADD', 'index:' .. attr .. ':' .. value, 0, key)
+        end
+    end
+end
+if replace then
+    redis.call('DEL', key)
+end
+for i = 1, #fields, 1000 do
+    redis.call('HSET', key, unpack(fields, i, math.min(i + 999, #fields)))
+end
+if ttl and #fields > 0 then
+    redis.call('EXPIRE', key, ttl)
+end
+return #fields / 2
+"""
+
+# Удалить атрибуты сущности и убрать её из их индексов.
+# KEYS[1] — сущность; ARGV: число индексируемых атрибутов, их имена, затем удаляемые атрибуты.
+EAV_DELETE_ATTRIBUTES = """
+local key = KEYS[1]
+local n = tonumber(ARGV[1])
+local indexed = {}
+for i = 1, n do
+    indexed[ARGV[1 + i]] = true
+end
+local removed = 0
+for i = 2 + n, #ARGV do
+    local attr = ARGV[i]
+    if indexed[attr] then
+        local old = redis.call('HGET', key, attr)
+        if old then
+            redis.call('ZREM', 'index:' .. attr .. ':' .. old, key)
+        end
+    end
+    removed = removed + redis.call('HDEL', key, attr)
+end
+return removed
+"""
+
+# Удалить сущности вместе с их индексами.
+# KEYS — сущности; ARGV — индексируемые атрибуты.
+EAV_DELETE = """
+local deleted = 0
+for _, key in ipairs(KEYS) do
+    for _, attr in ipairs(ARGV) do
+        local old = redis.call('HGET', key, attr)
+        if old then
+            redis.call('ZREM', 'index:' .. attr .. ':' .. old, key)
+        end
+    end
+    deleted = deleted + redis.call('DEL', key)
+end
+return deleted
+"""
+
+# Удалить из списка истории (KEYS[1]) все сообщения с ролью ARGV[1], увеличить версию истории (KEYS[2])
+# и продлить время жизни на ARGV[2] секунд.
+# Возвращает {индекс первого удалённого сообщения, длина списка, версия} или {-1, 0, 0}, если удалять нечего.
+HISTORY_REMOVE_ROLE = """
+local items = redis.call('LRANGE', KEYS[1], 0, -1)
+local kept = {}
+local first = -1
+for i, item in ipairs(items) do
+    local ok, message = pcall(cjson.decode, item)
+    if ok and type(message) == 'table' and message['role'] == ARGV[1] then
+        if first < 0 then
+            first = i - 1
+        end
+    else
+        kept[#kept + 1] = item
+    end
+end
+if first < 0 then
+    return {-1, 0, 0}
+end
+redis.call('DEL', KEYS[1])
+for i = 1, #kept, 1000 do
+    redis.call('RPUSH', KEYS[1], unpack(kept, i, math.min(i + 999, #kept)))
+end
+if #kept > 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+local version = redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return {first, #kept, version}
+"""
+
+# Добавить сообщение повторяемого запроса в историю один раз: если среди последних ARGV[4] сообщений
+# списка KEYS[1] уже есть сообщение с request_id == ARGV[2], вернуть его; иначе добавить ARGV[1],
+# увеличить версию истории (KEYS[2]) и продлить время жизни на ARGV[3] секунд.
+# Возвращает сохранённое сообщение.
+HISTORY_APPEND_ONCE = """
+local tail = redis.call('LRANGE', KEYS[1], -tonumber(ARGV[4]), -1)
+for i = #tail, 1, -1 do
+    local ok, message = pcall(cjson.decode, tail[i])
+    if ok and type(message) == 'table' and message['request_id'] == ARGV[2] then
+        return tail[i]
+    end
+end
+redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return ARGV[1]
+"""
+
+# Сохранить ответ в кэш ответов с вытеснением самых старых записей сверх лимита.
+# KEYS[1] — запись, KEYS[2] — индекс записей (sorted set по времени сохранения);
+# ARGV: ответ, время жизни (сек), текущее время, максимум записей.
+RESPONSE_CACHE_PUT = """
+local now = tonumber(ARGV[3])
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], now, KEYS[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - tonumber(ARGV[2]))
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[4])
+if excess > 0 then
+    local oldest = redis.call('ZRANGE', KEYS[2], 0, excess - 1)
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, excess - 1)
+    redis.call('DEL', unpack(oldest))
+    return excess
+end
+return 0
+"""
+
+SCRIPTS = {
+    "eav_set": EAV_SET,
+    "eav_delete_attributes": EAV_DELETE_ATTRIBUTES,
+    "eav_delete": EAV_DELETE,
+    "history_remove_role": HISTORY_REMOVE_ROLE,
+    "history_append_once": HISTORY_APPEND_ONCE,
+    "response_cache_put": RESPONSE_CACHE_PUT,
+}
+
+
+class RedisScripts:
+    def __init__(self, client):
+        """
+        Реестр Lua-скриптов составных операций: каждая выполняется атомарно за один round-trip (EVALSHA).
+        Скрипты регистрируются один раз на клиент; если Redis перезапущен и скрипта нет в кэше
+        (NOSCRIPT), он загружается заново и вызов повторяется.
+
+        :param client: клиент Redis
+        """
+        self.client = client
+        self._scripts = {name: client.register_script(source) for name, source in SCRIPTS.items()}
+
+    async def run(self, name: str, keys: List[str], args: List[Any]) -> Any:
+        """
+        Выполнить скрипт.
+
+        :param name: имя скрипта из SCRIPTS
+        :param keys: ключи Redis (KEYS)
+        :param args: аргументы (ARGV)
+        :return: результат скрипта
+        """
+        return await self._scripts[name](keys=keys, args=args)
+
+    async def load(self) -> Dict[str, str]:
+        """
+        Загрузить все скрипты в кэш Redis заранее (например, при старте приложения).
+
+        :return: словарь {имя скрипта: sha}
+        """
+        shas = {}
+        for name, script in self._scripts.items():
+            script.sha = await self.client.script_load(script.script)
+            shas[name] = script.sha
+        logger.info(f"Lua-скрипты Redis загружены: {sorted(shas)}")
+        return shas
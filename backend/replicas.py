@@ -0,0 +1,365 @@
+# backend/replicas.py
+
+import json
+import time
+import socket
+import asyncio
+import bisect
+import hashlib
+import logging
+from typing import Dict, Any, List, Optional
+
+import httpx
+import jwt
+
+from async_eav import eav
+from llama_workers import worker_pool
+from scheduler import scheduler
+from settings import settings
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.sha1(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, replica_ids: List[str], vnodes: int = settings.replica_vnodes):
+        """
+        Кольцо консистентного хеширования: у каждой реплики vnodes точек на кольце, ключ принадлежит
+        первой точке по часовой стрелке. При появлении или уходе реплики переезжает только ~1/N ключей.
+
+        :param replica_ids: идентификаторы реплик
+        :param vnodes: виртуальных узлов на реплику (больше — равномернее распределение)
+        """
+        self.replica_ids = sorted(set(replica_ids))
+        points = sorted((_hash(f"{replica_id}#{i}"), replica_id) for replica_id in self.replica_ids for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [replica_id for _, replica_id in points]
+
+    def preference(self, key: str) -> List[str]:
+        """
+        Реплики в порядке обхода кольца от ключа: первая — владелец, дальше — запасные.
+        """
+        if not self._hashes:
+            return []
+        start = bisect.bisect(self._hashes, _hash(key))
+        order: List[str] = []
+        for i in range(len(self._owners)):
+            replica_id = self._owners[(start + i) % len(self._owners)]
+            if replica_id not in order:
+                order.append(replica_id)
+                if len(order) == len(self.replica_ids):
+                    break
+        return order
+
+
+class ReplicaRegistry:
+    # Множество живых реплик (sorted set по времени последнего heartbeat)
+    REPLICAS_KEY = "replicas"
+
+    def __init__(
+        self,
+        client=eav.client,
+        replica_id: str = settings.replica_id,
+        url: str = settings.replica_url,
+        heartbeat_interval: float = settings.replica_heartbeat_interval,
+        overload_ratio: float = settings.replica_overload_ratio,
+        vnodes: int = settings.replica_vnodes,
+    ):
+        """
+        Реестр реплик API в Redis: каждая реплика раз в heartbeat_interval записывает свой адрес,
+        загруженные модели и нагрузку в replica:{id} и продлевает себя в множестве replicas;
+        запись, не обновлявшаяся три интервала, считается ушедшей.
+        Снимок реплик обновляется вместе с heartbeat, поэтому выбор реплики для запроса не обращается к Redis.
+
+        :param client: клиент Redis
+        :param replica_id: имя реплики (по умолчанию — имя хоста)
+        :param url: адрес реплики для других реплик (по умолчанию — http://{имя хоста}:{порт})
+        :param heartbeat_interval: интервал heartbeat (сек)
+        :param overload_ratio: нагрузка (выполняющиеся и ожидающие генерации) относительно лимита генераций,
+            начиная с которой реплика перегружена и новые запросы уходят на следующую реплику кольца
+        :param vnodes: виртуальных узлов на реплику в кольце
+        """
+        self.client = client
+        self.replica_id = replica_id or socket.gethostname()
+        self.url = url or f"http://{socket.gethostname()}:{settings.replica_port}"
+        self.heartbeat_interval = heartbeat_interval
+        self.ttl = heartbeat_interval * 3
+        self.overload_ratio = overload_ratio
+        self.vnodes = vnodes
+        self.replicas: Dict[str, Dict[str, Any]] = {}
+        self.ring = HashRing([], vnodes)
+        self._task: Optional[asyncio.Task] = None
+        self.http: Optional[httpx.AsyncClient] = None
+        self.routed: Dict[str, int] = {"local": 0, "remote": 0, "fallback": 0, "proxy_errors": 0}
+
+    def local_state(self) -> Dict[str, Any]:
+        """
+        Состояние этой реплики: загруженные модели и нагрузка.
+        """
+        stats = scheduler.stats()
+        return {
+            "url": self.url,
+            "models": sorted(worker_pool.workers),
+            "load": stats["active"] + stats["queue_depth"],
+            "capacity": scheduler.global_limit,
+        }
+
+    async def heartbeat(self):
+        """
+        Записать состояние реплики в Redis и обновить снимок живых реплик.
+        """
+        now = time.time()
+        state = self.local_state()
+        key = f"replica:{self.replica_id}"
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping={**state, "models": json.dumps(state["models"]), "updated_at": now})
+            pipe.expire(key, max(1, int(self.ttl)))
+            pipe.zadd(self.REPLICAS_KEY, {self.replica_id: now})
+            pipe.zremrangebyscore(self.REPLICAS_KEY, "-inf", now - self.ttl)
+            pipe.zrange(self.REPLICAS_KEY, 0, -1)
+            *_, replica_ids = await pipe.execute()
+
+        async with self.client.pipeline(transaction=False) as pipe:
+            for replica_id in replica_ids:
+                pipe.hgetall(f"replica:{replica_id}")
+            records = await pipe.execute()
+        replicas = {}
+        for replica_id, record in zip(replica_ids, records):
+            if not record:
+                continue
+            replicas[replica_id] = {
+                "url": record["url"],
+                "models": json.loads(record.get("models") or "[]"),
+                "load": int(record.get("load", 0)),
+                "capacity": int(record.get("capacity", 1)),
+            }
+        self._update(replicas)
+
+    def _update(self, replicas: Dict[str, Dict[str, Any]]):
+        """
+        Внутренний метод: заменить снимок реплик; кольцо перестраивается только при смене состава.
+        """
+        if set(replicas) != set(self.ring.replica_ids):
+            logger.info(f"Состав реплик изменился: {sorted(replicas)}")
+            self.ring = HashRing(list(replicas), self.vnodes)
+        self.replicas = replicas
+
+    def mark_down(self, replica_id: str):
+        """
+        Исключить недоступную реплику из маршрутизации до следующего heartbeat.
+        """
+        replicas = dict(self.replicas)
+        replicas.pop(replica_id, None)
+        self._update(replicas)
+
+    def overloaded(self, replica_id: str) -> bool:
+        state = self.local_state() if replica_id == self.replica_id else self.replicas[replica_id]
+        return state["load"] >= state["capacity"] * self.overload_ratio
+
+    def route(self, history_key: str, model: str) -> Optional[str]:
+        """
+        Реплика для запроса сессии: владелец ключа history_key и модели на кольце; если он перегружен —
+        следующая по кольцу неперегруженная реплика, в первую очередь с уже загруженной моделью.
+        Если перегружены все — владелец.
+
+        :return: идентификатор реплики или None, если реплик нет
+        """
+        order = self.ring.preference(f"{history_key}|{model}")
+        if not order:
+            return None
+        available = [replica_id for replica_id in order if not self.overloaded(replica_id)]
+        if not available or available[0] == order[0]:
+            return order[0]
+        self.routed["fallback"] += 1
+        warm = [replica_id for replica_id in available if model in self.replicas.get(replica_id, {}).get("models", [])]
+        return (warm or available)[0]
+
+    async def _run(self):
+        while True:
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.warning(f"Heartbeat реплики {self.replica_id} не удался: {str(e)}")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def start(self):
+        """
+        Зарегистрировать реплику и запустить heartbeat (при старте приложения).
+        """
+        if self.http is None:
+            self.http = httpx.AsyncClient(timeout=httpx.Timeout(settings.generation_timeout + 30, connect=2))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Остановить heartbeat и убрать реплику из реестра, чтобы её сессии сразу перешли к другим.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.http is not None:
+            await self.http.aclose()
+            self.http = None
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.zrem(self.REPLICAS_KEY, self.replica_id)
+                pipe.delete(f"replica:{self.replica_id}")
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Не удалось снять регистрацию реплики {self.replica_id}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "replica_id": self.replica_id,
+            "replicas": {
+                replica_id: {**state, "overloaded": self.overloaded(replica_id)}
+                for replica_id, state in self.replicas.items()
+            },
+            "routed": dict(self.routed),
+        }
+
+
+def _username(headers: Dict[str, str]) -> Optional[str]:
+    """
+    Внутренний метод: имя пользователя из JWT запроса (без обращения к Redis; проверку выполнит реплика-получатель).
+    """
+    authorization = headers.get("authorization", "")
+    if not authorization.lower().startswith("bearer "):
+        return None
+    token = authorization[len("bearer "):]
+    username = user_cache.get_token(token)
+    if username is None:
+        try:
+            username = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm]).get("sub")
+        except jwt.PyJWTError:
+            return None
+    return username
+
+
+class AffinityRouter:
+    # Запросы генерации, которые выгодно выполнять там, где сессия уже «тёплая»
+    PATHS = ("/api/generate", "/api/generate/stream")
+    # Заголовок проксированного запроса: получатель выполняет его сам, не маршрутизируя дальше
+    ROUTED_HEADER = "x-replica-routed"
+
+    def __init__(self, app, registry: Optional[ReplicaRegistry] = None):
+        """
+        ASGI middleware маршрутизации сессий: запрос генерации выполняется на реплике, которой сессия
+        (history_key и модель) принадлежит на кольце, — там её KV-кэши, история в кэше процесса
+        и загруженная модель. Чужие запросы проксируются владельцу (с потоковой передачей ответа);
+        если владелец недоступен, запрос выполняется локально.
+
+        :param app: ASGI-приложение
+        :param registry: реестр реплик; по умолчанию — общий
+        """
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        registry = self.registry or replica_registry
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in self.PATHS
+            or registry.http is None
+        ):
+            await self.app(scope, receive, send)
+            return
+        headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        if self.ROUTED_HEADER in headers:
+            await self.app(scope, receive, send)
+            return
+
+        body = b""
+        more = True
+        while more:
+            message = await receive()
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+        replay_done = False
+
+        async def replay():
+            nonlocal replay_done
+            if not replay_done:
+                replay_done = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        target = self._target(registry, headers, body)
+        if target is None or target == registry.replica_id or target not in registry.replicas:
+            registry.routed["local"] += 1
+            await self.app(scope, replay, send)
+            return
+        if not await self._proxy(registry, target, scope, headers, body, send):
+            await self.app(scope, replay, send)
+
+    @staticmethod
+    def _target(registry: ReplicaRegistry, headers: Dict[str, str], body: bytes) -> Optional[str]:
+        """
+        Внутренний метод: реплика для запроса по сессии и модели (как history_key в prepare_generation).
+        """
+        username = _username(headers)
+        if username is None:
+            return None
+        try:
+            prompt = json.loads(body or b"{}")
+        except ValueError:
+            return None
+        if not isinstance(prompt, dict):
+            return None
+        session_id = prompt.get("session_id", f"user:{username}")
+        return registry.route(f"history:{username}:{session_id}", str(prompt.get("model") or ""))
+
+    async def _proxy(self, registry: ReplicaRegistry, target: str, scope, headers: Dict[str, str], body: bytes, send) -> bool:
+        """
+        Внутренний метод: передать запрос реплике target и потоком вернуть её ответ.
+
+        :return: False, если реплика недоступна и запрос нужно выполнить локально
+        """
+        url = registry.replicas[target]["url"] + scope["path"]
+        forward = {
+            name: value for name, value in headers.items()
+            if name not in ("host", "content-length", "connection", "transfer-encoding")
+        }
+        forward[self.ROUTED_HEADER] = registry.replica_id
+        started = False
+        try:
+            request = registry.http.build_request("POST", url, content=body, headers=forward)
+            response = await registry.http.send(request, stream=True)
+            try:
+                await send({
+                    "type": "http.response.start",
+                    "status": response.status_code,
+                    "headers": [
+                        (name.encode("latin-1"), value.encode("latin-1"))
+                        for name, value in response.headers.items()
+                        if name.lower() not in ("content-length", "connection", "transfer-encoding")
+                    ],
+                })
+                started = True
+                async for chunk in response.aiter_raw():
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            finally:
+                await response.aclose()
+        except httpx.HTTPError as e:
+            registry.routed["proxy_errors"] += 1
+            if started:
+                logger.error(f"Ответ реплики {target} прерван: {str(e)}")
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return True
+            logger.warning(f"Реплика {target} недоступна, запрос выполняется локально: {str(e)}")
+            registry.mark_down(target)
+            registry.routed["local"] += 1
+            return False
+        registry.routed["remote"] += 1
+        return True
+
+
+# Инициализация реестра реплик
+replica_registry = ReplicaRegistry()
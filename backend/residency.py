@@ -0,0 +1,84 @@
+# backend/residency.py
+
+import os
+import logging
+from typing import Dict, Any, Optional
+
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Доля оперативной памяти под модели, если бюджет не задан
+DEFAULT_BUDGET_SHARE = 0.75
+
+
+def estimate_footprint_mb(model_config: Dict[str, Any]) -> float:
+    """
+    Оценить память, которую займёт загруженная модель: веса (размер файла, модель читается
+    целиком из-за --no-mmap), KV-кэш на контекст всех слотов в f16 и запас на вычислительные буферы.
+
+    :param model_config: конфигурация модели с метаданными GGUF
+    :return: оценка в МБ
+    """
+    weights = float(model_config.get("size") or 0)
+    if not weights and model_config.get("path") and os.path.isfile(model_config["path"]):
+        weights = os.path.getsize(model_config["path"]) / MB
+
+    kv = 0.0
+    n_layers = model_config.get("block_count")
+    n_embd = model_config.get("embedding_length")
+    n_head = model_config.get("head_count")
+    if n_layers and n_embd and n_head:
+        n_head_kv = model_config.get("head_count_kv") or n_head
+        # Контекст всех параллельных слотов llama-server
+        if model_config.get("slot_ctx"):
+            n_ctx = model_config["slot_ctx"] * model_config.get("n_slots", 1)
+        else:
+            n_ctx = model_config.get("max_ctx", settings.max_ctx_size)
+        # K и V: слои × контекст × (размер головы × число KV-голов) × 2 байта
+        kv = 2 * n_layers * n_ctx * (n_embd // n_head) * n_head_kv * 2 / MB
+    return round(weights + kv + settings.model_overhead_mb, 1)
+
+
+def process_rss_mb(pid: int) -> Optional[float]:
+    """
+    Резидентная память процесса (VmRSS из /proc) в МБ или None, если процесса нет.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+def total_memory_mb() -> Optional[float]:
+    """
+    Объём оперативной памяти (MemTotal из /proc/meminfo) в МБ.
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def memory_budget_mb(configured: int = settings.model_memory_budget_mb) -> float:
+    """
+    Бюджет памяти на загруженные модели: из настроек или доля оперативной памяти.
+    Если объём памяти неизвестен, бюджет не ограничен.
+    """
+    if configured > 0:
+        return float(configured)
+    total = total_memory_mb()
+    if total is None:
+        logger.warning("Объём оперативной памяти неизвестен, бюджет памяти моделей не ограничен")
+        return float("inf")
+    return round(total * DEFAULT_BUDGET_SHARE, 1)
@@ -0,0 +1,117 @@
+# backend/response_cache.py
+
+import json
+import time
+import hashlib
+import logging
+from typing import Dict, Any, Optional
+
+from async_eav import eav
+from redis_scripts import RedisScripts
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    # Индекс записей кэша (sorted set по времени сохранения) для ограничения размера
+    INDEX_KEY = "response_cache:index"
+
+    def __init__(
+        self,
+        client=eav.client,
+        ttl: int = settings.response_cache_ttl,
+        max_entries: int = settings.response_cache_max_entries,
+        max_bytes: int = settings.response_cache_max_bytes,
+    ):
+        """
+        Кэш ответов детерминированных генераций (seed задан и temperature 0, либо явный флаг cache).
+        Ответ такой генерации — функция модели, prompt'а и параметров, поэтому ключ — хеш этих данных.
+
+        :param client: клиент Redis
+        :param ttl: время жизни записи (сек)
+        :param max_entries: максимум записей; самые старые вытесняются
+        :param max_bytes: ответы больше этого размера не кэшируются
+        """
+        self.client = client
+        self.scripts = RedisScripts(client)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+
+    @staticmethod
+    def applies(params: Dict[str, Any], flag: Optional[bool] = None) -> bool:
+        """
+        Можно ли кэшировать генерацию: явный флаг cache или фиксированный seed при temperature 0.
+
+        :param params: параметры генерации
+        :param flag: флаг cache из запроса (None — решить по параметрам)
+        """
+        if flag is not None:
+            return bool(flag)
+        try:
+            seed = params.get("seed")
+            return seed is not None and int(seed) >= 0 and float(params.get("temperature") or 0) == 0
+        except (TypeError, ValueError):
+            return False
+
+    @staticmethod
+    def key(model_name: str, model_config: Dict[str, Any], prompt_text: str, params: Dict[str, Any]) -> str:
+        """
+        Ключ записи: хеш модели (имя и дата изменения файла), prompt'а и параметров генерации.
+        """
+        material = json.dumps(
+            [model_name, model_config.get("modified"), prompt_text, params],
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return f"response_cache:{hashlib.sha256(material.encode('utf-8')).hexdigest()}"
+
+    async def get(self, key: str) -> Optional[str]:
+        """
+        Ответ из кэша или None.
+        """
+        try:
+            response = await self.client.get(key)
+        except Exception as e:
+            logger.warning(f"Кэш ответов недоступен: {str(e)}")
+            return None
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    async def put(self, key: str, response: str):
+        """
+        Сохранить ответ; при превышении лимита записей вытесняются самые старые.
+        """
+        if len(response.encode("utf-8")) > self.max_bytes:
+            return
+        try:
+            evicted = await self.scripts.run(
+                "response_cache_put",
+                [key, self.INDEX_KEY],
+                [response, self.ttl, time.time(), self.max_entries]
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить ответ в кэш: {str(e)}")
+            return
+        self.stored += 1
+        self.evicted += evicted
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stored": self.stored,
+            "evicted": self.evicted,
+        }
+
+
+# Инициализация кэша ответов
+response_cache = ResponseCache()
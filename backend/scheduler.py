@@ -0,0 +1,261 @@
+# backend/scheduler.py
+
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque, defaultdict
+from typing import Dict, Any, Optional
+
+from fastapi import HTTPException
+
+from settings import settings
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: короткие prompt'ы обслуживаются раньше длинных
+LANES = ("short", "long")
+
+
+class Ticket:
+    def __init__(self, model: str, username: str, lane: str):
+        """
+        Заявка на генерацию в очереди планировщика.
+
+        :param model: имя модели
+        :param username: имя пользователя
+        :param lane: полоса приоритета (short или long)
+        """
+        self.model = model
+        self.username = username
+        self.lane = lane
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class GenerationScheduler:
+    def __init__(
+        self,
+        global_limit: int = settings.scheduler_global_limit,
+        model_limit: int = settings.scheduler_model_limit,
+        max_queue: int = settings.scheduler_max_queue,
+        max_wait: float = settings.scheduler_max_wait,
+        short_prompt_tokens: int = settings.scheduler_short_prompt_tokens,
+        short_burst: int = settings.scheduler_short_burst,
+    ):
+        """
+        Планировщик допуска генераций: ограничивает число одновременных генераций
+        на модель и глобально, ставит остальные в очередь с честным чередованием пользователей.
+
+        :param global_limit: максимум одновременных генераций на процесс
+        :param model_limit: максимум одновременных генераций на модель по умолчанию
+        :param max_queue: максимальная длина очереди, после неё — 429
+        :param max_wait: максимальное ожидаемое время в очереди (сек), после него — 429
+        :param short_prompt_tokens: prompt не длиннее этого числа токенов идёт в полосу short
+        :param short_burst: сколько short-заявок подряд можно выдать, пока ждут long-заявки
+        """
+        self.global_limit = global_limit
+        self.model_limit = model_limit
+        self.model_limits: Dict[str, int] = {}
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.short_prompt_tokens = short_prompt_tokens
+        self.short_burst = short_burst
+
+        # полоса -> пользователь -> очередь заявок; порядок пользователей задаёт round-robin
+        self._queues: Dict[str, "OrderedDict[str, deque]"] = {lane: OrderedDict() for lane in LANES}
+        self._active: Dict[str, int] = defaultdict(int)
+        self._active_total = 0
+        self._short_streak = 0
+
+        # Статистика: скользящие средние времени ожидания и генерации
+        self._avg_wait = 0.0
+        self._avg_service: Dict[str, float] = {}
+        self._admitted = 0
+        self._rejected = 0
+
+    def set_model_limit(self, model: str, limit: int):
+        """
+        Задать лимит одновременных генераций для конкретной модели.
+        """
+        self.model_limits[model] = limit
+        self._dispatch()
+
+    def _limit_for(self, model: str) -> int:
+        return self.model_limits.get(model, self.model_limit)
+
+    def queue_depth(self) -> int:
+        return sum(len(q) for lane in self._queues.values() for q in lane.values())
+
+    def free_capacity(self) -> int:
+        """
+        Сколько генераций можно допустить сразу, без очереди (по глобальному лимиту).
+        """
+        return max(0, self.global_limit - self._active_total - self.queue_depth())
+
+    def estimated_wait(self, model: str) -> float:
+        """
+        Оценить время ожидания новой заявки для модели (сек).
+        """
+        ahead = sum(
+            1
+            for lane in self._queues.values()
+            for q in lane.values()
+            for ticket in q
+            if ticket.model == model
+        )
+        if ahead == 0 and self._active[model] < self._limit_for(model) and self._active_total < self.global_limit:
+            return 0.0
+        service = self._avg_service.get(model, 0.0)
+        return (ahead + 1) * service / max(1, self._limit_for(model))
+
+    def check(self, model: str, username: str):
+        """
+        Проверить, что заявка будет принята (очередь не переполнена и ожидание не слишком долгое),
+        не вставая в очередь: отказ до подготовки запроса, которая пишет в историю.
+
+        :raises HTTPException: 429 с Retry-After
+        """
+        wait = self.estimated_wait(model)
+        if self.queue_depth() >= self.max_queue or wait > self.max_wait:
+            self._rejected += 1
+            retry_after = max(1, math.ceil(wait))
+            logger.warning(f"Очередь генерации переполнена, отказ {username} (ожидание ~{wait:.1f} с)")
+            raise HTTPException(
+                status_code=429,
+                detail="Слишком много запросов на генерацию, повторите позже",
+                headers={"Retry-After": str(retry_after)}
+            )
+
+    async def acquire(self, model: str, username: str, prompt_tokens: int) -> Ticket:
+        """
+        Встать в очередь и дождаться разрешения на генерацию.
+
+        :param model: имя модели
+        :param username: имя пользователя
+        :param prompt_tokens: размер prompt'а в токенах (для выбора полосы)
+        :return: заявка, которую нужно вернуть через release()
+        :raises HTTPException: 429, если очередь переполнена или ожидание слишком долгое
+        """
+        self.check(model, username)
+        lane = "short" if prompt_tokens <= self.short_prompt_tokens else "long"
+        ticket = Ticket(model, username, lane)
+        # Метрика до постановки в очередь: её ошибка не должна оставить в очереди заявку, которую никто не освободит
+        metrics.QUEUE_DEPTH.labels(model).inc()
+        self._queues[lane].setdefault(username, deque()).append(ticket)
+        try:
+            self._dispatch()
+            await ticket.future
+        except BaseException:
+            if ticket.started_at is not None:
+                self.release(ticket)
+            else:
+                self._remove(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: Optional[Ticket]):
+        """
+        Освободить место после завершения генерации и допустить следующие заявки.
+        """
+        if ticket is None or ticket.started_at is None:
+            return
+        duration = time.monotonic() - ticket.started_at
+        previous = self._avg_service.get(ticket.model)
+        self._avg_service[ticket.model] = duration if previous is None else 0.8 * previous + 0.2 * duration
+        ticket.started_at = None
+        self._active[ticket.model] -= 1
+        self._active_total -= 1
+        metrics.ACTIVE_GENERATIONS.labels(ticket.model).dec()
+        self._dispatch()
+
+    def _remove(self, ticket: Ticket):
+        """
+        Внутренний метод: убрать отменённую заявку из очереди.
+        """
+        queue = self._queues[ticket.lane].get(ticket.username)
+        if queue is None:
+            return
+        try:
+            queue.remove(ticket)
+        except ValueError:
+            return
+        metrics.QUEUE_DEPTH.labels(ticket.model).dec()
+        if not queue:
+            del self._queues[ticket.lane][ticket.username]
+
+    def _pick(self, lane: str) -> Optional[Ticket]:
+        """
+        Внутренний метод: выбрать следующую заявку полосы по кругу пользователей,
+        пропуская заявки к моделям, у которых нет свободных мест.
+        """
+        users = self._queues[lane]
+        for username in list(users.keys()):
+            queue = users[username]
+            for ticket in queue:
+                if self._active[ticket.model] < self._limit_for(ticket.model):
+                    queue.remove(ticket)
+                    metrics.QUEUE_DEPTH.labels(ticket.model).dec()
+                    # Пользователь уходит в конец круга
+                    del users[username]
+                    if queue:
+                        users[username] = queue
+                    return ticket
+        return None
+
+    def _dispatch(self):
+        """
+        Внутренний метод: допустить заявки, пока есть свободные места.
+        """
+        while self._active_total < self.global_limit:
+            long_waiting = bool(self._queues["long"])
+            if long_waiting and self._short_streak >= self.short_burst:
+                order = ("long", "short")
+            else:
+                order = LANES
+
+            ticket = None
+            for lane in order:
+                ticket = self._pick(lane)
+                if ticket is not None:
+                    break
+            if ticket is None:
+                return
+            if ticket.future.done():
+                # Заявка отменена, но ещё не убрана из очереди
+                continue
+
+            self._short_streak = self._short_streak + 1 if ticket.lane == "short" else 0
+            ticket.started_at = time.monotonic()
+            self._active[ticket.model] += 1
+            self._active_total += 1
+            self._admitted += 1
+            wait = ticket.started_at - ticket.enqueued_at
+            self._avg_wait = 0.8 * self._avg_wait + 0.2 * wait
+            ticket.future.set_result(None)
+            metrics.ACTIVE_GENERATIONS.labels(ticket.model).inc()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Статистика очереди: глубина по полосам, активные генерации, время ожидания.
+        """
+        return {
+            "queue_depth": self.queue_depth(),
+            "queue_depth_by_lane": {
+                lane: sum(len(q) for q in users.values())
+                for lane, users in self._queues.items()
+            },
+            "active": self._active_total,
+            "active_by_model": {model: count for model, count in self._active.items() if count},
+            "global_limit": self.global_limit,
+            "avg_wait_seconds": round(self._avg_wait, 3),
+            "avg_generation_seconds": {model: round(value, 3) for model, value in self._avg_service.items()},
+            "admitted": self._admitted,
+            "rejected": self._rejected,
+        }
+
+
+# Инициализация планировщика
+scheduler = GenerationScheduler()
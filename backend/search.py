@@ -0,0 +1,166 @@
+# backend/search.py
+
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+import httpx
+
+from async_eav import eav
+from settings import settings
+from utils import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+NOT_FOUND = "Ничего не найдено."
+SEARCH_DISABLED = "Поиск в интернете отключен."
+SEARCH_FAILED = "Ошибка при попытке поиска в интернете."
+
+
+class WebSearch:
+    def __init__(
+        self,
+        url: str = settings.search_url,
+        timeout: float = settings.search_timeout,
+        cache_ttl: int = settings.search_cache_ttl,
+        local_cache_size: int = settings.search_local_cache_size,
+        enabled: bool = settings.search_enabled,
+        client=eav.client,
+    ):
+        """
+        Поиск в интернете для use_search (API в формате DuckDuckGo Instant Answer).
+        Один HTTP-клиент с keep-alive на процесс, кэш результатов в Redis и в памяти процесса
+        по нормализованному запросу, одинаковые одновременные запросы объединяются в один.
+
+        :param url: адрес API поиска
+        :param timeout: таймаут запроса к API (сек)
+        :param cache_ttl: время жизни результата в кэше (сек)
+        :param local_cache_size: сколько результатов держать в памяти процесса
+        :param enabled: включён ли поиск
+        :param client: клиент Redis
+        """
+        self.url = url
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.local_cache_size = local_cache_size
+        self.enabled = enabled
+        self.redis = client
+        self.http: Optional[httpx.AsyncClient] = None
+        self._local: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def start(self):
+        """
+        Создать общий HTTP-клиент (при старте приложения).
+        """
+        if self.http is None:
+            self.http = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_keepalive_connections=10, keepalive_expiry=60),
+            )
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.aclose()
+            self.http = None
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """
+        Нормализованный запрос: регистр и пробелы не влияют на кэш.
+        """
+        return " ".join(query.lower().split())
+
+    @staticmethod
+    def _key(normalized: str) -> str:
+        return f"search:{hashlib.sha1(normalized.encode('utf-8')).hexdigest()}"
+
+    async def search(self, query: str) -> str:
+        """
+        Найти краткий ответ на запрос.
+
+        :param query: поисковый запрос
+        :return: результат поиска или сообщение об ошибке
+        """
+        if not self.enabled:
+            logger.info("Поиск в интернете отключен")
+            return SEARCH_DISABLED
+
+        normalized = self.normalize(query)
+        key = self._key(normalized)
+        cached = self._local.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            self._local.move_to_end(key)
+            self.hits += 1
+            return cached[0]
+        return await self._flight.do(key, lambda: self._lookup(key, normalized))
+
+    async def _lookup(self, key: str, normalized: str) -> str:
+        """
+        Внутренний метод: результат из Redis или запрос к API с сохранением в кэш.
+        """
+        try:
+            result = await self.redis.get(key)
+        except Exception as e:
+            logger.warning(f"Кэш поиска недоступен: {str(e)}")
+            result = None
+        if result is not None:
+            self.hits += 1
+            self._remember(key, result)
+            return result
+
+        self.misses += 1
+        try:
+            result = await self._fetch(normalized)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Ошибка поиска в интернете: {str(e)}", exc_info=True)
+            return SEARCH_FAILED
+        logger.info(f"Результат поиска: {result}")
+
+        self._remember(key, result)
+        try:
+            await self.redis.set(key, result, ex=self.cache_ttl)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить результат поиска в кэш: {str(e)}")
+        return result
+
+    async def _fetch(self, query: str) -> str:
+        """
+        Внутренний метод: запрос к API поиска.
+        """
+        if self.http is None:
+            await self.start()
+        response = await self.http.get(self.url, params={"q": query, "format": "json", "no_html": 1})
+        response.raise_for_status()
+        data = response.json()
+        topics = data.get("RelatedTopics") or [{}]
+        return data.get("Abstract") or topics[0].get("Text") or NOT_FOUND
+
+    def _remember(self, key: str, result: str):
+        """
+        Внутренний метод: сохранить результат в кэш процесса.
+        """
+        self._local[key] = (result, time.monotonic() + self.cache_ttl)
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_cache_size:
+            self._local.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "local_entries": len(self._local),
+            **self._flight.stats(),
+        }
+
+
+# Инициализация поиска
+web_search = WebSearch()
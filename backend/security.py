@@ -5,11 +5,13 @@ import logging
 
 from fastapi import HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 
 from async_eav import eav
+from user_cache import user_cache
+from hashing import password_hasher
 from settings import settings
+import metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,14 +23,12 @@ ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire / 60
 # OAuth2 схема для извлечения токена
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/user/login")
 
-# Настройка хеширования паролей (bcrypt)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Хеширование паролей — общий сервис в пуле потоков (hashing.py)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.verify(plain_password, hashed_password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    return await password_hasher.hash(password)
 
 
 # Генерация JWT
@@ -47,17 +47,28 @@ def create_access_token(data: dict):
 
 
 # Валидация JWT
+@metrics.timed("auth")
 async def get_current_user(token: str = Depends(oauth2_scheme)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
+    # Проверенный ранее токен не декодируется повторно
+    username = user_cache.get_token(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.PyJWTError:
+            raise HTTPException(status_code=401, detail="Недействительный токен")
+        username = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=401, detail="Недействительный токен!")
+        user_cache.put_token(token, username, payload.get("exp"))
+
+    user = user_cache.get_user(username)
+    if user is None:
         # Проверка существования пользователя в EAV
+        generation = user_cache.generation
         user_data = await eav.get_all_attributes(f"user:{username}")
         if not user_data:
             raise HTTPException(status_code=401, detail="Пользователь не найден")
-        return {"username": username, "role": user_data.get("role", "user")}
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=401, detail="Недействительный токен")
+        user = {"username": username, "role": user_data.get("role", "user")}
+        user_cache.put_user(username, user, generation)
+    return dict(user)
 
@@ -1,5 +1,7 @@
 # backend/settings.py
 
+from typing import Dict, List
+
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -10,6 +12,113 @@ class Settings(BaseSettings):
     algorithm: str = "HS256"
     # время жизни в секундах
     access_token_expire: int = 60 * 60
+    # Атрибуты EAV, по которым ведутся вторичные индексы (index:{атрибут}:{значение})
+    eav_indexed_attributes: List[str] = ["role"]
+    # Кэш пользователей в процессе: время жизни записи (сек) и максимум записей
+    user_cache_ttl: float = 30.0
+    user_cache_max_entries: int = 10000
+    # Хеширование паролей: схемы (первая — для новых паролей, остальные перехешируются при входе),
+    # параметры стоимости, размер пула потоков и максимум ожидающих операций
+    password_schemes: List[str] = ["argon2", "bcrypt"]
+    password_bcrypt_rounds: int = 12
+    password_argon2_time_cost: int = 3
+    password_argon2_memory_cost: int = 65536
+    password_argon2_parallelism: int = 2
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 64
+    # Поиск в интернете (use_search): адрес API, таймаут (сек), время жизни кэша (сек)
+    # и размер кэша процесса
+    search_enabled: bool = True
+    search_url: str = "https://api.duckduckgo.com/"
+    search_timeout: float = 10.0
+    search_cache_ttl: int = 3600
+    search_local_cache_size: int = 1024
+    # Кэш ответов детерминированных генераций: время жизни (сек), максимум записей
+    # и максимальный размер одного ответа (байт)
+    response_cache_ttl: int = 24 * 60 * 60
+    response_cache_max_entries: int = 10000
+    response_cache_max_bytes: int = 64 * 1024
+    # Скорость генерации по моделям: сколько последних замеров хранить в Redis для p50/p95
+    timings_window: int = 1000
+    # Каталог моделей и минимальный интервал проверки его изменений (сек)
+    model_dir: str = "/llama.cpp/models/"
+    model_registry_check_interval: float = 5.0
+    # Каталог с исполняемыми файлами llama.cpp (llama-server, llama-cli), который проверяется
+    # раньше стандартных путей сборки; пусто — только стандартные пути (например, заглушки бенчмарков)
+    llama_bin_dir: str = ""
+    # Верхний предел размера контекста (-c); фактический берётся из метаданных GGUF модели
+    max_ctx_size: int = 8192
+    # Воркеры llama-server: таймаут загрузки модели, интервал проверки здоровья (сек)
+    worker_startup_timeout: int = 180
+    worker_health_interval: int = 15
+    # Резидентность моделей: бюджет памяти на загруженные модели (МБ, 0 — 75% оперативной памяти),
+    # модели, загружаемые и прогреваемые при старте, и запас памяти на вычислительные буферы (МБ)
+    model_memory_budget_mb: int = 0
+    model_preload: List[str] = []
+    model_overhead_mb: int = 256
+    # Непрерывный батчинг: число параллельных слотов llama-server на модель (-np) и контекст одного
+    # слота в токенах (0 — весь контекст модели); переопределения по моделям —
+    # JSON вида {"модель": значение}
+    worker_slots: int = 4
+    worker_slot_ctx: int = 0
+    worker_model_slots: Dict[str, int] = {}
+    worker_model_slot_ctx: Dict[str, int] = {}
+    # Распределение ядер CPU между генерациями: закреплять ли процессы llama.cpp за непересекающимися
+    # наборами ядер, минимум физических ядер на генерацию, физических ядер на воркер llama-server
+    # (0 — все не занятые другими воркерами) и каталог топологии в sysfs
+    cpu_pinning: bool = True
+    cpu_min_cores: int = 1
+    cpu_server_cores: int = 0
+    cpu_sysfs_root: str = "/sys/devices/system"
+    # Максимальное время генерации одного ответа (сек)
+    generation_timeout: int = 300
+    # Планировщик генераций: лимиты одновременных генераций, очередь и полосы приоритета
+    scheduler_global_limit: int = 8
+    scheduler_model_limit: int = 1
+    scheduler_max_queue: int = 32
+    scheduler_max_wait: float = 120.0
+    scheduler_short_prompt_tokens: int = 256
+    scheduler_short_burst: int = 4
+    # Асинхронные задания генерации (очередь на Redis Streams): выполняет ли API генерацию сам
+    # (false — /api/generate идёт через очередь к отдельным воркерам job_worker.py), время хранения
+    # задания (сек), попыток до dead-letter, простой задания упавшего воркера до повторной выдачи (мс),
+    # максимальная длина потока, максимальное ожидание long-poll (сек), одновременных заданий на воркер,
+    # ожидание новых заданий (мс, меньше таймаута сокета клиента Redis) и имя воркера в группе (пусто — хост и pid)
+    api_inference: bool = True
+    job_result_ttl: int = 24 * 60 * 60
+    job_max_attempts: int = 3
+    job_claim_idle_ms: int = 60000
+    job_stream_maxlen: int = 100000
+    job_max_wait: float = 60.0
+    job_worker_concurrency: int = 4
+    job_poll_ms: int = 2000
+    job_consumer: str = ""
+    # Маршрутизация сессий между репликами API (при API_INFERENCE): включена ли, имя реплики и её адрес
+    # для других реплик (пусто — имя хоста и REPLICA_PORT), интервал heartbeat в Redis (сек), виртуальных
+    # узлов на реплику в кольце консистентного хеширования и нагрузка относительно лимита генераций,
+    # начиная с которой реплика перегружена и новые запросы сессии уходят на следующую реплику кольца
+    replica_routing: bool = True
+    replica_id: str = ""
+    replica_url: str = ""
+    replica_port: int = 5555
+    replica_heartbeat_interval: float = 2.0
+    replica_vnodes: int = 64
+    replica_overload_ratio: float = 1.5
+    # Сколько сессий держать в кэше истории процесса
+    history_cache_sessions: int = 1024
+    # Кэш KV/prompt'ов сессий: каталог, бюджет на диске (МБ) и максимум сессий
+    prompt_cache_dir: str = "/llama.cpp/cache/prompts"
+    prompt_cache_disk_budget_mb: int = 4096
+    prompt_cache_max_sessions: int = 256
+    # Тексты длиннее этого числа символов токенизируются в пуле потоков, а не в event loop
+    tokenize_inline_chars: int = 2048
+    # Бюджет prompt'а в токенах (0 — весь контекст модели за вычетом ответа);
+    # при переполнении окно истории сдвигается так, чтобы занять долю context_refill_ratio бюджета
+    context_budget_tokens: int = 0
+    context_refill_ratio: float = 0.75
+    # Краткое содержание вытесненных из окна сообщений (отдельная генерация той же моделью)
+    context_summary_enabled: bool = False
+    context_summary_tokens: int = 256
 
     class Config:
         env_file = ".env"
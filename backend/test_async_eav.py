@@ -8,7 +8,7 @@ async def eav():
     await eav_instance.client.flushdb()
     yield eav_instance
     await eav_instance.client.flushdb()
-    await eav_instance.client.close()
+    await eav_instance.client.aclose()
 
 # Положительные тесты - ваши существующие ...
 
@@ -54,3 +54,81 @@ async def test_find_entities_by_attribute_no_matches(eav):
     result = await eav.find_entities_by_attribute("status", "inactive")
     assert result == []
 
+
+# --------------- Пакетные операции -----------------
+
+@pytest.mark.asyncio
+async def test_create_entity_replaces_existing(eav):
+    await eav.create_entity("user:20", {"name": "Ann", "age": "30"})
+    await eav.create_entity("user:20", {"name": "Bob"}, ttl=60)
+    assert await eav.get_all_attributes("user:20") == {"name": "Bob"}
+    assert 0 < await eav.client.ttl("user:20") <= 60
+
+@pytest.mark.asyncio
+async def test_get_many_and_attributes_many(eav):
+    await eav.create_entity("user:21", {"name": "Ann", "role": "admin"})
+    await eav.create_entity("user:22", {"name": "Bob", "role": "user"})
+    many = await eav.get_many(["user:21", "user:22", "user:missing"])
+    assert many == {
+        "user:21": {"name": "Ann", "role": "admin"},
+        "user:22": {"name": "Bob", "role": "user"},
+    }
+    roles = await eav.get_attributes_many(["user:21", "user:missing"], ["role"])
+    assert roles == {"user:21": {"role": "admin"}, "user:missing": {"role": None}}
+
+@pytest.mark.asyncio
+async def test_delete_many(eav):
+    await eav.create_entity("user:23", {"name": "Ann"})
+    await eav.create_entity("user:24", {"name": "Bob"})
+    assert await eav.delete_many(["user:23", "user:24", "user:missing"]) == 2
+    assert await eav.get_many(["user:23", "user:24"]) == {}
+
+# --------------- Индексы -----------------
+
+@pytest_asyncio.fixture
+async def indexed_eav():
+    eav_instance = AsyncEAVWithIndex(redis_url="redis://redis:6379/0", indexed_attributes=["role"])
+    await eav_instance.client.flushdb()
+    yield eav_instance
+    await eav_instance.client.flushdb()
+    await eav_instance.client.aclose()
+
+@pytest.mark.asyncio
+async def test_index_follows_attribute_changes(indexed_eav):
+    await indexed_eav.create_entity("user:a", {"role": "admin"})
+    await indexed_eav.create_entity("user:b", {"role": "user"})
+    assert await indexed_eav.find_entities_by_attribute("role", "admin") == ["user:a"]
+
+    await indexed_eav.update_entity("user:b", {"role": "admin"})
+    assert await indexed_eav.find_entities_by_attribute("role", "admin") == ["user:a", "user:b"]
+    assert await indexed_eav.find_entities_by_attribute("role", "user") == []
+
+    await indexed_eav.delete_attribute("user:a", "role")
+    await indexed_eav.delete_entity("user:b")
+    assert await indexed_eav.find_entities_by_attribute("role", "admin") == []
+
+@pytest.mark.asyncio
+async def test_find_entities_page_with_prefix(indexed_eav):
+    for name in ("a", "b", "c"):
+        await indexed_eav.create_entity(f"user:{name}", {"role": "user"})
+    await indexed_eav.create_entity("bot:x", {"role": "user"})
+
+    page, cursor = await indexed_eav.find_entities_page("role", "user", prefix="user:", limit=2)
+    assert page == ["user:a", "user:b"] and cursor == "user:b"
+    page, cursor = await indexed_eav.find_entities_page("role", "user", prefix="user:", cursor=cursor, limit=2)
+    assert page == ["user:c"] and cursor is None
+
+@pytest.mark.asyncio
+async def test_rebuild_index_for_existing_entities(indexed_eav):
+    await indexed_eav.client.hset("user:old", mapping={"role": "admin"})
+    assert await indexed_eav.rebuild_index()
+    assert await indexed_eav.find_entities_by_attribute("role", "admin") == ["user:old"]
+    assert not await indexed_eav.rebuild_index()
+
+@pytest.mark.asyncio
+async def test_scripts_reload_after_flush(indexed_eav):
+    await indexed_eav.create_entity("user:a", {"role": "admin"})
+    # Как после перезапуска Redis: кэш скриптов пуст
+    await indexed_eav.client.script_flush()
+    await indexed_eav.delete_entity("user:a")
+    assert await indexed_eav.find_entities_by_attribute("role", "admin") == []
@@ -0,0 +1,28 @@
+from context_window import context_budget, select_window
+
+
+def test_window_keeps_everything_that_fits():
+    counts = [10, 10, 10]
+    assert select_window(counts.__getitem__, len(counts), 100) == 0
+
+
+def test_window_always_keeps_latest_turn():
+    counts = [50, 50, 40]
+    assert select_window(counts.__getitem__, len(counts), 40) == 2
+    assert select_window(counts.__getitem__, len(counts), 39) is None
+
+
+def test_window_start_is_stable_until_overflow():
+    counts = [10] * 10
+    # Прежнее начало помещается — не сдвигается, хотя можно было бы взять больше сообщений
+    assert select_window(counts.__getitem__, 10, 100, previous_start=4) == 4
+    # Переполнение — окно заполняется заново до доли бюджета
+    assert select_window(counts.__getitem__, 10, 60, previous_start=2, refill_ratio=0.5) == 7
+
+
+def test_budget_leaves_room_for_answer():
+    assert context_budget({"max_ctx": 4096}, 512) == 3584
+    assert context_budget({"max_ctx": 4096, "context_budget": 1024}, 512) == 1024
+    # Контекст слота — только для llama-server, llama-cli работает со всем контекстом модели
+    assert context_budget({"max_ctx": 4096, "slot_ctx": 1024}, 512) == 512
+    assert context_budget({"max_ctx": 4096, "slot_ctx": 1024}, 512, server=False) == 3584
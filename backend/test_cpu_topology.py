@@ -0,0 +1,106 @@
+import os
+import pytest
+import cpu_topology
+from cpu_topology import CoreAllocator, CpuTopology, parse_cpu_list, format_cpu_list
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+    """
+    Два NUMA-узла по 4 физических ядра с SMT: CPU N и N+8 — потоки одного ядра.
+    """
+    root = tmp_path / "system"
+    (root / "cpu").mkdir(parents=True)
+    (root / "cpu" / "online").write_text("0-15\n")
+    for cpu in range(16):
+        topology = root / "cpu" / f"cpu{cpu}" / "topology"
+        topology.mkdir(parents=True)
+        core = cpu % 8
+        (topology / "core_id").write_text(f"{core % 4}\n")
+        (topology / "physical_package_id").write_text(f"{core // 4}\n")
+    for node, cpus in ((0, "0-3,8-11"), (1, "4-7,12-15")):
+        (root / "node" / f"node{node}").mkdir(parents=True)
+        (root / "node" / f"node{node}" / "cpulist").write_text(cpus + "\n")
+    return str(root)
+
+
+@pytest.fixture
+def pinned(monkeypatch):
+    """
+    Маски, которые распределитель выставил бы потокам процессов.
+    """
+    masks = {}
+    monkeypatch.setattr(cpu_topology.os, "sched_setaffinity", lambda tid, cpus: masks.__setitem__(tid, sorted(cpus)))
+    return masks
+
+
+def test_cpu_list_format():
+    assert parse_cpu_list("0-3,8,10-11") == [0, 1, 2, 3, 8, 10, 11]
+    assert format_cpu_list([0, 1, 2, 5, 8, 9]) == "0-2,5,8-9"
+
+
+def test_read_topology(sysfs):
+    topology = CpuTopology.read(sysfs)
+    assert topology.stats() == {"cpus": 16, "physical_cores": 8, "numa_nodes": 2}
+    # Ядра упорядочены по узлам, SMT-соседи — в одном ядре
+    assert topology.cores[:4] == [[0, 8], [1, 9], [2, 10], [3, 11]]
+    assert topology.cores[4] == [4, 12]
+
+    # CPU, недоступные процессу (cpuset), не учитываются
+    limited = CpuTopology.read(sysfs, allowed={0, 1, 8})
+    assert limited.cores == [[0, 8], [1]]
+
+
+def test_disjoint_allocations_follow_load(sysfs, pinned):
+    allocator = CoreAllocator(CpuTopology.read(sysfs), enabled=True)
+    first = allocator.acquire("a")
+    allocator.attach(first, os.getpid())
+    assert first.cpus == list(range(16))
+    assert (first.threads, first.batch_threads) == (8, 16)
+
+    # Второй потребитель — ядра делятся пополам по NUMA-узлам, маска первого сужается
+    second = allocator.acquire("b")
+    assert first.cpus == [0, 1, 2, 3, 8, 9, 10, 11]
+    assert second.cpus == [4, 5, 6, 7, 12, 13, 14, 15]
+    assert (second.threads, second.batch_threads) == (4, 8)
+    assert pinned[os.getpid()] == first.cpus
+
+    # Нагрузка третьего выше — он получает больше ядер, наборы не пересекаются
+    third = allocator.acquire("c", weight=2)
+    assert [len(lease.cores) for lease in (first, second, third)] == [2, 2, 4]
+    assert not set(first.cpus) & set(second.cpus) and not set(second.cpus) & set(third.cpus)
+    allocator.release(third)
+
+    # Второй завершился — первый снова получает все ядра
+    allocator.release(second)
+    assert first.cpus == list(range(16))
+    assert pinned[os.getpid()] == list(range(16))
+
+
+def test_more_consumers_than_cores(sysfs, pinned):
+    allocator = CoreAllocator(CpuTopology.read(sysfs), min_cores=2, enabled=True)
+    leases = [allocator.acquire(f"g{i}") for i in range(5)]
+    # По min_cores ядер каждому: наборы вынужденно пересекаются, но все ядра заняты
+    assert all(len(lease.cores) == 2 for lease in leases)
+    assert set().union(*(lease.cpus for lease in leases)) == set(range(16))
+
+
+def test_server_sets_stay_fixed(sysfs, pinned):
+    allocator = CoreAllocator(CpuTopology.read(sysfs), enabled=True)
+    server = allocator.acquire("llama-server:a", fixed=True, cores=4)
+    allocator.attach(server, 1)
+    assert server.cpus == [0, 1, 2, 3, 8, 9, 10, 11]
+
+    # Запуски llama-cli делят ядра, не занятые воркером, и не меняют его маску
+    cli = [allocator.acquire(f"llama-cli:{i}") for i in range(2)]
+    assert [lease.cpus for lease in cli] == [[4, 5, 12, 13], [6, 7, 14, 15]]
+    allocator.release(cli[0])
+    assert cli[1].cpus == [4, 5, 6, 7, 12, 13, 14, 15]
+
+    # Второй воркер без заданного размера получает свободные ядра, первый не сужается
+    other = allocator.acquire("llama-server:b", fixed=True)
+    assert other.cpus == [4, 5, 6, 7, 12, 13, 14, 15]
+    assert server.threads == 4 and pinned[1] == [0, 1, 2, 3, 8, 9, 10, 11]
+    # Свободных ядер нет — третий воркер делит наименее занятые, по равной доле
+    third = allocator.acquire("llama-server:c", fixed=True)
+    assert len(third.cores) == 2
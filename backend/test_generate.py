@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import pytest
+from controllers import generate
+from history_store import HistoryStore
+from utils import Broadcast
+
+
+@pytest.mark.asyncio
+async def test_cancelled_stream_discards_user_message(client, monkeypatch):
+    store = HistoryStore(client=client, ttl=60)
+    monkeypatch.setattr(generate, "history_store", store)
+    user_message = {"role": "user", "content": "Привет", "timestamp": "2024-01-01T00:00:00"}
+    await store.append("history:alice:s", {"role": "user", "content": "раньше", "timestamp": "2023-12-31T00:00:00"})
+    await store.append("history:alice:s", user_message)
+
+    async def stream_generation(context):
+        yield "Отв"
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(generate, "stream_generation", stream_generation)
+    context = {"history_key": "history:alice:s", "user_message": user_message, "model": "m", "cached_response": None, "ticket": None}
+    stream = Broadcast(generate.stream_events(context))
+
+    # Единственный подписчик ушёл после первого фрагмента — поток отменяется, ответа не будет
+    events = stream.subscribe()
+    assert "Отв" in await events.__anext__()
+    await events.aclose()
+    await asyncio.gather(stream.task, return_exceptions=True)
+    assert [m["content"] for m in await store.recent("history:alice:s", 10)] == ["раньше"]
+
+
+@pytest.mark.asyncio
+async def test_long_texts_are_tokenized_off_loop(monkeypatch):
+    threads = []
+
+    class Tokenizer:
+        def count(self, text, add_bos=False):
+            threads.append(threading.current_thread() is threading.main_thread())
+            return len(text.split()) + int(add_bos)
+
+    tokenizer = Tokenizer()
+    monkeypatch.setattr(generate.settings, "tokenize_inline_chars", 10)
+    assert await generate.tokenize_count(tokenizer, "a b") == 2
+    assert await generate.tokenize_count(tokenizer, "слово " * 10) == 10
+    assert threads == [True, False]
+
+    # Системный prompt считается для словаря один раз
+    first = await generate.count_header_tokens(tokenizer, generate.SYSTEM_PROMPT)
+    assert await generate.count_header_tokens(tokenizer, generate.SYSTEM_PROMPT) == first
+    assert len(threads) == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("server, kept", [("/llama.cpp/llama-server", ["раньше", "ответ 1", "Привет", "ответ 2"]),
+                                          (None, ["раньше", "Привет", "ответ 2"])])
+async def test_previous_answers_are_kept_for_kv_reuse(client, monkeypatch, server, kept):
+    store = HistoryStore(client=client, ttl=60)
+    monkeypatch.setattr(generate, "history_store", store)
+    monkeypatch.setattr(generate, "find_server_executable", lambda: server)
+    for i, (role, content) in enumerate([("user", "раньше"), ("assistant", "ответ 1"), ("user", "Привет")]):
+        await store.append("history:alice:s", {"role": role, "content": content, "timestamp": f"2024-01-01T00:00:0{i}"})
+
+    # С llama-server ответ остаётся в истории: prompt следующего хода продолжает prompt этого вместе с ответом
+    context = {"session_id": "s", "history_key": "history:alice:s", "model": "m", "model_config": {"name": "m"}, "params": {},
+               "cache_key": None, "cached_response": None, "timings": {"generated_tokens": 2}}
+    await generate.finish_generation(context, "ответ 2")
+    assert [m["content"] for m in await store.recent("history:alice:s", 10)] == kept
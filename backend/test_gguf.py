@@ -0,0 +1,100 @@
+import struct
+import pytest
+from gguf_reader import GGUFReader, GGUFError, describe_model
+from gguf_tokenizer import GGUFTokenizer
+
+
+def _string(value: str) -> bytes:
+    data = value.encode("utf-8")
+    return struct.pack("<Q", len(data)) + data
+
+
+def _kv(key: str, value_type: int, payload: bytes) -> bytes:
+    return _string(key) + struct.pack("<I", value_type) + payload
+
+
+def write_gguf(path, kvs, tensors=()):
+    body = b"".join(kvs)
+    for name, dims in tensors:
+        body += _string(name) + struct.pack("<I", len(dims))
+        body += b"".join(struct.pack("<Q", d) for d in dims)
+        body += struct.pack("<IQ", 0, 0)
+    header = b"GGUF" + struct.pack("<IQQ", 3, len(tensors), len(kvs))
+    path.write_bytes(header + body)
+
+
+def test_describe_model(tmp_path):
+    path = tmp_path / "tiny.gguf"
+    tokens = [_string(t) for t in ("<s>", "</s>", "▁привет")]
+    write_gguf(path, [
+        _kv("general.architecture", 8, _string("llama")),
+        _kv("general.file_type", 4, struct.pack("<I", 15)),
+        _kv("llama.context_length", 4, struct.pack("<I", 4096)),
+        _kv("llama.block_count", 4, struct.pack("<I", 32)),
+        _kv("tokenizer.ggml.model", 8, _string("llama")),
+        _kv("tokenizer.ggml.tokens", 9, struct.pack("<IQ", 8, len(tokens)) + b"".join(tokens)),
+        _kv("tokenizer.chat_template", 8, _string("{{ messages }}")),
+    ], tensors=[("token_embd.weight", (4096, 32000)), ("output_norm.weight", (4096,))])
+
+    info = describe_model(str(path))
+    assert info["architecture"] == "llama"
+    assert info["context_length"] == 4096
+    assert info["quantization"] == "Q4_K_M"
+    assert info["tokenizer"] == "llama"
+    assert info["chat_template"] == "{{ messages }}"
+    assert info["parameter_count"] == 4096 * 32000 + 4096
+    assert info["parameters"] == "131M"
+
+
+def test_arrays_are_loaded_on_request(tmp_path):
+    path = tmp_path / "vocab.gguf"
+    tokens = [_string(t) for t in ("a", "б")]
+    write_gguf(path, [
+        _kv("tokenizer.ggml.tokens", 9, struct.pack("<IQ", 8, 2) + b"".join(tokens)),
+        _kv("tokenizer.ggml.scores", 9, struct.pack("<IQ", 6, 2) + struct.pack("<ff", 0.5, -1.0)),
+    ])
+    with GGUFReader(str(path)) as reader:
+        meta = reader.metadata(arrays=["tokenizer.ggml.tokens"])
+    assert meta["tokenizer.ggml.tokens"] == ["a", "б"]
+    # Незапрошенный массив пропускается, вместо него — длина
+    assert meta["tokenizer.ggml.scores"] == 2
+
+
+def test_not_gguf(tmp_path):
+    path = tmp_path / "broken.gguf"
+    path.write_bytes(b"NOPE" + b"\0" * 32)
+    with pytest.raises(GGUFError):
+        describe_model(str(path))
+
+
+def test_spm_tokenizer_counts_merges_and_byte_fallback():
+    tokens = ["<unk>", "<s>", "</s>", "<|user|>", "▁", "п", "р", "и", "в", "е", "т",
+              "▁п", "ри", "▁при", "ве", "вет", "▁привет", "<0x21>"]
+    scores = [0.0] * len(tokens)
+    for token, score in (("▁п", -1.0), ("ри", -2.0), ("▁при", -3.0), ("ве", -4.0), ("вет", -5.0), ("▁привет", -6.0)):
+        scores[tokens.index(token)] = score
+    token_type = [1] * len(tokens)
+    token_type[tokens.index("<|user|>")] = 4
+    tokenizer = GGUFTokenizer({
+        "tokenizer.ggml.model": "llama",
+        "tokenizer.ggml.tokens": tokens,
+        "tokenizer.ggml.scores": scores,
+        "tokenizer.ggml.token_type": token_type,
+    })
+    assert tokenizer.count("привет") == 1
+    # "!" нет в словаре — один байтовый токен
+    assert tokenizer.count("привет!") == 2
+    assert tokenizer.count("<|user|>привет") == 2
+    assert tokenizer.count("привет", add_bos=True) == 2
+
+
+def test_bpe_tokenizer_applies_merges_by_rank():
+    letters = ["h", "e", "l", "o", "Ġ"]
+    tokenizer = GGUFTokenizer({
+        "tokenizer.ggml.model": "gpt2",
+        "tokenizer.ggml.tokens": letters + ["he", "ll", "hell", "hello"],
+        "tokenizer.ggml.merges": ["h e", "l l", "he ll", "hell o"],
+    })
+    assert tokenizer.count("hello") == 1
+    # Пробел кодируется как Ġ и не сливается со словом
+    assert tokenizer.count("hello hello") == 3
@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+from passlib.context import CryptContext
+from hashing import PasswordHasher
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(schemes=["argon2"], workers=2, max_pending=8)
+    hasher.context.update(argon2__time_cost=1, argon2__memory_cost=1024, argon2__parallelism=1)
+    yield hasher
+    hasher.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_hash_and_verify_off_loop(hasher):
+    hashed = await hasher.hash("secret")
+    assert await hasher.verify("secret", hashed)
+    assert not await hasher.verify("wrong", hashed)
+    assert not await hasher.verify("secret", None)
+    assert not await hasher.verify("secret", "garbage")
+    assert hasher.stats()["latency"]["hash"]["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_rehash_when_cost_changes(hasher):
+    old = CryptContext(schemes=["argon2"], argon2__time_cost=2, argon2__memory_cost=1024, argon2__parallelism=1)
+    valid, new_hash = await hasher.verify_and_update("secret", old.hash("secret"))
+    assert valid and new_hash is not None
+    assert await hasher.verify_and_update("secret", new_hash) == (True, None)
+    assert hasher.stats()["rehashed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_pending_limit(hasher):
+    hasher.max_pending = 1
+    results = await asyncio.gather(hasher.hash("a"), hasher.hash("b"), return_exceptions=True)
+    assert sum(isinstance(result, Exception) for result in results) == 1
+    assert hasher.stats()["rejected"] == 1
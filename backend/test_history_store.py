@@ -0,0 +1,93 @@
+import pytest
+from history_store import HistoryStore
+
+
+def render(msg):
+    return f"<|{msg['role']}|>{msg['content']}\n"
+
+
+@pytest.fixture
+def store(client):
+    return HistoryStore(client=client, ttl=60)
+
+
+@pytest.mark.asyncio
+async def test_load_extends_cached_prompt(store):
+    await store.append("history:u:s", {"role": "user", "content": "a"})
+    entry = await store.load("history:u:s", render)
+    assert entry.text == "<|user|>a\n"
+
+    await store.append("history:u:s", {"role": "assistant", "content": "b"})
+    entry = await store.load("history:u:s", render)
+    assert entry.text == "<|user|>a\n<|assistant|>b\n"
+    assert [m["content"] for m in entry.messages] == ["a", "b"]
+    assert [m["content"] for m in await store.recent("history:u:s", 1)] == ["b"]
+
+
+@pytest.mark.asyncio
+async def test_remove_role_keeps_cache_consistent(store):
+    for role, content in (("user", "a"), ("assistant", "b"), ("user", "c")):
+        await store.append("history:u:s", {"role": role, "content": content})
+    await store.load("history:u:s", render)
+
+    await store.remove_role("history:u:s", "assistant")
+    entry = await store.load("history:u:s", render)
+    assert entry.text == "<|user|>a\n<|user|>c\n"
+
+
+@pytest.mark.asyncio
+async def test_delete_clears_history(store):
+    await store.append("history:u:s", {"role": "user", "content": "a"})
+    await store.load("history:u:s", render)
+    await store.delete("history:u:s")
+    entry = await store.load("history:u:s", render)
+    assert entry.messages == []
+
+
+@pytest.mark.asyncio
+async def test_summary_is_deleted_with_history(store):
+    await store.set_summary("history:u:s", "кратко", "2024-01-01T00:00:00")
+    assert await store.get_summary("history:u:s") == {"text": "кратко", "until": "2024-01-01T00:00:00"}
+    await store.delete("history:u:s")
+    assert await store.get_summary("history:u:s") is None
+
+
+@pytest.mark.asyncio
+async def test_changes_from_other_process_rebuild_cache(store):
+    other = HistoryStore(client=store.client, ttl=60)
+    for role, content in (("user", "u1"), ("assistant", "a1"), ("user", "u2"), ("assistant", "a2")):
+        await store.append("history:u:s", {"role": role, "content": content})
+    await other.load("history:u:s", render)
+
+    # Другой процесс не видит удаления из середины по длине списка: [u1, u2, a2, u3]
+    await store.discard("history:u:s", {"role": "assistant", "content": "a1"})
+    await store.append("history:u:s", {"role": "user", "content": "u3"})
+    entry = await other.load("history:u:s", render)
+    assert [m["content"] for m in entry.messages] == ["u1", "u2", "a2", "u3"]
+
+    await store.remove_role("history:u:s", "assistant")
+    await store.append("history:u:s", {"role": "assistant", "content": "a3"})
+    entry = await other.load("history:u:s", render)
+    assert [m["content"] for m in entry.messages] == ["u1", "u2", "u3", "a3"]
+
+    # Пересозданная история той же длины не принимается за продолжение старой
+    await store.delete("history:u:s")
+    for content in ("x1", "x2", "x3", "x4", "x5"):
+        await store.append("history:u:s", {"role": "user", "content": content})
+    entry = await other.load("history:u:s", render)
+    assert [m["content"] for m in entry.messages] == ["x1", "x2", "x3", "x4", "x5"]
+
+
+@pytest.mark.asyncio
+async def test_append_once_skips_retried_request(store):
+    message = {"role": "user", "content": "a", "timestamp": "2024-01-01T00:00:00"}
+    saved = await store.append_once("history:u:s", message, "job1")
+    retried = await store.append_once("history:u:s", {**message, "timestamp": "2024-01-01T00:01:00"}, "job1")
+    assert retried == saved and saved["request_id"] == "job1"
+    assert [m["content"] for m in await store.recent("history:u:s", 10)] == ["a"]
+
+    # Убранное из истории (отказ планировщика) сообщение при повторе добавляется снова
+    await store.discard("history:u:s", saved)
+    await store.append_once("history:u:s", message, "job1")
+    entry = await store.load("history:u:s", render)
+    assert [m["content"] for m in entry.messages] == ["a"]
@@ -0,0 +1,114 @@
+import asyncio
+from fastapi import HTTPException
+import pytest
+from jobs import JobQueue
+from job_worker import JobWorker, parse_sse
+
+USER = {"username": "alice", "role": "user"}
+
+
+@pytest.mark.asyncio
+async def test_job_lifecycle_with_long_poll(client):
+    queue = JobQueue(client)
+    created = await queue.enqueue({"text": "Привет", "model": "m"}, USER)
+    job_id = created["job_id"]
+    assert (await queue.get(job_id))["status"] == "queued"
+    assert await queue.get(job_id, "bob") is None
+
+    [(entry_id, claimed_id)] = await queue.claim("w1", 10, block_ms=100)
+    assert claimed_id == job_id
+    job = await queue.start(entry_id, job_id, "w1")
+    assert job == {"prompt": {"text": "Привет", "model": "m"}, "user": USER}
+
+    # Long-poll просыпается, как только воркер записал результат
+    waiter = asyncio.create_task(queue.wait(job_id, "alice", timeout=5))
+    await asyncio.sleep(0.1)
+    assert not waiter.done()
+    await queue.complete(entry_id, job_id, {"response": "Ответ"})
+    done = await asyncio.wait_for(waiter, 1)
+    assert done["status"] == "done" and done["result"] == {"response": "Ответ"}
+
+    stats = await queue.stats()
+    assert stats["pending"] == 0 and stats["stream_length"] == 0
+
+
+@pytest.mark.asyncio
+async def test_abandoned_job_is_reclaimed_then_dead_lettered(client):
+    queue = JobQueue(client, max_attempts=2, claim_idle_ms=0)
+    job_id = (await queue.enqueue({"text": "x"}, USER))["job_id"]
+
+    # Воркер взял задание и упал, не подтвердив его — задание забирает другой воркер
+    [(entry_id, _)] = await queue.claim("w1", 1, block_ms=100)
+    assert await queue.start(entry_id, job_id, "w1") is not None
+    [(reclaimed, _)] = await queue.claim("w2", 1, block_ms=100)
+    assert reclaimed == entry_id
+    assert await queue.start(entry_id, job_id, "w2") is not None
+
+    # Попытки исчерпаны — задание в dead-letter
+    [(entry_id, _)] = await queue.claim("w3", 1, block_ms=100)
+    assert await queue.start(entry_id, job_id, "w3") is None
+    job = await queue.get(job_id)
+    assert job["status"] == "failed" and job["attempts"] == 3
+    assert (await queue.stats())["dead_letter"] == 1
+    assert await queue.claim("w3", 1, block_ms=100) == []
+
+
+@pytest.mark.asyncio
+async def test_worker_publishes_tokens_and_retries_on_error(client, monkeypatch):
+    queue = JobQueue(client, claim_idle_ms=0)
+    worker = JobWorker(queue, consumer="w1")
+    job_id = (await queue.enqueue({"text": "x"}, USER))["job_id"]
+    events = await queue.events(job_id, "alice")
+
+    calls = []
+
+    async def stream(prompt, current_user):
+        calls.append(prompt)
+        if len(calls) == 1:
+            raise RuntimeError("воркер llama-server упал")
+
+        async def generate():
+            yield 'data: {"token": "Отв"}\n\n'
+            yield 'data: {"token": "ет"}\n\n'
+            yield 'event: done\ndata: {"response": "Ответ"}\n\n'
+        return generate()
+
+    monkeypatch.setattr("job_worker.generate_text_stream", stream)
+    [(entry_id, _)] = await queue.claim("w1", 1, block_ms=100)
+    await worker.process(entry_id, job_id)
+    assert (await queue.get(job_id))["status"] == "queued" and worker.retried == 1
+
+    [(entry_id, _)] = await queue.claim("w1", 1, block_ms=100)
+    await worker.process(entry_id, job_id)
+    assert (await queue.get(job_id))["result"] == {"response": "Ответ"}
+    # Повторная попытка выполняется с тем же id задания, чтобы не дублировать сообщение в истории
+    assert [prompt["job_id"] for prompt in calls] == [job_id, job_id]
+
+    received = [parse_sse(event) async for event in events]
+    assert ("status", {"status": "queued"}) in received
+    assert [data["token"] for name, data in received if name is None] == ["Отв", "ет"]
+    assert received[-1] == ("done", {"response": "Ответ"})
+
+
+@pytest.mark.asyncio
+async def test_scheduler_rejection_does_not_use_attempts(client, monkeypatch):
+    queue = JobQueue(client, max_attempts=1)
+    worker = JobWorker(queue, consumer="w1")
+    job_id = (await queue.enqueue({"text": "x"}, USER))["job_id"]
+    calls = []
+
+    async def stream(prompt, current_user):
+        calls.append(prompt)
+        if len(calls) < 3:
+            raise HTTPException(status_code=429, detail="Очередь занята", headers={"Retry-After": "0"})
+
+        async def generate():
+            yield 'event: done\ndata: {"response": "Ответ"}\n\n'
+        return generate()
+
+    monkeypatch.setattr("job_worker.generate_text_stream", stream)
+    [(entry_id, _)] = await queue.claim("w1", 1, block_ms=100)
+    await worker.process(entry_id, job_id)
+    job = await queue.get(job_id)
+    assert job["status"] == "done" and job["attempts"] == 1
+    assert worker.deferred == 2 and worker.retried == 0
@@ -0,0 +1,61 @@
+import os
+import time
+import asyncio
+import pytest
+from llama_workers import LlamaWorker, build_server_command
+from model_registry import slot_layout
+from prompt_cache import prompt_cache
+from settings import settings
+
+STUB_SERVER = os.path.join(os.path.dirname(__file__), "benchmarks", "stubs", "llama-server")
+
+
+def test_slot_layout(monkeypatch):
+    monkeypatch.setattr(settings, "worker_slots", 4)
+    monkeypatch.setattr(settings, "worker_slot_ctx", 0)
+    monkeypatch.setattr(settings, "worker_model_slots", {"big": 1})
+    monkeypatch.setattr(settings, "worker_model_slot_ctx", {"long": 16384})
+    # Каждый слот получает весь контекст модели
+    assert slot_layout("m", 8192) == (4, 8192)
+    assert slot_layout("big", 8192) == (1, 8192)
+    # Контекст слота не больше контекста модели
+    assert slot_layout("long", 8192) == (4, 8192)
+    monkeypatch.setattr(settings, "worker_slot_ctx", 2048)
+    assert slot_layout("m", 8192) == (4, 2048)
+
+    command = build_server_command("llama-server", {"path": "m.gguf", "n_slots": 4, "slot_ctx": 2048}, 8080)
+    assert command[command.index("-c") + 1] == "8192"
+    assert command[command.index("-np") + 1] == "4"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(prompt_cache, "root_dir", str(tmp_path))
+    monkeypatch.setattr(prompt_cache, "cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setenv("FAKE_LLAMA_LOAD_MS", "0")
+    monkeypatch.setenv("FAKE_LLAMA_GEN_TPS", "100")
+    monkeypatch.setenv("FAKE_LLAMA_MAX_TOKENS", "20")
+
+    config = {"name": "m", "path": str(tmp_path / "m.gguf"), "size": 1.0, "n_slots": 4, "slot_ctx": 512}
+    worker = LlamaWorker("m", config, STUB_SERVER)
+    await worker.start()
+    try:
+        started = time.perf_counter()
+        await worker.complete("x", {"n_tokens": 20}, session="s0")
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker.complete("x", {"n_tokens": 20}, session=f"s{i}") for i in range(4)))
+        batched = time.perf_counter() - started
+        # Четыре запроса декодируются одним батчем, а не по очереди
+        assert batched < single * 2.5
+        assert set(worker.slot_sessions.values()) == {"s0", "s1", "s2", "s3"}
+        assert worker.busy_slots() == 0
+
+        # Сессия возвращается в слот со своим KV-кэшем
+        slot = next(slot_id for slot_id, session in worker.slot_sessions.items() if session == "s2")
+        await worker.complete("x", {"n_tokens": 1}, session="s2")
+        assert worker.slot_sessions[slot] == "s2"
+    finally:
+        await worker.stop()
+
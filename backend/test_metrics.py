@@ -0,0 +1,34 @@
+import pytest
+import redis.asyncio as redis
+import metrics
+
+
+def sample(name, **labels):
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.mark.asyncio
+async def test_request_metrics_are_labeled_by_model():
+    client = redis.from_url("redis://redis:6379/0", decode_responses=True)
+    metrics.instrument_redis(client)
+    before = sample("llm_stage_seconds_count", stage="history_load", model="test-model")
+    roundtrips = sample("llm_redis_roundtrips_sum", model="test-model")
+
+    async def app(scope, receive, send):
+        with metrics.stage("history_load"):
+            await client.ping()
+            pipeline = client.pipeline()
+            pipeline.ping()
+            pipeline.ping()
+            await pipeline.execute()
+        metrics.set_model("test-model")
+        metrics.observe_timings("test-model", {"prompt_ms": 10.0, "generation_ms": 20.0, "prompt_tokens": 3, "generated_tokens": 4})
+
+    await metrics.MetricsMiddleware(app)({"type": "http"}, None, None)
+    await client.aclose()
+
+    assert sample("llm_stage_seconds_count", stage="history_load", model="test-model") == before + 1
+    assert sample("llm_stage_seconds_count", stage="decode", model="test-model") >= 1
+    assert sample("llm_redis_roundtrips_sum", model="test-model") == roundtrips + 2
+    body, content_type = metrics.render()
+    assert b"llm_tokens_total" in body and content_type.startswith("text/plain")
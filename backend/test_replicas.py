@@ -0,0 +1,88 @@
+import json
+import pytest
+import httpx
+from fastapi import FastAPI, Request
+
+from replicas import HashRing, ReplicaRegistry, AffinityRouter
+from security import create_access_token
+
+
+def replica(load=0, capacity=8, models=()):
+    return {"url": "http://replica", "models": list(models), "load": load, "capacity": capacity}
+
+
+def test_ring_moves_only_keys_of_new_replica():
+    keys = [f"history:user{i}:s|m" for i in range(2000)]
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+    moved = [key for key in keys if before.preference(key)[0] != after.preference(key)[0]]
+
+    # Переезжают только ключи, доставшиеся новой реплике, — около четверти
+    assert all(after.preference(key)[0] == "d" for key in moved)
+    assert 0.15 < len(moved) / len(keys) < 0.35
+    assert sorted(after.preference(keys[0])) == ["a", "b", "c", "d"]
+
+
+def test_overloaded_owner_falls_back_to_warm_replica():
+    registry = ReplicaRegistry(replica_id="self", overload_ratio=1.0)
+    registry._update({"a": replica(), "b": replica(), "c": replica()})
+    key = "history:alice:s"
+    owner, second, third = registry.ring.preference(f"{key}|m")
+    assert registry.route(key, "m") == owner
+
+    registry.replicas[owner]["load"] = 8
+    assert registry.route(key, "m") == second
+    registry.replicas[third]["models"] = ["m"]
+    assert registry.route(key, "m") == third
+
+    # Перегружены все — запрос остаётся у владельца
+    for state in registry.replicas.values():
+        state["load"] = 8
+    assert registry.route(key, "m") == owner
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_registers_and_stop_deregisters(client):
+    a = ReplicaRegistry(client, replica_id="a", url="http://a:5555")
+    b = ReplicaRegistry(client, replica_id="b", url="http://b:5555")
+    await a.heartbeat()
+    await b.heartbeat()
+    await a.heartbeat()
+    assert set(a.replicas) == {"a", "b"} and a.replicas["b"]["url"] == "http://b:5555"
+
+    await b.stop()
+    await a.heartbeat()
+    assert set(a.replicas) == {"a"} and a.ring.replica_ids == ["a"]
+
+
+@pytest.mark.asyncio
+async def test_router_proxies_session_to_owner():
+    def backend(name):
+        api = FastAPI()
+
+        @api.post("/api/generate")
+        async def generate(request: Request):
+            return {"replica": name, "routed_by": request.headers.get("x-replica-routed"), "prompt": await request.json()}
+        return api
+
+    remote = backend("b")
+    local = ReplicaRegistry(replica_id="a", url="http://a")
+    local._update({"a": {**replica(), "url": "http://a"}, "b": {**replica(), "url": "http://b"}})
+    local.http = httpx.AsyncClient(transport=httpx.ASGITransport(app=remote))
+    router = AffinityRouter(backend("a"), local)
+
+    token = create_access_token({"sub": "alice"})
+    sessions = {}
+    for i in range(20):
+        sessions.setdefault(local.route(f"history:alice:s{i}", "m"), f"s{i}")
+    assert set(sessions) == {"a", "b"}
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=router), base_url="http://a") as http:
+        for name, session_id in sessions.items():
+            prompt = {"text": "Привет", "model": "m", "session_id": session_id}
+            response = await http.post("/api/generate", content=json.dumps(prompt), headers={"Authorization": f"Bearer {token}"})
+            body = response.json()
+            assert body["replica"] == name and body["prompt"] == prompt
+            assert body["routed_by"] == ("a" if name == "b" else None)
+    assert local.routed["remote"] == 1 and local.routed["local"] == 1
+    await local.http.aclose()
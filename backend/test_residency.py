@@ -0,0 +1,76 @@
+import os
+import pytest
+import llama_workers
+from llama_workers import LlamaWorkerPool
+from prompt_cache import prompt_cache
+from residency import estimate_footprint_mb
+from scheduler import GenerationScheduler
+from settings import settings
+
+STUBS_DIR = os.path.join(os.path.dirname(__file__), "benchmarks", "stubs")
+
+
+def test_estimate_footprint():
+    config = {
+        "size": 4000.0,
+        "max_ctx": 4096,
+        "block_count": 32,
+        "embedding_length": 4096,
+        "head_count": 32,
+        "head_count_kv": 8,
+    }
+    # KV: 2 × 32 слоя × 4096 токенов × (128 × 8) × 2 байта = 512 МБ
+    assert estimate_footprint_mb(config) == 4000 + 512 + settings.model_overhead_mb
+    assert estimate_footprint_mb({"size": 100.0}) == 100 + settings.model_overhead_mb
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction_within_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(llama_workers, "find_server_executable", lambda: os.path.join(STUBS_DIR, "llama-server"))
+    monkeypatch.setattr(prompt_cache, "root_dir", str(tmp_path))
+    monkeypatch.setattr(prompt_cache, "cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setenv("FAKE_LLAMA_LOAD_MS", "0")
+    monkeypatch.setenv("FAKE_LLAMA_GEN_TPS", "10000")
+
+    footprint = 100 + settings.model_overhead_mb
+    pool = LlamaWorkerPool(budget_mb=footprint * 2)
+    configs = {name: {"name": name, "path": str(tmp_path / f"{name}.gguf"), "size": 100.0} for name in ("a", "b", "c")}
+    try:
+        await pool.preload({"a": configs["a"], "b": configs["b"], "c": configs["c"]})
+        # Третья модель не помещается — предзагрузка её пропускает, не вытесняя прогретые
+        assert set(pool.workers) == {"a", "b"}
+
+        await (await pool.get_worker("a", configs["a"])).complete("x", {"n_tokens": 1})
+        await pool.get_worker("c", configs["c"])
+        # Вытеснена давно не использовавшаяся b
+        assert set(pool.workers) == {"a", "c"}
+        stats = pool.stats()
+        assert stats["evictions"] == {"b": 1}
+        assert stats["loads"] == {"a": 1, "b": 1, "c": 1}
+        assert stats["models"]["a"]["rss_mb"] > 0
+    finally:
+        await pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_preload_warmup_goes_through_scheduler(tmp_path, monkeypatch):
+    monkeypatch.setattr(llama_workers, "find_server_executable", lambda: os.path.join(STUBS_DIR, "llama-server"))
+    monkeypatch.setattr(prompt_cache, "root_dir", str(tmp_path))
+    monkeypatch.setattr(prompt_cache, "cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setenv("FAKE_LLAMA_LOAD_MS", "0")
+    scheduler = GenerationScheduler(global_limit=1)
+    monkeypatch.setattr(llama_workers, "scheduler", scheduler)
+
+    pool = LlamaWorkerPool(budget_mb=10000)
+    configs = {name: {"name": name, "path": str(tmp_path / f"{name}.gguf"), "size": 100.0} for name in ("a", "b")}
+    try:
+        await pool.preload({"a": configs["a"]})
+        assert scheduler.stats()["admitted"] == 1 and scheduler.stats()["active"] == 0
+
+        # Все места заняты генерациями — модель загружается, но прогрев не отнимает слот
+        running = await scheduler.acquire("x", "alice", 10)
+        await pool.preload({"b": configs["b"]})
+        assert set(pool.workers) == {"a", "b"} and scheduler.stats()["admitted"] == 2
+        scheduler.release(running)
+    finally:
+        await pool.shutdown()
@@ -0,0 +1,37 @@
+import pytest
+from response_cache import ResponseCache
+
+
+def test_applies_and_key():
+    assert ResponseCache.applies({"seed": 1, "temperature": 0})
+    assert not ResponseCache.applies({"seed": 1, "temperature": 0.7})
+    assert not ResponseCache.applies({"seed": -1, "temperature": 0})
+    assert not ResponseCache.applies({"temperature": 0})
+    assert ResponseCache.applies({"temperature": 0.7}, flag=True)
+    assert not ResponseCache.applies({"seed": 1, "temperature": 0}, flag=False)
+
+    config = {"modified": 1.0}
+    params = {"seed": 1, "temperature": 0}
+    key = ResponseCache.key("m", config, "prompt", params)
+    assert key == ResponseCache.key("m", config, "prompt", dict(reversed(list(params.items()))))
+    assert key != ResponseCache.key("m", {"modified": 2.0}, "prompt", params)
+    assert key != ResponseCache.key("m", config, "prompt!", params)
+
+
+@pytest.mark.asyncio
+async def test_put_get_and_eviction(client):
+    cache = ResponseCache(client=client, ttl=60, max_entries=2, max_bytes=16)
+    assert await cache.get("response_cache:a") is None
+
+    await cache.put("response_cache:a", "A")
+    await cache.put("response_cache:b", "B")
+    await cache.put("response_cache:c", "C")
+    await cache.put("response_cache:big", "x" * 17)
+
+    assert await cache.get("response_cache:a") is None
+    assert await cache.get("response_cache:b") == "B"
+    assert await cache.get("response_cache:c") == "C"
+    assert await cache.get("response_cache:big") is None
+    assert await client.zcard(ResponseCache.INDEX_KEY) == 2
+    assert 0 < await client.ttl("response_cache:b") <= 60
+    assert cache.stats() == {"hits": 2, "misses": 3, "stored": 3, "evicted": 1}
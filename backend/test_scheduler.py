@@ -0,0 +1,112 @@
+import asyncio
+import pytest
+from fastapi import HTTPException
+from scheduler import GenerationScheduler
+
+
+async def _enqueue(scheduler, model, username, tokens=10):
+    task = asyncio.create_task(scheduler.acquire(model, username, tokens))
+    await asyncio.sleep(0)
+    return task
+
+
+@pytest.mark.asyncio
+async def test_model_limit_queues_extra_requests():
+    scheduler = GenerationScheduler(global_limit=4, model_limit=1)
+    first = await scheduler.acquire("m", "alice", 10)
+    second = await _enqueue(scheduler, "m", "bob")
+    assert not second.done()
+    assert scheduler.stats()["queue_depth"] == 1
+
+    scheduler.release(first)
+    await asyncio.sleep(0)
+    assert second.done()
+    scheduler.release(second.result())
+    assert scheduler.stats()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_round_robin_between_users():
+    scheduler = GenerationScheduler(global_limit=1, model_limit=1)
+    running = await scheduler.acquire("m", "alice", 10)
+    alice = [await _enqueue(scheduler, "m", "alice") for _ in range(3)]
+    bob = await _enqueue(scheduler, "m", "bob")
+
+    scheduler.release(running)
+    await asyncio.sleep(0)
+    assert alice[0].done() and not bob.done()
+
+    scheduler.release(alice[0].result())
+    await asyncio.sleep(0)
+    # Второй запрос alice ждёт, пока обслужат bob
+    assert bob.done() and not alice[1].done()
+
+    for task in alice[1:]:
+        task.cancel()
+    scheduler.release(bob.result())
+
+
+@pytest.mark.asyncio
+async def test_short_lane_goes_first():
+    scheduler = GenerationScheduler(global_limit=1, model_limit=1, short_prompt_tokens=100)
+    running = await scheduler.acquire("m", "alice", 10)
+    long_task = await _enqueue(scheduler, "m", "bob", tokens=5000)
+    short_task = await _enqueue(scheduler, "m", "carol", tokens=20)
+
+    scheduler.release(running)
+    await asyncio.sleep(0)
+    assert short_task.done() and not long_task.done()
+
+    scheduler.release(short_task.result())
+    await asyncio.sleep(0)
+    assert long_task.done()
+    scheduler.release(long_task.result())
+
+
+@pytest.mark.asyncio
+async def test_rejects_with_retry_after_when_queue_full():
+    scheduler = GenerationScheduler(global_limit=1, model_limit=1, max_queue=1)
+    running = await scheduler.acquire("m", "alice", 10)
+    waiting = await _enqueue(scheduler, "m", "bob")
+
+    with pytest.raises(HTTPException) as exc:
+        await scheduler.acquire("m", "carol", 10)
+    assert exc.value.status_code == 429
+    assert int(exc.value.headers["Retry-After"]) >= 1
+    assert scheduler.stats()["rejected"] == 1
+
+    waiting.cancel()
+    await asyncio.sleep(0)
+    assert scheduler.stats()["queue_depth"] == 0
+    scheduler.release(running)
+
+
+@pytest.mark.asyncio
+async def test_failed_enqueue_does_not_leak_slot(monkeypatch):
+    scheduler = GenerationScheduler(global_limit=1, model_limit=1)
+
+    def broken(*labels):
+        raise FileNotFoundError("каталог метрик")
+
+    monkeypatch.setattr("scheduler.metrics.QUEUE_DEPTH.labels", broken)
+    with pytest.raises(FileNotFoundError):
+        await scheduler.acquire("m", "alice", 10)
+    monkeypatch.undo()
+    assert scheduler.stats()["queue_depth"] == 0 and scheduler.stats()["active"] == 0
+
+    ticket = await asyncio.wait_for(scheduler.acquire("m", "alice", 10), 1)
+    scheduler.release(ticket)
+
+
+@pytest.mark.asyncio
+async def test_check_rejects_without_queueing():
+    scheduler = GenerationScheduler(global_limit=1, model_limit=1, max_queue=1)
+    running = await scheduler.acquire("m", "alice", 10)
+    scheduler.check("m", "bob")
+    waiting = await _enqueue(scheduler, "m", "bob")
+    with pytest.raises(HTTPException) as error:
+        scheduler.check("m", "carol")
+    assert error.value.status_code == 429
+    assert scheduler.stats()["queue_depth"] == 1
+    waiting.cancel()
+    scheduler.release(running)
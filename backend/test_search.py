@@ -0,0 +1,70 @@
+import json
+import time
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+from search import WebSearch
+from utils import SingleFlight
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    requests = 0
+
+    def do_GET(self):
+        StubHandler.requests += 1
+        time.sleep(0.1)
+        body = json.dumps({"Abstract": "Ответ из заглушки"}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    StubHandler.requests = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_identical_queries_share_one_upstream_call(stub_url, client):
+    search = WebSearch(url=stub_url, client=client, enabled=True)
+    await search.start()
+    results = await asyncio.gather(*(search.search("Погода  в Москве") for _ in range(5)))
+    assert results == ["Ответ из заглушки"] * 5
+    assert StubHandler.requests == 1
+
+    # Повтор с другим регистром — из кэша процесса, затем из Redis в другом процессе
+    assert await search.search("погода в москве") == "Ответ из заглушки"
+    other = WebSearch(url=stub_url, client=client, enabled=True)
+    assert await other.search("ПОГОДА В МОСКВЕ") == "Ответ из заглушки"
+    assert StubHandler.requests == 1
+    await search.close()
+    await other.close()
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_cancelled_caller():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return 42
+
+    first = asyncio.create_task(flight.do("k", work))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(flight.do("k", work))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == 42
+    assert flight.stats() == {"in_flight": 0, "calls": 1, "shared": 1}
@@ -0,0 +1,59 @@
+import pytest
+from timings import parse_llama_cli, from_server, ThroughputStats
+
+CLI_STDERR = """
+llama_model_loader: loaded meta data with 24 key-value pairs
+llama_perf_sampler_print:    sampling time =      12.10 ms /   169 runs   (    0.07 ms per token, 13966.94 tokens per second)
+llama_perf_context_print:        load time =     812.45 ms
+llama_perf_context_print: prompt eval time =     145.10 ms /    42 tokens (    3.45 ms per token,   289.45 tokens per second)
+llama_perf_context_print:        eval time =    2210.33 ms /   127 runs   (   17.40 ms per token,    57.46 tokens per second)
+llama_perf_context_print:       total time =    2400.00 ms /   169 tokens
+"""
+
+
+def test_parse_llama_cli():
+    timings = parse_llama_cli(CLI_STDERR)
+    assert timings["source"] == "llama-cli"
+    assert timings["load_ms"] == 812.45
+    assert (timings["prompt_tokens"], timings["prompt_ms"]) == (42, 145.1)
+    assert (timings["generated_tokens"], timings["generation_ms"]) == (127, 2210.33)
+    assert timings["prompt_tokens_per_second"] == 289.46
+    assert timings["generation_tokens_per_second"] == 57.46
+
+    old = "llama_print_timings:        eval time =     500.00 ms /    10 runs   (   50.00 ms per token,    20.00 tokens per second)"
+    assert parse_llama_cli(old)["generation_tokens_per_second"] == 20.0
+    assert parse_llama_cli("no timings here") is None
+
+
+def test_from_server():
+    timings = from_server({"prompt_n": 3, "prompt_ms": 10.0, "predicted_n": 4, "predicted_ms": 20.0})
+    assert timings["source"] == "llama-server" and timings["load_ms"] is None
+    assert timings["generation_tokens_per_second"] == 200.0
+    assert from_server(None) is None
+
+
+@pytest.mark.asyncio
+async def test_throughput_stats(client):
+    stats = ThroughputStats(client=client, window=3)
+    for tokens in (10, 20, 30, 40):
+        await stats.record("m", from_server({"prompt_n": tokens, "prompt_ms": 1000.0, "predicted_n": tokens, "predicted_ms": 1000.0}))
+    await stats.record_load("m", 812.5)
+
+    result = (await stats.stats())["m"]
+    assert result["generation_tokens_per_second"] == {"samples": 3, "avg": 30.0, "p50": 30.0, "p95": 40.0}
+    assert result["load_ms"]["samples"] == 1 and result["load_ms"]["p50"] == 812.5
+
+
+def test_benchmark_stub_matches_llama_cli_format():
+    import os
+    import subprocess
+    import sys
+    from controllers.generate import extract_assistant_response
+
+    stub = os.path.join(os.path.dirname(__file__), "benchmarks", "stubs", "llama-cli")
+    env = dict(os.environ, FAKE_LLAMA_LOAD_MS="0", FAKE_LLAMA_GEN_TPS="10000", FAKE_LLAMA_PROMPT_TPS="100000")
+    result = subprocess.run([sys.executable, stub, "-p", "<|user|>Привет", "-n", "3"], capture_output=True, text=True, env=env)
+
+    assert extract_assistant_response(result.stdout, "<|user|>Привет") == "Это тестовый ответ"
+    timings = parse_llama_cli(result.stderr)
+    assert timings["generated_tokens"] == 3 and timings["generation_tokens_per_second"] == 10000.0
@@ -0,0 +1,55 @@
+import asyncio
+import pytest
+import pytest_asyncio
+import redis.asyncio as redis
+from user_cache import UserCache
+
+
+@pytest_asyncio.fixture
+async def caches():
+    clients = [redis.from_url("redis://redis:6379/0", decode_responses=True) for _ in range(2)]
+    caches = [UserCache(client=client, ttl=60, max_entries=2) for client in clients]
+    for cache in caches:
+        cache.start()
+    for _ in range(50):
+        if all(cache.active for cache in caches):
+            break
+        await asyncio.sleep(0.02)
+    yield caches
+    for cache, client in zip(caches, clients):
+        await cache.stop()
+        await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_invalidation_reaches_other_process(caches):
+    first, second = caches
+    second.put_user("bob", {"username": "bob", "role": "user"}, second.generation)
+    assert second.get_user("bob") == {"username": "bob", "role": "user"}
+
+    await first.invalidate("bob")
+    for _ in range(50):
+        if second.get_user("bob") is None:
+            break
+        await asyncio.sleep(0.02)
+    assert second.get_user("bob") is None
+    assert second.stats()["invalidations"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_read_is_not_cached(caches):
+    cache = caches[0]
+    generation = cache.generation
+    cache.forget("bob")  # изменение пользователя во время чтения из Redis
+    cache.put_user("bob", {"username": "bob", "role": "user"}, generation)
+    assert cache.get_user("bob") is None
+
+
+def test_tokens_expire_and_are_bounded():
+    cache = UserCache(client=None, ttl=60, max_entries=2)
+    cache.put_token("expired", "bob", exp=1)
+    assert cache.get_token("expired") is None
+    for token in ("a", "b", "c"):
+        cache.put_token(token, "bob", exp=None)
+    assert cache.get_token("a") is None
+    assert cache.get_token("c") == "bob"
@@ -0,0 +1,43 @@
+import asyncio
+import pytest
+from utils import Broadcast
+
+
+@pytest.mark.asyncio
+async def test_broadcast_replays_to_late_subscriber():
+    async def source():
+        for item in range(3):
+            await asyncio.sleep(0.01)
+            yield item
+
+    broadcast = Broadcast(source())
+
+    async def collect():
+        return [item async for item in broadcast.subscribe()]
+
+    first = asyncio.create_task(collect())
+    await asyncio.sleep(0.015)
+    second = asyncio.create_task(collect())
+    assert await first == [0, 1, 2]
+    assert await second == [0, 1, 2]
+    assert broadcast.done and not broadcast.cancelled
+
+
+@pytest.mark.asyncio
+async def test_broadcast_stops_when_last_subscriber_leaves():
+    closed = asyncio.Event()
+
+    async def source():
+        try:
+            while True:
+                await asyncio.sleep(0.01)
+                yield "x"
+        finally:
+            closed.set()
+
+    broadcast = Broadcast(source())
+    stream = broadcast.subscribe()
+    assert await stream.__anext__() == "x"
+    await stream.aclose()
+    await asyncio.wait_for(closed.wait(), 1)
+    assert broadcast.cancelled and broadcast.subscribers == 0
@@ -0,0 +1,164 @@
+# backend/timings.py
+
+import re
+import logging
+from typing import Dict, Any, List, Optional
+
+from async_eav import eav
+from settings import settings
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Строки замеров llama.cpp в stderr (llama_perf_context_print / llama_print_timings), например:
+#   load time =     812.45 ms
+#   prompt eval time =     145.10 ms /    42 tokens (    3.45 ms per token,   289.45 tokens per second)
+#   eval time =    2210.33 ms /   127 runs   (   17.40 ms per token,    57.46 tokens per second)
+TIMING_RE = re.compile(
+    r"(?P<name>load|prompt eval|eval) time\s*=\s*(?P<ms>[\d.]+) ms"
+    r"(?:\s*/\s*(?P<n>\d+) (?:tokens|runs))?"
+)
+
+# Ряды замеров, хранимые в Redis по каждой модели
+SERIES = ("prompt_tokens_per_second", "generation_tokens_per_second", "load_ms")
+
+
+def _timings(load_ms, prompt_tokens, prompt_ms, generated_tokens, generation_ms, source: str) -> Dict[str, Any]:
+    """
+    Внутренний метод: замеры одной генерации в едином формате ответа API.
+    """
+    def per_second(tokens, ms):
+        return round(tokens * 1000 / ms, 2) if tokens and ms else None
+
+    return {
+        "source": source,
+        "load_ms": round(load_ms, 2) if load_ms is not None else None,
+        "prompt_tokens": prompt_tokens,
+        "prompt_ms": round(prompt_ms, 2) if prompt_ms is not None else None,
+        "prompt_tokens_per_second": per_second(prompt_tokens, prompt_ms),
+        "generated_tokens": generated_tokens,
+        "generation_ms": round(generation_ms, 2) if generation_ms is not None else None,
+        "generation_tokens_per_second": per_second(generated_tokens, generation_ms),
+    }
+
+
+def parse_llama_cli(stderr: str) -> Optional[Dict[str, Any]]:
+    """
+    Разобрать замеры llama-cli из stderr.
+
+    :param stderr: вывод stderr процесса
+    :return: замеры или None, если в выводе их нет
+    """
+    found = {}
+    for match in TIMING_RE.finditer(stderr):
+        # Последний блок замеров — итоговый
+        found[match.group("name")] = (float(match.group("ms")), int(match.group("n")) if match.group("n") else None)
+    if not found:
+        return None
+    load_ms = found.get("load", (None, None))[0]
+    prompt_ms, prompt_tokens = found.get("prompt eval", (None, None))
+    generation_ms, generated_tokens = found.get("eval", (None, None))
+    return _timings(load_ms, prompt_tokens, prompt_ms, generated_tokens, generation_ms, "llama-cli")
+
+
+def from_server(raw: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Привести поле timings ответа llama-server к формату ответа API.
+    Модель воркера уже загружена, поэтому load_ms не заполняется.
+    """
+    if not raw:
+        return None
+    return _timings(
+        None,
+        raw.get("prompt_n"),
+        raw.get("prompt_ms"),
+        raw.get("predicted_n"),
+        raw.get("predicted_ms"),
+        "llama-server",
+    )
+
+
+def _percentile(ordered: List[float], share: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * share))], 2)
+
+
+class ThroughputStats:
+    # Модели, по которым есть замеры
+    MODELS_KEY = "timings:models"
+
+    def __init__(self, client=eav.client, window: int = settings.timings_window):
+        """
+        Скользящая статистика скорости моделей в Redis, общая для всех процессов:
+        последние window замеров скорости prompt eval, генерации и времени загрузки модели.
+
+        :param client: клиент Redis
+        :param window: сколько последних замеров хранить в каждом ряду
+        """
+        self.client = client
+        self.window = window
+
+    @staticmethod
+    def _key(model: str, series: str) -> str:
+        return f"timings:{model}:{series}"
+
+    async def record(self, model: str, timings: Optional[Dict[str, Any]]):
+        """
+        Учесть замеры генерации: метрики Prometheus и ряды в Redis.
+        Ошибка Redis не прерывает генерацию.
+        """
+        if not timings:
+            return
+        metrics.observe_timings(model, timings)
+        await self._push(model, {series: timings.get(series) for series in SERIES})
+
+    async def record_load(self, model: str, load_ms: float):
+        """
+        Учесть время загрузки модели (запуск воркера llama-server).
+        """
+        await self._push(model, {"load_ms": round(load_ms, 2)})
+
+    async def _push(self, model: str, values: Dict[str, Optional[float]]):
+        """
+        Внутренний метод: добавить значения в ряды модели, обрезав их до window.
+        """
+        values = {series: value for series, value in values.items() if value is not None}
+        if not values:
+            return
+        pipeline = self.client.pipeline()
+        pipeline.sadd(self.MODELS_KEY, model)
+        for series, value in values.items():
+            pipeline.lpush(self._key(model, series), value)
+            pipeline.ltrim(self._key(model, series), 0, self.window - 1)
+        try:
+            await pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить замеры модели {model}: {str(e)}")
+
+    async def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Статистика по моделям: число замеров, среднее, p50 и p95 каждого ряда.
+        """
+        models = sorted(await self.client.smembers(self.MODELS_KEY))
+        pipeline = self.client.pipeline()
+        for model in models:
+            for series in SERIES:
+                pipeline.lrange(self._key(model, series), 0, -1)
+        values = iter(await pipeline.execute())
+        result = {}
+        for model in models:
+            result[model] = {}
+            for series in SERIES:
+                ordered = sorted(float(value) for value in next(values))
+                result[model][series] = {
+                    "samples": len(ordered),
+                    "avg": round(sum(ordered) / len(ordered), 2) if ordered else None,
+                    "p50": _percentile(ordered, 0.5),
+                    "p95": _percentile(ordered, 0.95),
+                }
+        return result
+
+
+# Инициализация статистики скорости моделей
+throughput = ThroughputStats()
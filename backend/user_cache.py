@@ -0,0 +1,172 @@
+# backend/user_cache.py
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from async_eav import eav
+from settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class UserCache:
+    # Канал Redis, в который публикуются имена изменённых пользователей
+    CHANNEL = "user:invalidate"
+
+    def __init__(self, client=eav.client, ttl: float = settings.user_cache_ttl, max_entries: int = settings.user_cache_max_entries):
+        """
+        Кэш процесса для аутентификации: разобранные JWT и записи пользователей (имя и роль).
+        Изменения пользователей рассылаются всем процессам через Redis pub/sub;
+        пока подписка не активна, записи пользователей не кэшируются, чтобы не отдать устаревшую роль.
+
+        :param client: клиент Redis
+        :param ttl: время жизни записи в секундах (страховка на случай потерянного сообщения)
+        :param max_entries: максимальное число записей каждого вида (LRU)
+        """
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # token -> (username, момент истечения по time.time())
+        self._tokens: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        # username -> (запись пользователя, момент истечения по time.monotonic())
+        self._users: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        # Номер поколения: увеличивается при каждой инвалидации,
+        # чтобы не положить в кэш запись, прочитанную до изменения
+        self.generation = 0
+        self.active = False
+        self._listener: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_token(self, token: str) -> Optional[str]:
+        """
+        Имя пользователя из ранее проверенного токена или None.
+        """
+        cached = self._tokens.get(token)
+        if cached is None or cached[1] <= time.time():
+            self._tokens.pop(token, None)
+            return None
+        self._tokens.move_to_end(token)
+        return cached[0]
+
+    def put_token(self, token: str, username: str, exp: Optional[float]):
+        """
+        Запомнить проверенный токен до его истечения, но не дольше ttl.
+        """
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        self._tokens[token] = (username, expires_at)
+        self._tokens.move_to_end(token)
+        while len(self._tokens) > self.max_entries:
+            self._tokens.popitem(last=False)
+
+    def get_user(self, username: str) -> Optional[Dict[str, Any]]:
+        """
+        Запись пользователя из кэша или None (промах).
+        """
+        cached = self._users.get(username) if self.active else None
+        if cached is None or cached[1] <= time.monotonic():
+            self._users.pop(username, None)
+            self.misses += 1
+            return None
+        self._users.move_to_end(username)
+        self.hits += 1
+        return cached[0]
+
+    def put_user(self, username: str, user: Dict[str, Any], generation: int):
+        """
+        Запомнить запись пользователя, прочитанную при поколении generation.
+        Если с тех пор была инвалидация, запись могла устареть и не кэшируется.
+        """
+        if not self.active or generation != self.generation:
+            return
+        self._users[username] = (user, time.monotonic() + self.ttl)
+        self._users.move_to_end(username)
+        while len(self._users) > self.max_entries:
+            self._users.popitem(last=False)
+
+    def forget(self, username: str):
+        """
+        Удалить запись пользователя из кэша этого процесса.
+        """
+        self.generation += 1
+        self.invalidations += 1
+        self._users.pop(username, None)
+
+    def clear(self):
+        """
+        Очистить записи пользователей (например, после переподключения к Redis).
+        """
+        self.generation += 1
+        self._users.clear()
+
+    async def invalidate(self, username: str):
+        """
+        Удалить запись пользователя из кэшей всех процессов.
+        """
+        self.forget(username)
+        try:
+            await self.client.publish(self.CHANNEL, username)
+        except Exception as e:
+            logger.error(f"Не удалось разослать инвалидацию пользователя {username}: {str(e)}")
+
+    async def _listen(self):
+        """
+        Внутренний метод: слушать канал инвалидаций, переподключаясь при ошибках.
+        """
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(self.CHANNEL)
+                # Сообщения, пришедшие до подписки, потеряны — начинаем с пустого кэша
+                self.clear()
+                self.active = True
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.forget(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Подписка на инвалидации пользователей прервана: {str(e)}")
+            finally:
+                self.active = False
+                self.clear()
+                await pubsub.aclose()
+            await asyncio.sleep(1)
+
+    def start(self):
+        """
+        Запустить подписку на инвалидации (при старте приложения).
+        """
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "active": self.active,
+            "users": len(self._users),
+            "tokens": len(self._tokens),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+# Инициализация кэша пользователей
+user_cache = UserCache()
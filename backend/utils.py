@@ -1,4 +1,114 @@
 # backend/utils.py
 
+import asyncio
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, Hashable, List, TypeVar
+
+T = TypeVar("T")
+
+
 def health():
     return {"status": "ok"}
+
+
+class SingleFlight:
+    def __init__(self):
+        """
+        Объединение одинаковых одновременных вызовов: пока вызов с ключом выполняется,
+        повторные вызовы с тем же ключом ждут его результат, а не запускают работу заново.
+        Вызов выполняется отдельной задачей, поэтому отмена одного из ожидающих
+        (например, клиент закрыл соединение) не прерывает его для остальных.
+        """
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Выполнить func или присоединиться к уже выполняющемуся вызову с тем же ключом.
+
+        :param key: ключ вызова
+        :param func: асинхронная функция без аргументов
+        :return: результат вызова (исключение передаётся всем ожидающим)
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        """
+        Внутренний метод: убрать завершённый вызов.
+        """
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"in_flight": len(self._calls), "calls": self.calls, "shared": self.shared}
+
+
+class Broadcast:
+    def __init__(self, source: AsyncIterator[T]):
+        """
+        Раздача одного асинхронного потока нескольким подписчикам.
+        Поток читается отдельной задачей в буфер, каждый подписчик получает все элементы с начала,
+        даже если подключился позже. Когда уходит последний подписчик, чтение потока прекращается.
+
+        :param source: асинхронный поток (например, события SSE генерации)
+        """
+        self._source = source
+        self._items: List[T] = []
+        self._event = asyncio.Event()
+        self.done = False
+        self.cancelled = False
+        self.subscribers = 0
+        self.task = asyncio.ensure_future(self._pump())
+
+    async def _pump(self):
+        """
+        Внутренний метод: читать поток в буфер и будить подписчиков.
+        """
+        try:
+            async for item in self._source:
+                self._items.append(item)
+                self._notify()
+        finally:
+            self.done = True
+            self._notify()
+            aclose = getattr(self._source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def _notify(self):
+        """
+        Внутренний метод: разбудить ожидающих подписчиков.
+        """
+        self._event.set()
+        self._event = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[T]:
+        """
+        Получить все элементы потока с начала и дождаться остальных.
+        """
+        self.subscribers += 1
+        position = 0
+        try:
+            while True:
+                while position < len(self._items):
+                    yield self._items[position]
+                    position += 1
+                if self.done:
+                    return
+                await self._event.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                self.cancelled = True
+                self.task.cancel()